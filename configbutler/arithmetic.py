@@ -0,0 +1,119 @@
+import ast
+import math
+import operator
+import threading
+
+MAX_EXPONENT = 100
+MAX_CACHED = 1024
+
+
+class ArithmeticExpressionError(ValueError):
+
+    def __init__(self, message):
+        super(ArithmeticExpressionError, self).__init__(message)
+
+
+def _power(base, exponent):
+    # Keeps a single expression from building numbers large enough to stall the run.
+    if abs(exponent) > MAX_EXPONENT:
+        raise ArithmeticExpressionError("Exponent {} is larger than {}".format(exponent, MAX_EXPONENT))
+    return operator.pow(base, exponent)
+
+
+BINARY_OPERATORS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv,
+    ast.Mod: operator.mod,
+    ast.Pow: _power,
+}
+
+UNARY_OPERATORS = {
+    ast.UAdd: operator.pos,
+    ast.USub: operator.neg,
+}
+
+# Each function with the least and most arguments it takes.
+FUNCTIONS = {
+    "min": (min, 2, None),
+    "max": (max, 2, None),
+    "round": (round, 1, 2),
+    "floor": (math.floor, 1, 1),
+    "ceil": (math.ceil, 1, 1),
+}
+
+
+def _number(node):
+    if hasattr(ast, "Constant") and isinstance(node, ast.Constant):
+        value = node.value
+    elif isinstance(node, getattr(ast, "Num", ())):
+        value = node.n
+    else:
+        return None
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return None
+    return value
+
+
+def _compile(node, text):
+    value = _number(node)
+    if value is not None:
+        return lambda: value
+
+    if isinstance(node, ast.BinOp) and type(node.op) in BINARY_OPERATORS:
+        function = BINARY_OPERATORS[type(node.op)]
+        left = _compile(node.left, text)
+        right = _compile(node.right, text)
+        return lambda: function(left(), right())
+
+    if isinstance(node, ast.UnaryOp) and type(node.op) in UNARY_OPERATORS:
+        function = UNARY_OPERATORS[type(node.op)]
+        operand = _compile(node.operand, text)
+        return lambda: function(operand())
+
+    if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in FUNCTIONS:
+        function, least, most = FUNCTIONS[node.func.id]
+        if len(node.keywords) > 0 or getattr(node, "starargs", None) is not None or getattr(node, "kwargs", None) is not None:
+            raise ArithmeticExpressionError("'{}' only takes positional arguments in '{}'".format(node.func.id, text))
+        if len(node.args) < least or (most is not None and len(node.args) > most):
+            raise ArithmeticExpressionError("Wrong number of arguments to '{}' in '{}'".format(node.func.id, text))
+        args = [_compile(arg, text) for arg in node.args]
+        return lambda: function(*[arg() for arg in args])
+
+    raise ArithmeticExpressionError("Unsupported '{}' in '{}'".format(type(node).__name__, text))
+
+
+_compiled = dict()
+_lock = threading.Lock()
+
+
+def compile_arithmetic(text):
+    """
+    Compile an arithmetic expression of numbers, ``+ - * / // % **``,
+    parentheses and the functions ``min``, ``max``, ``round``, ``floor`` and
+    ``ceil`` into a function computing its value. Anything else, names and
+    attributes included, is rejected, so the expression never reaches
+    ``eval``. Compiled expressions are cached by their text.
+    """
+    with _lock:
+        compiled = _compiled.get(text)
+    if compiled is not None:
+        return compiled
+
+    try:
+        tree = ast.parse(text.strip(), mode="eval")
+    except SyntaxError as ex:
+        raise ArithmeticExpressionError("Invalid expression '{}' - {}".format(text, ex.msg))
+    compiled = _compile(tree.body, text)
+
+    with _lock:
+        if len(_compiled) >= MAX_CACHED:
+            _compiled.clear()
+        _compiled[text] = compiled
+    return compiled
+
+
+def evaluate(text):
+    return compile_arithmetic(text)()
@@ -0,0 +1,336 @@
+"""
+A benchmark of property resolution and rendering, against in-process stand ins
+for SSM, EC2 and the instance metadata service.
+
+Generates a synthetic service definition, resolves and renders it a number of
+times, and reports the wall time, the AWS calls made, the resolvers invoked
+and the peak memory as JSON, so results can be compared across versions::
+
+    python -m configbutler.benchmark --properties 200 --depth 4 --fanout 3 \\
+        --templates 10 --aws-refs 60 --latency 0.005 --output results.json
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+from . import _version
+from .engine import PropertyEngine
+from .imds import InstanceMetadata
+from .registry import ResolverRegistry
+from .trace import Tracer
+
+METADATA_ATTRIBUTES = ["instance_id", "instance_type", "availability_zone", "region", "account_id", "private_ipv4"]
+
+METADATA_PATHS = {
+    "meta-data/ami-id": "ami-12345",
+    "meta-data/placement/availability-zone": "ap-southeast-2a",
+    "meta-data/instance-id": "i-12345",
+    "meta-data/instance-type": "t3.micro",
+    "meta-data/local-hostname": "ip-10-0-0-1.internal",
+    "meta-data/local-ipv4": "10.0.0.1",
+    "dynamic/instance-identity/document": json.dumps({
+        "accountId": "123456789012",
+        "region": "ap-southeast-2",
+        "instanceId": "i-12345",
+    }),
+}
+
+
+class CallCounter(object):
+    """
+    Counts the calls made to the fake services, by operation, and adds the
+    injected latency to each one.
+    """
+
+    def __init__(self, latency=0):
+        self.latency = latency
+        self.calls = Counter()
+        self.lock = threading.Lock()
+
+    def call(self, operation):
+        with self.lock:
+            self.calls[operation] += 1
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+
+def resolver_counts(tracer):
+    """
+    Count the property spans of a run: the resolver invocations, by resolver
+    and sub resolver (eg. ``aws|paramstore``), leaving out values answered
+    from the memo or the cache, and the properties by cache outcome.
+    """
+    calls = Counter()
+    cache = Counter()
+    for event in tracer.events:
+        if event["cat"] != "property":
+            continue
+        args = event["args"]
+        outcome = args.get("cache")
+        if outcome is not None:
+            cache[outcome] += 1
+        if outcome in ("hit", "memo"):
+            continue
+        calls["|".join(name for name in (args["resolver"], args.get("sub_resolver")) if name)] += 1
+    return {"calls": dict(calls), "cache": dict(cache)}
+
+
+class FakeSSM(object):
+
+    def __init__(self, counter, parameters):
+        self.counter = counter
+        self.parameters = parameters
+
+    def get_parameter(self, Name, WithDecryption=False):
+        self.counter.call("ssm.GetParameter")
+        return {"Parameter": {"Name": Name, "Value": self.parameters[Name]}}
+
+    def get_parameters(self, Names, WithDecryption=False):
+        self.counter.call("ssm.GetParameters")
+        return {
+            "Parameters": [{"Name": name, "Value": self.parameters[name]} for name in Names if name in self.parameters],
+            "InvalidParameters": [name for name in Names if name not in self.parameters],
+        }
+
+    def get_parameters_by_path(self, Path, Recursive=False, WithDecryption=False, NextToken=None):
+        self.counter.call("ssm.GetParametersByPath")
+        prefix = Path.rstrip("/") + "/"
+        return {"Parameters": [{"Name": name, "Value": value} for name, value in sorted(self.parameters.items())
+                               if name.startswith(prefix)]}
+
+
+class FakeEC2(object):
+
+    def __init__(self, counter, tags):
+        self.counter = counter
+        self.tags = tags
+
+    def describe_tags(self, Filters, NextToken=None):
+        self.counter.call("ec2.DescribeTags")
+        return {"Tags": [{"Key": key, "Value": value} for key, value in sorted(self.tags.items())]}
+
+
+class FakeInstanceMetadata(InstanceMetadata):
+    """
+    The real instance metadata client, with each HTTP request replaced by a
+    lookup in ``METADATA_PATHS`` (and the instance's tags, when ``tags_enabled``).
+    """
+
+    def __init__(self, counter, tags, tags_enabled=False):
+        super(FakeInstanceMetadata, self).__init__("http://fake-imds")
+        self.counter = counter
+        self.paths = dict(METADATA_PATHS)
+        if tags_enabled:
+            self.paths["meta-data/tags/instance"] = "\n".join(sorted(tags.keys()))
+            for key, value in tags.items():
+                self.paths["meta-data/tags/instance/" + key] = value
+
+    def request(self, path):
+        self.counter.call("imds.GET")
+        return self.paths.get(path)
+
+
+class FakeAWS(object):
+    """
+    Stands in for ``AWSClientPool``, serving every AWS resolver from the fakes above.
+    """
+
+    def __init__(self, counter, parameters, tags, imds_tags=False):
+        self.ssm = FakeSSM(counter, parameters)
+        self.ec2 = FakeEC2(counter, tags)
+        self.metadata = FakeInstanceMetadata(counter, tags, imds_tags)
+
+    def client(self, service_name):
+        return getattr(self, service_name)
+
+    def instance_metadata(self):
+        return self.metadata
+
+
+def synthetic_properties(properties, depth=2, fanout=2, aws_refs=0):
+    """
+    Generate ``properties`` property expressions over ``depth`` + 1 levels. The
+    first level holds plain values, and ``aws_refs`` paramstore, tag and
+    metadata lookups in turn. Every property on a later level references
+    ``fanout`` properties of the level before.
+
+    Returns the properties with the SSM parameters and tags they look up.
+    """
+    levels = [[] for _ in range(depth + 1)]
+    for index in range(properties):
+        levels[index * (depth + 1) // properties].append("p{}".format(index))
+
+    expressions = dict()
+    parameters = dict()
+    tags = dict()
+    for position, key in enumerate(levels[0]):
+        if position < aws_refs:
+            kind = position % 3
+            if kind == 0:
+                name = "/bench/param{}".format(position)
+                parameters[name] = "value{}".format(position)
+                expressions[key] = "aws|paramstore|{}".format(name)
+            elif kind == 1:
+                name = "tag{}".format(position)
+                tags[name] = "value{}".format(position)
+                expressions[key] = "aws|tags|{}".format(name)
+            else:
+                expressions[key] = "aws|metadata|{}".format(METADATA_ATTRIBUTES[position % len(METADATA_ATTRIBUTES)])
+        else:
+            expressions[key] = "string|value{}".format(position)
+
+    for level in range(1, depth + 1):
+        previous = levels[level - 1] or levels[0]
+        for position, key in enumerate(levels[level]):
+            references = [previous[(position + offset) % len(previous)] for offset in range(fanout)]
+            expressions[key] = "string|" + "-".join("${" + name + "}" for name in references)
+
+    ordered = dict((key, expressions[key]) for level in levels for key in level)
+    return ordered, parameters, tags
+
+
+def synthetic_config(directory, properties, templates=1):
+    """
+    Write ``templates`` templates into ``directory``, each reading an equal
+    share of ``properties``, and return a service definition rendering them.
+    """
+    files = []
+    keys = list(properties.keys())
+    for index in range(templates):
+        src = os.path.join(directory, "template{}.j2".format(index))
+        with open(src, "w") as template:
+            for key in keys[index::templates]:
+                template.write("{0}={{{{ {0} }}}}\n".format(key))
+        files.append({"mode": "jinja2", "src": src, "dest": os.path.join(directory, "output{}".format(index))})
+    return {"properties": properties, "files": files}
+
+
+def run_once(config, parameters, tags, directory, jobs=1, latency=0, imds_tags=False):
+    # Imported here so the benchmark module itself stays cheap to import.
+    from .main import parse_args as parse_main_args, render_files
+    from .templates import TemplateEnvironment
+
+    counter = CallCounter(latency)
+    registry = ResolverRegistry(aws=FakeAWS(counter, parameters, tags, imds_tags))
+    tracer = Tracer()
+    engine = PropertyEngine(registry, jobs=jobs, tracer=tracer)
+    args = parse_main_args([directory])
+
+    for output in config["files"]:
+        if os.path.exists(output["dest"]):
+            os.remove(output["dest"])
+
+    peak = None
+    if tracemalloc is not None:
+        tracemalloc.start()
+    try:
+        start = time.time()
+        resolved = engine.resolve(config["properties"])
+        resolved_time = time.time()
+        render_files(args, config, resolved, templates=TemplateEnvironment())
+        end = time.time()
+        if tracemalloc is not None:
+            peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        if tracemalloc is not None:
+            tracemalloc.stop()
+
+    return {
+        "resolve_seconds": resolved_time - start,
+        "render_seconds": end - resolved_time,
+        "total_seconds": end - start,
+        "peak_memory_bytes": peak,
+        "calls": dict(counter.calls),
+        "resolvers": resolver_counts(tracer),
+    }
+
+
+def _summary(values):
+    values = sorted(values)
+    return {"min": values[0], "median": values[len(values) // 2], "max": values[-1]}
+
+
+def run_benchmark(properties=100, depth=2, fanout=2, templates=5, aws_refs=30, latency=0.0, jobs=1,
+                  repeat=3, imds_tags=False):
+    """
+    Resolve and render a synthetic service definition ``repeat`` times, and
+    return the parameters and measurements as a JSON serialisable dict.
+    """
+    directory = tempfile.mkdtemp(prefix="configbutler-bench-")
+    try:
+        expressions, parameters, tags = synthetic_properties(properties, depth, fanout, aws_refs)
+        config = synthetic_config(directory, expressions, templates)
+        runs = [run_once(config, parameters, tags, directory, jobs, latency, imds_tags) for _ in range(repeat)]
+    finally:
+        shutil.rmtree(directory)
+
+    return {
+        "version": _version.__version__,
+        "python": sys.version.split()[0],
+        "parameters": {
+            "properties": properties,
+            "depth": depth,
+            "fanout": fanout,
+            "templates": templates,
+            "aws_refs": aws_refs,
+            "latency": latency,
+            "jobs": jobs,
+            "repeat": repeat,
+            "imds_tags": imds_tags,
+        },
+        "resolve_seconds": _summary([run["resolve_seconds"] for run in runs]),
+        "render_seconds": _summary([run["render_seconds"] for run in runs]),
+        "total_seconds": _summary([run["total_seconds"] for run in runs]),
+        "peak_memory_bytes": runs[-1]["peak_memory_bytes"] if tracemalloc is None else max(run["peak_memory_bytes"] for run in runs),
+        # Every run starts from nothing, so each makes the same calls.
+        "calls": runs[0]["calls"],
+        "resolvers": runs[0]["resolvers"],
+    }
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(
+        prog="configbutler-benchmark",
+        description="Benchmark property resolution and rendering against fake AWS services.",
+    )
+    parser.add_argument('--properties', type=int, default=100, metavar="N", help="Number of properties (default 100).")
+    parser.add_argument('--depth', type=int, default=2, help="Levels of properties referencing the level before (default 2).")
+    parser.add_argument('--fanout', type=int, default=2, help="Properties referenced by each dependent property (default 2).")
+    parser.add_argument('--templates', type=int, default=5, metavar="M", help="Number of templates rendered (default 5).")
+    parser.add_argument('--aws-refs', type=int, default=30, metavar="K",
+                        help="Number of paramstore, tag and metadata lookups (default 30).")
+    parser.add_argument('--latency', type=float, default=0.0, metavar="SECONDS",
+                        help="Latency added to every fake AWS call (default 0).")
+    parser.add_argument('--imds-tags', action="store_true", help="Serve tags from the instance metadata service.")
+    parser.add_argument('-j', '--jobs', type=int, default=1, metavar="N", help="Resolve up to N properties concurrently.")
+    parser.add_argument('--repeat', type=int, default=3, help="Number of runs measured (default 3).")
+    parser.add_argument('-o', '--output', metavar="FILE", help="Write the results to FILE rather than stdout.")
+    return parser.parse_args(args)
+
+
+def main(cli_args=None):
+    args = parse_args(sys.argv[1:] if cli_args is None else cli_args)
+    results = run_benchmark(args.properties, args.depth, args.fanout, args.templates, args.aws_refs,
+                            args.latency, args.jobs, args.repeat, args.imds_tags)
+
+    report = json.dumps(results, indent=2, sort_keys=True)
+    if args.output is not None:
+        with open(args.output, "w") as output:
+            output.write(report + "\n")
+    else:
+        print(report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+logger = logging.getLogger("configbutler")
+
+FOREVER = -1
+
+# Metadata that stays the same for the life of the instance. The rest, such
+# as its public address or IAM role, can change while it runs.
+IDENTITY_TTLS = {
+    "aws|metadata|instance_id": FOREVER,
+    "aws|metadata|ami_id": FOREVER,
+    "aws|metadata|account_id": FOREVER,
+    "aws|metadata|region": FOREVER,
+    "aws|metadata|availability_zone": FOREVER,
+}
+
+DEFAULT_TTLS = dict(IDENTITY_TTLS)
+DEFAULT_TTLS.update({
+    "aws|metadata": 300,
+    "aws|metadata|instance_action": 0,
+    "aws|tags": 300,
+    "aws|paramstore": 300,
+    "aws|paramstore-path": 300,
+})
+
+
+class ResolverCache(object):
+    """
+    Resolved property values persisted between runs, keyed by the property
+    expression with its references substituted (eg. ``aws|paramstore|/garden/test/key``).
+
+    Only expressions matching a prefix in ``ttls`` are cached, each for the TTL
+    (in seconds) of its longest matching prefix, where ``FOREVER`` never expires.
+    The cache may hold decrypted secrets, so the directory and file are only
+    accessible by their owner.
+
+    The values are saved with the id of the instance they were resolved on,
+    as returned by ``instance``, and dropped when loaded on another instance,
+    eg. when the cache directory was baked into an AMI.
+    """
+
+    FILE_NAME = "values.json"
+
+    def __init__(self, directory, ttls=None, stale_if_error=False, instance=None):
+        self.directory = directory
+        self.path = os.path.join(directory, self.FILE_NAME)
+        self.ttls = dict(DEFAULT_TTLS if ttls is None else ttls)
+        self.stale_if_error = stale_if_error
+        self.instance = instance
+        self.instance_id = None
+        self.entries = None
+        self.dirty = False
+        self.lock = threading.Lock()
+
+    def ttl(self, expression):
+        matches = [prefix for prefix in self.ttls if expression == prefix or expression.startswith(prefix + "|")]
+        if len(matches) == 0:
+            return 0
+        return self.ttls[max(matches, key=len)]
+
+    def _instance_id(self):
+        if self.instance is None:
+            return None
+        try:
+            return self.instance()
+        except Exception as ex:
+            logger.debug("Unable to determine the instance id - cause {}".format(ex))
+            return None
+
+    def _entries(self):
+        if self.entries is None:
+            self.entries = dict()
+            cached = dict()
+            try:
+                with open(self.path, "r") as cache_file:
+                    cached = json.load(cache_file)
+            except (IOError, OSError):
+                pass
+            except ValueError as ex:
+                logger.warning("Ignoring unreadable cache '{}' - cause {}".format(self.path, ex))
+
+            if len(cached) > 0 and "entries" not in cached:
+                logger.info("Ignoring cache '{}' saved without an instance id".format(self.path))
+                cached = dict()
+            self.instance_id = self._instance_id()
+            cached_id = cached.get("instance_id")
+
+            # Only answer for the instance the values were resolved on. When
+            # the instance cannot be confirmed, eg. as the metadata service is
+            # down, nothing saved by a known instance is used, stale or not.
+            if cached_id == self.instance_id:
+                self.entries = cached.get("entries", {})
+            elif len(cached) > 0:
+                logger.info("Ignoring cache '{}' of instance '{}' on '{}'".format(self.path, cached_id, self.instance_id))
+        return self.entries
+
+    def get(self, expression):
+        """
+        Return ``(True, value)`` for an unexpired cached value, otherwise ``(False, None)``.
+        """
+        ttl = self.ttl(expression)
+        if ttl == 0:
+            return False, None
+
+        with self.lock:
+            entry = self._entries().get(expression)
+        if entry is None:
+            return False, None
+        if ttl != FOREVER and time.time() - entry["time"] > ttl:
+            return False, None
+        return True, entry["value"]
+
+    def get_stale(self, expression):
+        """
+        Return ``(True, value)`` for any cached value, expired or not, when
+        ``stale_if_error`` is enabled, otherwise ``(False, None)``.
+        """
+        if not self.stale_if_error:
+            return False, None
+
+        with self.lock:
+            entry = self._entries().get(expression)
+        if entry is None:
+            return False, None
+        return True, entry["value"]
+
+    def put(self, expression, value):
+        if value is None or self.ttl(expression) == 0:
+            return
+
+        with self.lock:
+            self._entries()[expression] = {"time": time.time(), "value": value}
+            self.dirty = True
+
+    def save(self):
+        with self.lock:
+            if not self.dirty:
+                return
+
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory, 0o700)
+
+            # Written beside the cache and renamed over it, so a reader never sees a partial file.
+            fd, temp_path = tempfile.mkstemp(dir=self.directory, prefix=".values-")
+            try:
+                os.fchmod(fd, 0o600)
+                with os.fdopen(fd, "w") as cache_file:
+                    json.dump({"instance_id": self.instance_id, "entries": self.entries}, cache_file)
+                    cache_file.flush()
+                    os.fsync(cache_file.fileno())
+                os.rename(temp_path, self.path)
+            except:
+                os.remove(temp_path)
+                raise
+
+            self.dirty = False
@@ -0,0 +1,118 @@
+import hashlib
+import logging
+import os
+import pickle
+import threading
+
+import yaml
+
+from .expressions import Expression, ExpressionError
+from .output import write_file
+
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
+logger = logging.getLogger("configbutler")
+
+
+def compile_config(data):
+    """
+    Parse a service definition, with every property compiled to an ``Expression``.
+    """
+    config = yaml.load(data, Loader=SafeLoader)
+    if isinstance(config, dict) and isinstance(config.get('properties'), dict):
+        properties = dict()
+        for key, value in config['properties'].items():
+            try:
+                properties[key] = Expression(value)
+            except ExpressionError as ex:
+                raise ExpressionError("Invalid property '{}' - {}".format(key, ex))
+        config['properties'] = properties
+    return config
+
+
+class ConfigCache(object):
+    """
+    Compiled service definitions, keyed by path and reused for as long as the
+    file's mtime and size are unchanged, so unchanged service files are not
+    parsed again. The compiled definitions are pickled in ``directory``
+    between runs, which, like the other caches, only its owner can write to.
+
+    Without a ``directory`` the definitions are only kept in memory, for as
+    long as the process runs.
+    """
+
+    FILE_NAME = "configs.pickle"
+    VERSION = 2
+
+    def __init__(self, directory=None):
+        self.directory = directory
+        self.path = os.path.join(directory, self.FILE_NAME) if directory is not None else None
+        self.entries = None
+        self.dirty = False
+        self.lock = threading.Lock()
+
+    def _entries(self):
+        if self.entries is None:
+            self.entries = dict()
+            if self.path is None:
+                return self.entries
+            try:
+                with open(self.path, "rb") as cache_file:
+                    cached = pickle.load(cache_file)
+                if cached.get("version") == self.VERSION:
+                    self.entries = cached["entries"]
+            except (IOError, OSError):
+                pass
+            except Exception as ex:
+                logger.warning("Ignoring unreadable config cache '{}' - cause {}".format(self.path, ex))
+        return self.entries
+
+    def load(self, filename):
+        """
+        The compiled service definition in ``filename``.
+        """
+        return self._entry(filename)["config"]
+
+    def digest(self, filename):
+        """
+        The sha256 digest of the service file, as it was when it was compiled.
+        """
+        return self._entry(filename)["digest"]
+
+    def _entry(self, filename):
+        path = os.path.abspath(filename)
+        stat = os.stat(path)
+        key = (getattr(stat, "st_mtime_ns", stat.st_mtime), stat.st_size)
+
+        with self.lock:
+            entry = self._entries().get(path)
+        if entry is not None and entry["key"] == key:
+            return entry
+
+        logger.debug("Compiling '{}'".format(filename))
+        with open(path, "rb") as config_file:
+            data = config_file.read()
+        try:
+            config = compile_config(data)
+        except ExpressionError as ex:
+            raise ExpressionError("{} in '{}'".format(ex, filename))
+        entry = {"key": key, "digest": hashlib.sha256(data).hexdigest(), "config": config}
+
+        with self.lock:
+            self._entries()[path] = entry
+            self.dirty = True
+        return entry
+
+    def save(self):
+        with self.lock:
+            if not self.dirty or self.directory is None:
+                return
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory, 0o700)
+
+            entries = dict((path, entry) for path, entry in self.entries.items() if os.path.exists(path))
+            write_file(self.path, pickle.dumps({"version": self.VERSION, "entries": entries}, pickle.HIGHEST_PROTOCOL))
+            self.dirty = False
@@ -0,0 +1,400 @@
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from .expressions import as_expression, bind, find_references  # noqa: F401 - find_references is re-exported
+from .resolvers import BaseSubResolver, UnsafeSubstitution, ResolverError
+from .trace import annotate, untraced
+
+logger = logging.getLogger("configbutler")
+
+
+class PropertyGraph(object):
+    """
+    The dependency graph between a set of property expressions.
+
+    Every property is a node, with an edge to each property its expression
+    references. The graph is built once, up front, so that cycles and missing
+    references can be reported before any resolver is invoked. References to
+    names in ``context``, which are already resolved, are not edges.
+    """
+
+    def __init__(self, properties, context=None):
+        if context is None:
+            context = dict()
+        self.keys = list(properties.keys())
+        self.dependencies = dict()
+        self.missing = dict()
+
+        for key in self.keys:
+            references = as_expression(properties[key]).references
+            self.dependencies[key] = [name for name in references if name in properties]
+            missing = [name for name in references if name not in properties and name not in context]
+            if len(missing) > 0:
+                self.missing[key] = missing
+
+    def cycles(self):
+        """
+        Find the dependency cycles in the graph, each returned as the chain of
+        property names that leads back to its own start.
+        """
+        cycles = []
+        state = dict()
+
+        for root in self.keys:
+            if root in state:
+                continue
+
+            # Iterative depth first search, so long chains cannot exhaust the stack.
+            path = [root]
+            state[root] = "visiting"
+            stack = [iter(self.dependencies[root])]
+
+            while len(stack) > 0:
+                child = next(stack[-1], None)
+                if child is None:
+                    state[path.pop()] = "done"
+                    stack.pop()
+                elif child not in state:
+                    state[child] = "visiting"
+                    path.append(child)
+                    stack.append(iter(self.dependencies[child]))
+                elif state[child] == "visiting":
+                    cycles.append(path[path.index(child):] + [child])
+
+        return cycles
+
+    def chains(self, key):
+        """
+        The chains of properties leading to ``key``, one from each property
+        that depends on it but that nothing else depends on, in declaration
+        order. A property nothing depends on is its own chain.
+        """
+        dependents = self.scheduler().dependents
+        # Breadth first over the reverse dependencies, recording the next step towards ``key``.
+        towards = {key: None}
+        queue = [key]
+        for name in queue:
+            for dependent in dependents[name]:
+                if dependent not in towards:
+                    towards[dependent] = name
+                    queue.append(dependent)
+
+        roots = [name for name in self.keys if name in towards and len(dependents[name]) == 0]
+        if len(roots) == 0:
+            # Only depended on from within a cycle, which is reported on its own.
+            roots = [key]
+
+        chains = []
+        for root in roots:
+            chain = [root]
+            while chain[-1] != key:
+                chain.append(towards[chain[-1]])
+            chains.append(chain)
+        return chains
+
+    def problems(self):
+        """
+        Describe every missing reference and cycle in the graph, one message per problem.
+        Missing references are reported against each property they keep from
+        resolving, with the full chain of references that leads to them.
+        """
+        messages = []
+        for key in self.keys:
+            for name in self.missing.get(key, []):
+                for chain in self.chains(key):
+                    messages.append("Property '{}' references undefined property '{}' ({})".format(
+                        chain[0], name, " -> ".join(chain + [name])))
+        for cycle in self.cycles():
+            messages.append("Circular property reference ({})".format(" -> ".join(cycle)))
+        return messages
+
+    def scheduler(self):
+        return GraphScheduler(self)
+
+    def waves(self):
+        """
+        Generate the properties in dependency order, as successive lists of
+        properties whose dependencies have all been yielded before.
+
+        Each wave is a list of ``(key, safe_mode)`` tuples in declaration order,
+        see ``GraphScheduler.take``.
+        """
+        scheduler = self.scheduler()
+        while not scheduler.finished():
+            wave = scheduler.take()
+            for key, _ in wave:
+                scheduler.complete(key)
+            yield wave
+
+    def order(self):
+        """
+        The properties in a single dependency order, see ``waves``.
+        """
+        return [item for wave in self.waves() for item in wave]
+
+
+class GraphScheduler(object):
+    """
+    Tracks which properties of a ``PropertyGraph`` are ready to be resolved, as
+    the properties they depend on are completed.
+    """
+
+    def __init__(self, graph):
+        self.position = dict((key, index) for index, key in enumerate(graph.keys))
+        self.remaining = dict((key, set(graph.dependencies[key])) for key in graph.keys)
+        self.dependents = dict((key, []) for key in graph.keys)
+        for key in graph.keys:
+            for name in self.remaining[key]:
+                self.dependents[name].append(key)
+
+        self.ready = [key for key in graph.keys if len(self.remaining[key]) == 0]
+        self.running = set()
+        self.unsafe = set(graph.missing.keys())
+
+    def finished(self):
+        return len(self.remaining) == 0 and len(self.running) == 0
+
+    def take(self):
+        """
+        Take every property that is ready to be resolved, as a list of ``(key, safe_mode)``
+        tuples in declaration order.
+
+        ``safe_mode`` is set for properties that can never be fully resolved:
+        those with missing references, and one member of each cycle, which is
+        released with its unresolved references left in place once nothing
+        else can proceed, so the rest of the cycle can follow.
+        """
+        if len(self.ready) == 0 and len(self.running) == 0 and len(self.remaining) > 0:
+            # Everything left is blocked on a cycle, break it at the first declared property.
+            key = min(self.remaining.keys(), key=self.position.get)
+            self.unsafe.add(key)
+            self.ready = [key]
+
+        batch = sorted(self.ready, key=self.position.get)
+        self.ready = []
+        for key in batch:
+            del self.remaining[key]
+            self.running.add(key)
+
+        return [(key, key in self.unsafe) for key in batch]
+
+    def complete(self, key):
+        self.running.discard(key)
+        for dependent in self.dependents[key]:
+            if dependent in self.remaining:
+                self.remaining[dependent].discard(key)
+                if len(self.remaining[dependent]) == 0 and dependent not in self.ready:
+                    self.ready.append(dependent)
+
+
+class PropertyEngine(object):
+    """
+    Resolves the properties of a service definition in dependency order, each
+    exactly once, through the resolvers of a ``ResolverRegistry``.
+
+    With ``jobs`` above one, properties are dispatched to a pool of that many
+    worker threads as soon as everything they reference is resolved, so
+    independent lookups overlap. The result is the same as resolving serially.
+
+    With a ``ResolverCache``, values cached by an earlier run are used while
+    they are fresh, and when a resolver fails the last known value can stand in.
+
+    An engine is shared by every service definition in a run, and each distinct
+    expression (after substituting the properties it references) is resolved
+    once and reused by every property and file that evaluates it.
+
+    With a ``Tracer``, every property resolved and every prefetch is recorded as a span.
+    """
+
+    def __init__(self, registry, jobs=1, cache=None, tracer=None):
+        self.registry = registry
+        self.jobs = jobs
+        self.cache = cache
+        self.tracer = tracer
+        self.memo = dict()
+        self.lock = threading.Lock()
+
+    def resolve(self, properties, context=None, source=None):
+        """
+        Resolve a set of properties, which may reference the already resolved
+        values in ``context``. The result holds the context overridden by the
+        resolved properties. ``source`` names the service file they came from, for tracing.
+        """
+        if context is None:
+            context = dict()
+
+        properties = dict((key, as_expression(value)) for key, value in properties.items())
+        graph = PropertyGraph(properties, context)
+        for problem in graph.problems():
+            logger.error(problem)
+
+        if self.jobs > 1:
+            resolved_properties = self._resolve_concurrently(graph, properties, context, source)
+        else:
+            resolved_properties = dict(context)
+            for number, wave in enumerate(graph.waves()):
+                self.prefetch([properties[key] for key, safe_mode in wave if not safe_mode], resolved_properties)
+                for key, safe_mode in wave:
+                    resolved_properties[key] = self.resolve_property(key, properties[key], resolved_properties, safe_mode,
+                                                                     source, number)
+
+        # Merge in declaration order, however the properties were scheduled.
+        result = dict(context)
+        for key in graph.keys:
+            result[key] = resolved_properties[key]
+        return result
+
+    def _resolve_concurrently(self, graph, properties, context, source=None):
+        resolved_properties = dict(context)
+        scheduler = graph.scheduler()
+        futures = dict()
+        number = 0
+
+        with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+            while not scheduler.finished():
+                batch = scheduler.take()
+                if len(batch) > 0:
+                    # Workers only read the properties resolved before their batch was released.
+                    snapshot = dict(resolved_properties)
+                    self.prefetch([properties[key] for key, safe_mode in batch if not safe_mode], snapshot)
+                    for key, safe_mode in batch:
+                        future = pool.submit(self.resolve_property, key, properties[key], snapshot, safe_mode, source, number)
+                        futures[future] = key
+                    number += 1
+
+                done, _ = wait(list(futures.keys()), return_when=FIRST_COMPLETED)
+                for future in done:
+                    key = futures.pop(future)
+                    resolved_properties[key] = future.result()
+                    scheduler.complete(key)
+
+        return resolved_properties
+
+    def prefetch(self, values, resolved_properties):
+        """
+        Give each resolver the chance to batch up the lookups for a set of property
+        values whose dependencies are all resolved, before they are resolved one by one.
+        Of expressions with nested calls, only the innermost calls are known up front.
+        """
+        requests = dict()
+        for value in values:
+            for call in as_expression(value).call.innermost():
+                key, args = bind(call, resolved_properties)
+                if key in self.memo:
+                    continue
+                if self.cache is not None and self.cache.get(key)[0]:
+                    continue
+                requests.setdefault(call.name, []).append(args)
+
+        for resolver_name, parts_list in requests.items():
+            resolver = self.registry.get(resolver_name)
+            if hasattr(resolver, "prefetch"):
+                with self._span("prefetch " + resolver_name, "prefetch", {"resolver": resolver_name, "count": len(parts_list)}):
+                    resolver.prefetch(parts_list, resolved_properties)
+
+    def _span(self, name, category, args):
+        if self.tracer is None:
+            return untraced()
+        return self.tracer.span(name, category, args)
+
+    def _property_span(self, key, value, resolved_properties, safe_mode, source, number):
+        if self.tracer is None:
+            return untraced()
+
+        args = bind(value.call, resolved_properties)[1]
+        sub_resolver = None
+        if len(args) > 1 and isinstance(self.registry.get(value.call.name), BaseSubResolver):
+            sub_resolver = args[0]
+        return self.tracer.span(key, "property", {
+            "property": key,
+            "file": source,
+            "expression": value.value,
+            "resolver": value.call.name,
+            "sub_resolver": sub_resolver,
+            "key": "|".join(args[1:] if sub_resolver is not None else args),
+            "pass": number,
+            "safe_mode": safe_mode,
+            "references": value.references,
+        })
+
+    def resolve_property(self, key, value, resolved_properties, safe_mode=False, source=None, number=None):
+        logger.info("Processing property - {} = {}".format(key, value))
+        value = as_expression(value)
+
+        with self._property_span(key, value, resolved_properties, safe_mode, source, number):
+            return self._call(value.call, resolved_properties, safe_mode)
+
+    def _call(self, call, resolved_properties, safe_mode):
+        """
+        Resolve a call, after the calls nested within it.
+        """
+        key, args = bind(call, resolved_properties, lambda nested: self._call(nested, resolved_properties, safe_mode))
+        if safe_mode:
+            return self._lookup(key, call, args, resolved_properties, safe_mode)
+
+        with self.lock:
+            future = self.memo.get(key)
+            owner = future is None
+            if owner:
+                future = self.memo[key] = Future()
+
+        if not owner:
+            # Another property, in this or an earlier file, has (or is) resolving the same expression.
+            logger.debug("Reusing the value resolved for '{}'".format(key))
+            annotate(cache="memo")
+            return future.result()
+
+        try:
+            resolved = self._lookup(key, call, args, resolved_properties, safe_mode)
+        except BaseException as ex:
+            future.set_exception(ex)
+            raise
+        future.set_result(resolved)
+        return resolved
+
+    def _lookup(self, key, call, args, resolved_properties, safe_mode):
+        use_cache = self.cache is not None and not safe_mode
+        if use_cache:
+            hit, cached = self.cache.get(key)
+            if hit:
+                logger.debug("Using cached value for '{}'".format(key))
+                annotate(cache="hit")
+                return cached
+            annotate(cache="miss")
+
+        try:
+            resolved = self._resolve(call, args, resolved_properties, safe_mode)
+        except ResolverError as ex:
+            annotate(error=str(ex))
+            if use_cache:
+                stale, cached = self.cache.get_stale(key)
+                if stale:
+                    logger.warning("{}, using the last known value".format(ex))
+                    annotate(cache="stale")
+                    return cached
+            logger.error(str(ex))
+            return None
+
+        if use_cache:
+            self.cache.put(key, resolved)
+        return resolved
+
+    def _resolve(self, call, args, resolved_properties, safe_mode):
+        logger.debug("Lookup resolver '{}'".format(call.name))
+        resolver = self.registry.get(call.name)
+
+        if resolver is None:
+            logger.error("Unable to locate resolver for '{}'".format(call.name))
+            return call.source
+
+        logger.debug("Resolver found '{}'".format(resolver))
+        resolver.safe_mode = safe_mode
+        try:
+            return resolver.resolve(args, current_properties=resolved_properties)
+        except UnsafeSubstitution as ex:
+            # The dependency graph should have ordered this away, fall back to leaving the reference in place.
+            logger.error("Unable to fully resolve '{}' due to {}".format(call.source, ex))
+            annotate(safe_mode=True)
+            resolver.safe_mode = True
+            return resolver.resolve(args, current_properties=resolved_properties)
@@ -0,0 +1,293 @@
+import re
+
+try:
+    string_types = basestring  # noqa: F821 - Python 2
+except NameError:
+    string_types = str
+
+IDENTIFIER = re.compile(r"[_a-z][_a-z0-9]*", re.IGNORECASE)
+RESOLVER_CALL = re.compile(r"\$\{([_a-z][-_a-z0-9]*)\|", re.IGNORECASE)
+
+ESCAPABLE = "\\|$}"
+
+
+class ExpressionError(ValueError):
+
+    def __init__(self, message):
+        super(ExpressionError, self).__init__(message)
+
+
+class Text(object):
+    __slots__ = ("text",)
+
+    def __init__(self, text):
+        self.text = text
+
+
+class Reference(object):
+    """
+    A ``${NAME}`` (or ``$NAME``) reference to another property.
+    """
+    __slots__ = ("name",)
+
+    def __init__(self, name):
+        self.name = name
+
+
+class Call(object):
+    """
+    A resolver call: the resolver ``name`` and its ``args``, each a list of
+    ``Text``, ``Reference`` and nested ``Call`` nodes. ``source`` is the
+    text the call was parsed from.
+    """
+    __slots__ = ("name", "args", "source")
+
+    def __init__(self, name, args, source):
+        self.name = name
+        self.args = args
+        self.source = source
+
+    def nodes(self):
+        """
+        Every node within the call's arguments, nested calls included, depth first.
+        """
+        for arg in self.args:
+            for node in arg:
+                yield node
+                if isinstance(node, Call):
+                    for nested in node.nodes():
+                        yield nested
+
+    def innermost(self):
+        """
+        The calls, this one or nested within it, that have no calls nested within them.
+        """
+        nested = [node for arg in self.args for node in arg if isinstance(node, Call)]
+        if len(nested) == 0:
+            return [self]
+        return [call for node in nested for call in node.innermost()]
+
+
+def _format(value):
+    return '%s' % (value,)
+
+
+def _key_escape(text):
+    return text.replace("\\", "\\\\").replace("|", "\\|")
+
+
+class _Parser(object):
+    """
+    Parses an expression of ``|`` separated arguments, the first naming the
+    resolver. Within an argument:
+
+    - ``${NAME}`` and ``$NAME`` reference another property;
+    - ``${resolver|arg|...}`` is a nested resolver call, whose value is used
+      in place of it;
+    - ``$$`` is a literal ``$``, and a backslash escapes a following ``|``,
+      ``$``, ``}`` or backslash.
+
+    Anything else, including a ``$`` that starts none of these, is literal.
+    """
+
+    def __init__(self, source):
+        self.source = source
+
+    def call(self, start, nested):
+        """
+        Parse the call starting at ``start``, up to the end of the source or,
+        when ``nested``, the closing ``}``. Returns the call and where it ended.
+        """
+        source = self.source
+        segments = []
+        names = []
+        nodes = []
+        text = []
+        segment_start = position = start
+
+        def flush():
+            if len(text) > 0:
+                nodes.append(Text("".join(text)))
+                del text[:]
+
+        def end_segment(end):
+            flush()
+            if all(isinstance(node, Text) for node in nodes):
+                names.append("".join(node.text for node in nodes))
+            else:
+                names.append(source[segment_start:end])
+            segments.append(list(nodes))
+            del nodes[:]
+
+        while True:
+            if position >= len(source):
+                if nested:
+                    raise ExpressionError("Unterminated '${{' in '{}'".format(source))
+                break
+            char = source[position]
+            if char == "\\" and position + 1 < len(source) and source[position + 1] in ESCAPABLE:
+                text.append(source[position + 1])
+                position += 2
+            elif char == "|":
+                end_segment(position)
+                position += 1
+                segment_start = position
+            elif char == "}" and nested:
+                break
+            elif char == "$":
+                position = self.placeholder(position, nodes, text, flush)
+            else:
+                text.append(char)
+                position += 1
+
+        end_segment(position)
+        return Call(names[0], segments[1:], source[start:position]), position
+
+    def placeholder(self, position, nodes, text, flush):
+        source = self.source
+        following = source[position + 1:position + 2]
+
+        if following == "$":
+            text.append("$")
+            return position + 2
+
+        if following == "{":
+            match = IDENTIFIER.match(source, position + 2)
+            if match is not None and source[match.end():match.end() + 1] == "}":
+                flush()
+                nodes.append(Reference(match.group()))
+                return match.end() + 1
+            if RESOLVER_CALL.match(source, position) is not None:
+                call, end = self.call(position + 2, nested=True)
+                call.source = source[position:end + 1]
+                flush()
+                nodes.append(call)
+                return end + 1
+        else:
+            match = IDENTIFIER.match(source, position + 1)
+            if match is not None:
+                flush()
+                nodes.append(Reference(match.group()))
+                return match.end()
+
+        text.append("$")
+        return position + 1
+
+
+def parse(value):
+    """
+    Compile an expression into the ``Call`` at its root.
+    """
+    return _Parser(value).call(0, nested=False)[0]
+
+
+def bind(call, resolved_properties, resolve_call=None):
+    """
+    Substitute the references within a call's arguments with their resolved
+    values, and its nested calls with the values ``resolve_call(nested)``
+    returns. References that are not resolved are left in place.
+
+    Returns ``(key, args)``: ``key`` identifies the value the call resolves
+    to within a run and in the cache, and ``args`` are passed to the
+    resolver, with each literal ``$`` escaped as ``$$`` as resolvers
+    substitute their arguments again. Without ``resolve_call`` nested calls
+    are left as they were written.
+    """
+    keys = [_key_escape(call.name)]
+    args = []
+    for arg in call.args:
+        key = []
+        escaped = []
+        for node in arg:
+            if isinstance(node, Text):
+                key.append(_key_escape(node.text))
+                escaped.append(node.text.replace("$", "$$"))
+            elif isinstance(node, Reference):
+                if node.name in resolved_properties:
+                    value = _format(resolved_properties[node.name])
+                    key.append(_key_escape(value))
+                    escaped.append(value.replace("$", "$$"))
+                else:
+                    key.append("${" + node.name + "}")
+                    escaped.append("${" + node.name + "}")
+            elif resolve_call is None:
+                key.append(node.source)
+                escaped.append(node.source)
+            else:
+                value = _format(resolve_call(node))
+                key.append(_key_escape(value))
+                escaped.append(value.replace("$", "$$"))
+        keys.append("".join(key))
+        args.append("".join(escaped))
+    return "|".join(keys), args
+
+
+class Expression(object):
+    """
+    A property expression compiled into the ``call`` at its root, with the
+    properties it ``references`` anywhere within it, nested calls included.
+
+    Service files are compiled into expressions when they are loaded, and
+    kept that way in the config cache, so the same tree is used to order the
+    properties and to resolve them without parsing the expression again.
+    """
+
+    __slots__ = ("value", "call", "references", "nested")
+
+    def __init__(self, value):
+        # Only coerce values that are not text, as on Python 2 YAML gives unicode for non-ASCII values.
+        if not isinstance(value, string_types):
+            value = str(value)
+        self.value = value
+        self.call = parse(value)
+        self.references = []
+        self.nested = False
+        for node in self.call.nodes():
+            if isinstance(node, Reference) and node.name not in self.references:
+                self.references.append(node.name)
+            elif isinstance(node, Call):
+                self.nested = True
+
+    def substitute(self, resolved_properties):
+        """
+        The expression with its references substituted, nested calls left as written.
+        """
+        return bind(self.call, resolved_properties)[0]
+
+    def __getstate__(self):
+        return self.value, self.call, self.references, self.nested
+
+    def __setstate__(self, state):
+        self.value, self.call, self.references, self.nested = state
+
+    def __eq__(self, other):
+        return isinstance(other, Expression) and self.value == other.value
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.value)
+
+    def __str__(self):
+        return self.value
+
+    def __repr__(self):
+        return "Expression({!r})".format(self.value)
+
+
+def as_expression(value):
+    if isinstance(value, Expression):
+        return value
+    return Expression(value)
+
+
+def find_references(value):
+    """
+    Return the names of the properties referenced by ``${NAME}`` (or ``$NAME``)
+    placeholders within a property expression, nested calls included, in
+    order of first appearance.
+    """
+    if not isinstance(value, string_types):
+        return []
+    return Expression(value).references
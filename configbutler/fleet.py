@@ -0,0 +1,212 @@
+import csv
+import json
+import logging
+import multiprocessing
+import os
+import time
+
+from .engine import PropertyEngine
+from .imds import InstanceMetadata, InstanceMetadataError
+from .output import RunSummary
+from .pipeline import exported_properties, run_pipeline
+from .registry import ResolverRegistry
+from .resolvers import (AWSClientPool, AWSParamStorePathResolver, AWSParamStoreResolver, AWSResolver, BaseResolver)
+from .templates import shared_environment
+
+logger = logging.getLogger("configbutler")
+
+SCOPES = ("tags", "metadata", "host")
+
+
+class FleetError(ValueError):
+
+    def __init__(self, message):
+        super(FleetError, self).__init__(message)
+
+
+class HostFacts(object):
+    """
+    The facts of one host, standing in for what the live host would report:
+    its ``tags`` for ``aws|tags``, its ``metadata`` for ``aws|metadata`` and
+    its ``host`` facts for ``host``.
+    """
+
+    def __init__(self, name, tags=None, metadata=None, host=None):
+        self.name = name
+        self.tags = dict(tags or {})
+        self.metadata = dict(metadata or {})
+        self.host = dict(host or {})
+        self.host.setdefault("hostname", name)
+
+
+def _host(record, source):
+    name = record.get("name")
+    if not name or name in (".", "..") or os.path.sep in name:
+        raise FleetError("Invalid host name '{}' in {}".format(name, source))
+    return HostFacts(name, record.get("tags"), record.get("metadata"), record.get("host"))
+
+
+def load_facts(path):
+    """
+    Read the hosts of a fleet from ``path``.
+
+    A ``.csv`` file has a ``name`` column and a column per fact, named by its
+    scope and key, eg. ``tags:Environment``, ``metadata:instance_id`` or
+    ``host:total_memory``, where empty cells are left out. Anything else is
+    read as JSON lines, each an object with ``name``, ``tags``, ``metadata``
+    and ``host``.
+    """
+    hosts = []
+    with open(path, "r") as facts:
+        if path.endswith(".csv"):
+            for number, row in enumerate(csv.DictReader(facts), 2):
+                record = {"name": row.pop("name", None)}
+                for column, value in row.items():
+                    scope, _, key = (column or "").partition(":")
+                    if scope not in SCOPES or not key:
+                        raise FleetError("Unknown fact column '{}' in {}".format(column, path))
+                    if value:
+                        record.setdefault(scope, {})[key] = value
+                hosts.append(_host(record, "{} line {}".format(path, number)))
+        else:
+            for number, line in enumerate(facts, 1):
+                if line.strip():
+                    try:
+                        record = json.loads(line)
+                    except ValueError as ex:
+                        raise FleetError("Invalid JSON in {} line {} - cause {}".format(path, number, ex))
+                    hosts.append(_host(record, "{} line {}".format(path, number)))
+
+    names = set()
+    for host in hosts:
+        if host.name in names:
+            raise FleetError("Host '{}' is listed more than once in {}".format(host.name, path))
+        names.add(host.name)
+    return hosts
+
+
+class FactMetadata(object):
+    """
+    Instance metadata answered from a host's facts.
+    """
+
+    def __init__(self, facts):
+        self.facts = facts
+
+    def __getattr__(self, name):
+        if name not in InstanceMetadata.ATTRIBUTES:
+            raise AttributeError(name)
+        if name not in self.facts:
+            raise InstanceMetadataError("No '{}' metadata fact for this host".format(name))
+        return self.facts[name]
+
+
+class FactHostResolver(BaseResolver):
+    """
+    ``host`` properties answered from a host's facts.
+    """
+
+    def __init__(self, facts):
+        super(FactHostResolver, self).__init__()
+        self.facts = facts
+
+    def resolve(self, key, current_properties):
+        if key[0] in self.facts:
+            return self.facts[key[0]]
+        logger.error("No host fact '{}' for this host".format(key[0]))
+        return None
+
+
+class FleetWorker(object):
+    """
+    Resolves and renders every service file for one host after another.
+
+    The compiled service definitions, the template environment and the SSM
+    parameters fetched are shared by all the hosts a worker renders, while
+    each host has its own tags, metadata and host facts, and its own memo,
+    as the same expression resolves differently from host to host.
+    """
+
+    def __init__(self, args, filenames, configs):
+        self.args = args
+        self.filenames = filenames
+        self.configs = configs
+        self.templates = shared_environment(args.cache_dir, args.template_archive)
+        self.aws = AWSClientPool()
+        self.paramstore = AWSParamStoreResolver(self.aws)
+
+    def _aws_resolver(self, host):
+        resolver = AWSResolver(self.aws)
+        resolver.tags_resolver.tags = host.tags
+        resolver.metadata_resolver.metadata = FactMetadata(host.metadata)
+        resolver.tags_resolver.metadata = resolver.metadata_resolver.metadata
+        resolver.paramstore_resolver = self.paramstore
+        resolver.paramstore_path_resolver = AWSParamStorePathResolver(self.paramstore)
+        return resolver
+
+    def registry(self, host):
+        registry = ResolverRegistry(aws=self.aws)
+        registry.register("aws", lambda: self._aws_resolver(host))
+        registry.register("host", lambda: FactHostResolver(host.host))
+        return registry
+
+    def render(self, host):
+        """
+        Render a host's outputs beneath its own directory, returning ``(name, changed, unchanged, error)``.
+        """
+        from .main import render_files
+
+        # No persistent cache, as tags and metadata are keyed the same for every host.
+        engine = PropertyEngine(self.registry(host), jobs=self.args.jobs)
+        summary = RunSummary()
+        root = os.path.join(self.args.fleet_output, host.name)
+
+        def resolve(filename, config, dependencies):
+            return engine.resolve(config['properties'], exported_properties(dependencies), source=filename)
+
+        try:
+            for filename, config, resolved_properties in run_pipeline(self.filenames, self.configs.get, resolve):
+                render_files(self.args, config, resolved_properties, summary, templates=self.templates, root=root)
+        except Exception as ex:
+            logger.error("Unable to render host '{}' - cause {}".format(host.name, ex))
+            return host.name, len(summary.changed), len(summary.unchanged), str(ex)
+        return host.name, len(summary.changed), len(summary.unchanged), None
+
+
+_worker = None
+
+
+def _start_worker(args, filenames, configs):
+    global _worker
+    _worker = FleetWorker(args, filenames, configs)
+
+
+def _render(host):
+    return _worker.render(host)
+
+
+def render_fleet(args, filenames, configs, hosts, workers=None):
+    """
+    Render every host of a fleet, spread across a pool of ``workers`` processes
+    (one per CPU by default). Returns the ``(name, changed, unchanged, error)``
+    of each host, in the order they finished.
+    """
+    workers = workers or multiprocessing.cpu_count()
+    start = time.time()
+    results = []
+
+    if workers == 1:
+        _start_worker(args, filenames, configs)
+        results = [_render(host) for host in hosts]
+    else:
+        pool = multiprocessing.Pool(workers, _start_worker, (args, filenames, configs))
+        try:
+            chunksize = max(1, min(50, len(hosts) // (workers * 4)))
+            for result in pool.imap_unordered(_render, hosts, chunksize):
+                results.append(result)
+        finally:
+            pool.close()
+            pool.join()
+
+    logger.info("Rendered {} host(s) in {:.1f}s".format(len(results), time.time() - start))
+    return results
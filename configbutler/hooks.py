@@ -0,0 +1,174 @@
+import logging
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from string import Template
+
+from .engine import GraphScheduler
+
+try:
+    from shlex import quote
+except ImportError:
+    from pipes import quote
+
+logger = logging.getLogger("configbutler")
+
+DEFAULT_TIMEOUT = 300
+MAX_WORKERS = 8
+
+# Each command runs in its own process group, so a timeout kills everything
+# the shell started. preexec_fn is not safe with other threads running, so it
+# is only used where start_new_session is missing (Python 2).
+if sys.version_info[0] >= 3:
+    NEW_SESSION = {"start_new_session": True}
+else:
+    NEW_SESSION = {"preexec_fn": os.setsid}
+
+
+class HookResult(object):
+
+    def __init__(self, command, outputs, returncode=None, duration=0, timed_out=False, skipped_for=None, output=""):
+        self.command = command
+        self.outputs = outputs
+        self.returncode = returncode
+        self.duration = duration
+        self.timed_out = timed_out
+        self.skipped_for = skipped_for
+        self.output = output
+
+    @property
+    def succeeded(self):
+        return self.returncode == 0
+
+    def report(self):
+        if self.skipped_for is not None:
+            status = "skipped as '{}' failed".format(self.skipped_for)
+        elif self.timed_out:
+            status = "timed out after {:.1f}s".format(self.duration)
+        else:
+            status = "exit {} in {:.1f}s".format(self.returncode, self.duration)
+        return "Ran '{}' for {} changed file(s) - {}".format(self.command, len(self.outputs), status)
+
+
+class _HookGraph(object):
+    """
+    The commands to run as a graph for ``GraphScheduler``, where each command
+    depends on the one before it in every ``on_change`` list it appears in.
+    """
+
+    def __init__(self, hooks):
+        self.keys = list(hooks.keys())
+        self.dependencies = dict((command, list(hook["after"])) for command, hook in hooks.items())
+        self.missing = dict()
+
+
+class ChangeHooks(object):
+    """
+    The ``on_change`` commands of the output files changed in a run.
+
+    Each command runs once at the end of the run however many changed files
+    name it. The commands of a single ``on_change`` list run in the order
+    given, and a command only runs once those before it have succeeded, while
+    unrelated commands run in parallel.
+    """
+
+    def __init__(self, timeout=DEFAULT_TIMEOUT):
+        self.timeout = timeout
+        self.hooks = OrderedDict()
+
+    def add(self, on_change, dest, resolved_properties=None):
+        """
+        Queue a file's ``on_change`` commands, as it has changed. Each command is
+        a string, run by the shell, or a mapping of ``command`` and ``timeout``,
+        and may reference the file's properties. Property values come from
+        tags and parameters, so each is shell-quoted, and always substituted
+        as a single word.
+        """
+        if on_change is None:
+            return
+        if not isinstance(on_change, list):
+            on_change = [on_change]
+
+        quoted = dict((name, quote('%s' % (value,))) for name, value in (resolved_properties or {}).items())
+        previous = None
+        for entry in on_change:
+            if isinstance(entry, dict):
+                command, timeout = entry["command"], entry.get("timeout", self.timeout)
+            else:
+                command, timeout = entry, self.timeout
+            command = Template(command).safe_substitute(quoted)
+
+            hook = self.hooks.setdefault(command, {"timeout": timeout, "outputs": [], "after": []})
+            hook["timeout"] = max(hook["timeout"], timeout)
+            if dest not in hook["outputs"]:
+                hook["outputs"].append(dest)
+            if previous is not None and previous != command and previous not in hook["after"]:
+                hook["after"].append(previous)
+            previous = command
+
+    def run(self):
+        """
+        Run the queued commands, returning a ``HookResult`` for each in the order queued.
+        """
+        if len(self.hooks) == 0:
+            return []
+
+        scheduler = GraphScheduler(_HookGraph(self.hooks))
+        results = dict()
+        futures = dict()
+
+        with ThreadPoolExecutor(max_workers=min(len(self.hooks), MAX_WORKERS)) as pool:
+            while not scheduler.finished():
+                for command, _ in scheduler.take():
+                    failed = [name for name in self.hooks[command]["after"] if name in results and not results[name].succeeded]
+                    if len(failed) > 0:
+                        logger.error("Not running '{}' as '{}' failed".format(command, failed[0]))
+                        results[command] = HookResult(command, self.hooks[command]["outputs"], skipped_for=failed[0])
+                        scheduler.complete(command)
+                    else:
+                        futures[pool.submit(self._run, command)] = command
+
+                if len(futures) == 0:
+                    continue
+                done, _ = wait(list(futures.keys()), return_when=FIRST_COMPLETED)
+                for future in done:
+                    command = futures.pop(future)
+                    results[command] = future.result()
+                    scheduler.complete(command)
+
+        return [results[command] for command in self.hooks]
+
+    def _run(self, command):
+        hook = self.hooks[command]
+        logger.info("Running '{}' for {}".format(command, ", ".join(hook["outputs"])))
+
+        start = time.time()
+        process = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, **NEW_SESSION)
+        expired = threading.Event()
+
+        def kill():
+            expired.set()
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except OSError:
+                pass
+
+        timer = threading.Timer(hook["timeout"], kill)
+        timer.start()
+        try:
+            output = process.communicate()[0]
+        finally:
+            timer.cancel()
+
+        result = HookResult(command, hook["outputs"], process.returncode, time.time() - start, timed_out=expired.is_set(),
+                            output=output.decode("utf-8", "replace"))
+        if result.timed_out:
+            logger.error("'{}' timed out after {}s".format(command, hook["timeout"]))
+        elif not result.succeeded:
+            logger.error("'{}' failed with exit {}: {}".format(command, process.returncode, result.output.strip()))
+        return result
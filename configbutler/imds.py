@@ -0,0 +1,210 @@
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from urllib.parse import quote
+except ImportError:
+    from urllib import quote
+
+logger = logging.getLogger("configbutler")
+
+
+def _urllib():
+    """
+    The urllib request API, imported on first use as it is slow to load and
+    only needed when instance metadata is actually read.
+    """
+    try:
+        from urllib.request import Request, urlopen
+        from urllib.error import HTTPError, URLError
+    except ImportError:
+        from urllib2 import Request, urlopen, HTTPError, URLError
+    return Request, urlopen, HTTPError, URLError
+
+
+def _text(body):
+    return body
+
+
+def _lines(body):
+    return body.splitlines()
+
+
+class InstanceMetadataError(Exception):
+
+    def __init__(self, message):
+        super(InstanceMetadataError, self).__init__(message)
+
+
+class InstanceMetadata(object):
+    """
+    A client for the EC2 instance metadata service (IMDS).
+
+    Every attribute is fetched at most once and then served from a snapshot,
+    and every request reuses a single IMDSv2 session token. ``prefetch`` loads
+    a set of attributes concurrently, so a config reading many attributes pays
+    for one round trip rather than one per attribute. Attributes are also
+    readable as properties (eg. ``metadata.instance_id``).
+    """
+
+    BASE_URL = "http://169.254.169.254"
+    TOKEN_TTL = 21600
+    TIMEOUT = 2
+    MAX_WORKERS = 8
+
+    # The attributes read from a metadata path, and how to parse each response.
+    PATHS = {
+        "ami_id": ("meta-data/ami-id", _text),
+        "ami_launch_index": ("meta-data/ami-launch-index", int),
+        "availability_zone": ("meta-data/placement/availability-zone", _text),
+        "iam_info": ("meta-data/iam/info", json.loads),
+        "instance_action": ("meta-data/instance-action", _text),
+        "instance_id": ("meta-data/instance-id", _text),
+        "instance_identity_document": ("dynamic/instance-identity/document", json.loads),
+        "instance_type": ("meta-data/instance-type", _text),
+        "private_hostname": ("meta-data/local-hostname", _text),
+        "private_ipv4": ("meta-data/local-ipv4", _text),
+        "public_hostname": ("meta-data/public-hostname", _text),
+        "public_ipv4": ("meta-data/public-ipv4", _text),
+        "security_groups": ("meta-data/security-groups", _lines),
+    }
+
+    # The attributes read from a field of another attribute's document.
+    FIELDS = {
+        "account_id": ("instance_identity_document", "accountId"),
+        "region": ("instance_identity_document", "region"),
+        "instance_profile_arn": ("iam_info", "InstanceProfileArn"),
+        "instance_profile_id": ("iam_info", "InstanceProfileId"),
+    }
+
+    ATTRIBUTES = sorted(list(PATHS.keys()) + list(FIELDS.keys()))
+
+    # The attributes that stay the same for the life of the instance.
+    IDENTITY = ("ami_id", "availability_zone", "instance_id", "instance_identity_document")
+
+    def __init__(self, base_url=None):
+        self.base_url = base_url if base_url is not None else self.BASE_URL
+        self.token = None
+        self.token_time = 0
+        self.snapshot = dict()
+        self.lock = threading.Lock()
+        self.token_lock = threading.Lock()
+
+    def _token(self, renew=False):
+        Request, urlopen, HTTPError, URLError = _urllib()
+        with self.token_lock:
+            if renew or self.token is None or time.time() - self.token_time > self.TOKEN_TTL - 60:
+                request = Request(self.base_url + "/latest/api/token",
+                                  headers={"X-aws-ec2-metadata-token-ttl-seconds": str(self.TOKEN_TTL)})
+                request.get_method = lambda: "PUT"
+                try:
+                    self.token = urlopen(request, timeout=self.TIMEOUT).read().decode("utf-8")
+                except (HTTPError, URLError) as ex:
+                    # IMDSv1 only instances do not issue tokens, continue without one.
+                    logger.debug("Unable to obtain an IMDSv2 token - cause {}".format(ex))
+                    self.token = ""
+                self.token_time = time.time()
+            return self.token
+
+    def request(self, path):
+        """
+        Return the body of a metadata path, or None when the path does not exist.
+        """
+        Request, urlopen, HTTPError, URLError = _urllib()
+        for renew in (False, True):
+            token = self._token(renew)
+            request = Request(self.base_url + "/latest/" + path,
+                              headers={"X-aws-ec2-metadata-token": token} if token else {})
+            try:
+                return urlopen(request, timeout=self.TIMEOUT).read().decode("utf-8")
+            except HTTPError as ex:
+                if ex.code == 404:
+                    return None
+                if ex.code != 401 or renew:
+                    raise InstanceMetadataError("Unable to read instance metadata '{}' - cause {}".format(path, ex))
+            except URLError as ex:
+                raise InstanceMetadataError("Unable to read instance metadata '{}' - cause {}".format(path, ex))
+
+    def _fetch(self, name):
+        path, parse = self.PATHS[name]
+        body = self.request(path)
+        return None if body is None else parse(body)
+
+    def prefetch(self, names):
+        """
+        Load every named attribute not already in the snapshot, concurrently.
+        """
+        wanted = []
+        for name in names:
+            name = self.FIELDS[name][0] if name in self.FIELDS else name
+            if name in self.PATHS and name not in self.snapshot and name not in wanted:
+                wanted.append(name)
+        if len(wanted) == 0:
+            return
+
+        # Obtain the session token before fanning out, so it is shared by every request.
+        self._token()
+        with ThreadPoolExecutor(max_workers=min(len(wanted), self.MAX_WORKERS)) as pool:
+            results = list(pool.map(self._try_fetch, wanted))
+
+        with self.lock:
+            for name, (fetched, value) in zip(wanted, results):
+                if fetched:
+                    self.snapshot.setdefault(name, value)
+
+    def _try_fetch(self, name):
+        try:
+            return True, self._fetch(name)
+        except InstanceMetadataError as ex:
+            # Left out of the snapshot, so the failure is reported when the attribute is read.
+            logger.debug(str(ex))
+            return False, None
+
+    def get(self, name):
+        if name in self.FIELDS:
+            source, field = self.FIELDS[name]
+            document = self.get(source)
+            return None if document is None else document.get(field)
+
+        with self.lock:
+            if name in self.snapshot:
+                return self.snapshot[name]
+
+        value = self._fetch(name)
+        with self.lock:
+            return self.snapshot.setdefault(name, value)
+
+    def refresh(self):
+        """
+        Forget every attribute but the instance's identity, so the rest are
+        fetched again when next read.
+        """
+        with self.lock:
+            for name in list(self.snapshot.keys()):
+                if name not in self.IDENTITY:
+                    del self.snapshot[name]
+
+    def instance_tags(self):
+        """
+        Return the instance's tags from the metadata tags endpoint, or None when
+        access to tags in instance metadata is not enabled for the instance.
+        """
+        listing = self.request("meta-data/tags/instance")
+        if listing is None:
+            return None
+
+        keys = listing.splitlines()
+        if len(keys) == 0:
+            return dict()
+
+        with ThreadPoolExecutor(max_workers=min(len(keys), self.MAX_WORKERS)) as pool:
+            values = list(pool.map(lambda key: self.request("meta-data/tags/instance/" + quote(key, safe="")), keys))
+        return dict((key, value) for key, value in zip(keys, values) if value is not None)
+
+    def __getattr__(self, name):
+        if name in InstanceMetadata.PATHS or name in InstanceMetadata.FIELDS:
+            return self.get(name)
+        raise AttributeError(name)
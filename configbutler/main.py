@@ -3,28 +3,33 @@ import os
 import yaml
 import argparse
 import logging
-from .resolvers import StringResolver, AWSResolver, LocalHostResolver, MathResolver, UnsafeSubstitution
-# from .service import install_service
-
+from .registry import ResolverRegistry
+from .resolvers import AWSClientPool
+from .service import ConvergenceDaemon, install_service, send_command
+
+from .cache import ResolverCache, DEFAULT_TTLS
+from .configs import ConfigCache, compile_config
+from .engine import PropertyEngine
+from .expressions import ExpressionError
+from .fleet import FleetError, load_facts, render_fleet
+from .hooks import ChangeHooks, DEFAULT_TIMEOUT
+from .manifest import Manifest, template_inputs
+from .metrics import RunMetrics
+from .output import RunSummary, stream_file
+from .pipeline import PipelineError, exported_properties, run_pipeline
+from .templates import compile_templates, shared_environment
+from .trace import Tracer, untraced
 from . import _version
 from string import Template
-from jinja2 import Environment, FileSystemLoader, select_autoescape
 
 logger = logging.getLogger("configbutler")
 
 
-def lookup_resolver(resolver_name):
+def lookup_resolver(resolver_name, registry=None):
 
-    if resolver_name == 'string':
-        return StringResolver()
-    elif resolver_name == 'aws':
-        return AWSResolver()
-    elif resolver_name == "host":
-        return LocalHostResolver()
-    elif resolver_name == "math":
-        return MathResolver()
-    else:
-        return None
+    if registry is None:
+        registry = ResolverRegistry()
+    return registry.get(resolver_name)
 
 
 def parse_args(args):
@@ -35,8 +40,47 @@ def parse_args(args):
 
     parser.add_argument('-s', '--show_properties', action="store_true", help='Print the resolved set of properties')
     parser.add_argument('-n', '--dry_run', action="store_true", help="Show the output of the generated files.")
+    parser.add_argument('-j', '--jobs', type=int, default=1, metavar="N",
+                        help="Resolve up to N independent properties concurrently.")
+    parser.add_argument('--cache-dir', metavar="DIR",
+                        help="Cache resolved AWS values in DIR between runs.")
+    parser.add_argument('--paramstore-ttl', type=int, default=300, metavar="SECONDS",
+                        help="How long cached SSM parameters are used for (default 300).")
+    parser.add_argument('--stale-if-error', action="store_true",
+                        help="Use the last cached value when an AWS lookup fails.")
+    parser.add_argument('--detailed-exitcode', action="store_true",
+                        help="Exit with status 2 when any output file was changed.")
+    parser.add_argument('--hook-timeout', type=float, default=DEFAULT_TIMEOUT, metavar="SECONDS",
+                        help="How long an on_change command may run before it is killed (default {}).".format(DEFAULT_TIMEOUT))
+    parser.add_argument('--template-archive', metavar="FILE",
+                        help="Load precompiled templates from an archive built with --compile-templates.")
+    parser.add_argument('--compile-templates', metavar="FILE",
+                        help="Precompile the templates used by the configuration into an archive, then exit.")
+    parser.add_argument('--tags-deadline', type=float, default=30, metavar="SECONDS",
+                        help="How long to keep retrying when the instance has no tags yet (default 30).")
+    parser.add_argument('--trace', metavar="FILE",
+                        help="Record every property resolved as a span in FILE, in Chrome trace-event JSON.")
+    parser.add_argument('--profile', metavar="FILE",
+                        help="Run under cProfile and write its stats to FILE.")
+    parser.add_argument('--metrics-file', metavar="FILE",
+                        help="Write run metrics to FILE for the node_exporter textfile collector (eg. configbutler.prom).")
+
+    parser.add_argument('--fleet', metavar="FACTS",
+                        help="Render the configuration for every host in FACTS (JSON lines or .csv) instead of this host, then exit.")
+    parser.add_argument('--fleet-output', metavar="DIR",
+                        help="Where --fleet writes each host's outputs, in a directory per host.")
+    parser.add_argument('--fleet-workers', type=int, metavar="N",
+                        help="How many processes --fleet renders hosts with (default one per CPU).")
 
     parser.add_argument('--install-service', action="store_true", help="Install configbutler as service to execute on boot.")
+    parser.add_argument('--daemon', action="store_true",
+                        help="Keep running, converging the configuration every --interval seconds.")
+    parser.add_argument('--interval', type=float, default=300, metavar="SECONDS",
+                        help="How often the daemon converges the configuration (default 300).")
+    parser.add_argument('--control-socket', metavar="PATH",
+                        help="The daemon's control socket, for the run, status and stop commands.")
+    parser.add_argument('--send', metavar="COMMAND", choices=["run", "status", "stop"],
+                        help="Send a command to the daemon listening on --control-socket, then exit.")
     parser.add_argument("-v", "--verbose", dest="verbose_count",
                         action="count", default=0,
                         help="increases log verbosity for each occurrence.")
@@ -65,103 +109,223 @@ def cli(cli_args):
     # Sets log level to WARN going more verbose for each new -v.
     logger.setLevel(max(3 - args.verbose_count, 0) * 10)
 
+    metrics = None
+    summary = None
     try:
-        # if args.install_service:
-        #     install_service()
-        # else:
-        process(args)
+        if args.install_service:
+            install_service(args)
+            return 0
+        if args.send is not None:
+            if args.control_socket is None:
+                raise ExpectedException("--send needs the daemon's --control-socket")
+            try:
+                print(send_command(args.control_socket, args.send))
+            except (IOError, OSError) as ex:
+                raise ExpectedException("Unable to reach the daemon at '{}' - cause {}".format(args.control_socket, ex))
+            return 0
+        if args.fleet is not None:
+            return fleet(args)
+        if args.daemon:
+            ConvergenceDaemon(args, args.interval, args.control_socket).serve_forever()
+            return 0
+        if args.compile_templates is not None:
+            compile_archive(args)
+            return 0
+
+        if args.metrics_file is not None:
+            metrics = RunMetrics()
+        if args.profile is not None:
+            import cProfile
+            profiler = cProfile.Profile()
+            summary = profiler.runcall(process, args, metrics)
+            profiler.dump_stats(args.profile)
+        else:
+            summary = process(args, metrics)
+        if not args.dry_run:
+            print(summary.report())
+        if len(summary.failed_hooks()) > 0:
+            return 1
+        if args.detailed_exitcode and len(summary.changed) > 0:
+            return 2
     except ExpectedException as ex:
         print(ex)
     except KeyboardInterrupt:
         logger.error('Program interrupted!')
     finally:
+        if metrics is not None:
+            metrics.write(args.metrics_file, summary, success=summary is not None)
         logging.shutdown()
 
+    return 0
 
-def process(args):
 
-    if os.path.exists(args.entrypoint):
-        if os.path.isdir(args.entrypoint):
-            for file_name in os.listdir(args.entrypoint):
-                child = os.path.join(args.entrypoint, file_name)
-                if os.path.isfile(child):
-                    process_file(args, child)
-        else:
-            process_file(args, args.entrypoint)
-    else:
+def config_files(entrypoint):
+    if os.path.isdir(entrypoint):
+        children = [os.path.join(entrypoint, file_name) for file_name in sorted(os.listdir(entrypoint))]
+        return [child for child in children if os.path.isfile(child)]
+    return [entrypoint]
+
+
+def compile_archive(args):
+
+    if not os.path.exists(args.entrypoint):
         raise ExpectedException("Path not found '{}'".format(args.entrypoint))
 
+    configs = [load_config(filename) for filename in config_files(args.entrypoint)]
+    for name in compile_templates(configs, args.compile_templates):
+        print("Compiled template {}".format(name))
 
-def process_file(args, filename):
 
-    print("Processing configuration {}".format(filename))
+def fleet(args):
 
-    config = yaml.load(open(filename, 'r'), Loader=yaml.SafeLoader)
+    if not os.path.exists(args.entrypoint):
+        raise ExpectedException("Path not found '{}'".format(args.entrypoint))
+    if args.fleet_output is None:
+        raise ExpectedException("--fleet needs an --fleet-output directory")
 
-    resolved_properties = resolve_properties(args, config)
-    render_files(args, config, resolved_properties)
+    try:
+        hosts = load_facts(args.fleet)
+        configs = ConfigCache(args.cache_dir)
+        filenames = config_files(args.entrypoint)
+        compiled = dict((filename, configs.load(filename)) for filename in filenames)
+    except (IOError, OSError, FleetError, ExpressionError) as ex:
+        raise ExpectedException(str(ex))
+    configs.save()
+
+    # Everything but the output stream, which cannot be sent to the worker processes.
+    worker_args = argparse.Namespace(**dict((name, value) for name, value in vars(args).items() if name != "o"))
+    results = render_fleet(worker_args, filenames, compiled, hosts, args.fleet_workers)
+
+    failed = sorted((name, error) for name, _, _, error in results if error is not None)
+    for name, error in failed:
+        print("Failed '{}': {}".format(name, error))
+    print("{} host(s) rendered into {}: {} file(s) changed, {} unchanged, {} host(s) failed".format(
+        len(results) - len(failed), args.fleet_output, sum(result[1] for result in results),
+        sum(result[2] for result in results), len(failed)))
+    return 1 if len(failed) > 0 else 0
+
+
+class RunState(object):
+    """
+    The resolvers, caches, manifest, compiled service definitions and templates used by a run. A single run
+    builds its own, while the daemon keeps one warm between runs.
+    """
+
+    def __init__(self, args, metrics=None, ttls=None, manifest=None):
+        # One registry for the whole run, so resolvers and their clients are shared by every file.
+        aws = AWSClientPool(hooks=metrics.hooks()) if metrics is not None else None
+        self.registry = ResolverRegistry(aws=aws, tags_deadline=args.tags_deadline)
+
+        self.cache = None
+        if args.cache_dir is not None:
+            if ttls is None:
+                ttls = dict(DEFAULT_TTLS)
+                ttls["aws|paramstore"] = args.paramstore_ttl
+                ttls["aws|paramstore-path"] = args.paramstore_ttl
+            self.cache = ResolverCache(args.cache_dir, ttls, stale_if_error=args.stale_if_error, instance=self.instance_id)
+        if manifest is None and args.cache_dir is not None:
+            manifest = Manifest(args.cache_dir)
+        self.manifest = manifest
+        self.templates = shared_environment(args.cache_dir, args.template_archive)
+        self.configs = ConfigCache(args.cache_dir)
+
+    def instance_id(self):
+        """
+        The id of the instance from its identity document, which the resolver cache is saved for.
+        """
+        return self.registry.aws.instance_metadata().instance_identity_document["instanceId"]
+
+
+def process(args, metrics=None, state=None):
+
+    if not os.path.exists(args.entrypoint):
+        raise ExpectedException("Path not found '{}'".format(args.entrypoint))
 
+    if state is None:
+        state = RunState(args, metrics)
+    if metrics is not None:
+        tracer = metrics.tracer
+    else:
+        tracer = Tracer() if args.trace is not None else None
+    # A new engine for every run, so expressions are resolved afresh.
+    engine = PropertyEngine(state.registry, jobs=args.jobs, cache=state.cache, tracer=tracer)
+    summary = RunSummary()
+    hooks = ChangeHooks(args.hook_timeout)
+    cache = state.cache
+    manifest = state.manifest
+    templates = state.templates
+    configs = state.configs
+
+    def resolve(filename, config, dependencies):
+        return engine.resolve(config['properties'], exported_properties(dependencies), source=filename)
+
+    # Later files are parsed and resolved in the background while earlier ones are rendered,
+    # but outputs are still rendered and written one file at a time in alphabetical order.
+    # One file is resolved at a time, as the engine already spreads its properties across
+    # --jobs threads, so a run never has more than --jobs lookups in flight.
+    pipeline = run_pipeline(config_files(args.entrypoint), configs.load, resolve, workers=1)
+    try:
+        for filename, config, resolved_properties in pipeline:
+            print("Processing configuration {}".format(filename))
+            show_properties(args, resolved_properties)
+            render_files(args, config, resolved_properties, summary, manifest, configs.digest(filename), templates, tracer, hooks)
+    except (PipelineError, ExpressionError) as ex:
+        raise ExpectedException(str(ex))
+    finally:
+        # Even when a later file fails, as the next run will find these outputs unchanged.
+        summary.hooks = hooks.run()
 
-def resolve_properties(args, config):
+    configs.save()
+    if cache is not None:
+        cache.save()
+    if manifest is not None:
+        manifest.save()
+    if args.trace is not None:
+        tracer.save(args.trace)
+        print(tracer.summary())
 
-    resolved_properties = dict()
-    deferred_properties = list(config['properties'].keys())
-    last_size = 0
-    safe_mode = False
+    return summary
 
-    logger.debug("Properties :")
-    logger.debug(config['properties'])
 
-    # We need to try (until we can't) to expand the available variables
-    while len(deferred_properties) > 0:
+def load_config(filename):
+    with open(filename, 'rb') as config_file:
+        return compile_config(config_file.read())
 
-        # Once we have resolved no more properties, we need to do the final pass in safe mode
-        if last_size == len(deferred_properties):
-            logger.error(deferred_properties)
-            safe_mode = True
 
-        last_size = len(deferred_properties)
+def resolve_properties(args, config, engine=None):
 
-        for key in deferred_properties:
-            value = config['properties'][key]
-            logger.info("Processing property - " + key + " = " + value)
+    if engine is None:
+        engine = PropertyEngine(ResolverRegistry())
 
-            parts = value.split("|")
-            logger.debug("Lookup resolver '{}'".format(parts[0]))
-            resolver = lookup_resolver(parts[0])
+    logger.debug("Properties :")
+    logger.debug(config['properties'])
 
-            try:
-                if resolver is not None:
-                    logger.debug("Resolver found '{}'".format(resolver))
-                    resolver.safe_mode = safe_mode
-                    resolved_value = resolver.resolve(parts[1:], current_properties=resolved_properties)
-                    resolved_properties[key] = resolved_value
-                else:
-                    logger.error("Unable to locate resolver for '{}'".format(parts[0]))
-                    resolved_properties[key] = value
+    resolved_properties = engine.resolve(config['properties'])
+
+    logger.debug("Resolved properties {}".format(resolved_properties))
 
-                deferred_properties.remove(key)
-            except UnsafeSubstitution as ex:
-                logger.info("Resolved properties")
-                logger.info(resolved_properties)
-                logger.info("Deferring render of {}/{} due to {}".format(key, value, ex))
+    show_properties(args, resolved_properties)
+    return resolved_properties
 
-            logger.debug("Progressively resolved properties {}".format(resolved_properties))
 
+def show_properties(args, resolved_properties):
     if args.show_properties:
         print("---------------------")
         print(" Resolved Properties ")
         print("---------------------")
         print(yaml.dump(resolved_properties, default_flow_style=False))
 
-    return resolved_properties
 
-
-def render_files(args, config, resolved_properties):
-    env = Environment(
-        loader=FileSystemLoader('/'),
-        autoescape=select_autoescape(['html', 'xml'])
-    )
+def render_files(args, config, resolved_properties, summary=None, manifest=None, config_digest=None, templates=None,
+                 tracer=None, hooks=None, root=None):
+    """
+    Render the output files of a service definition. With ``root`` every output
+    is written beneath that directory instead, eg. ``/etc/app.conf`` to ``ROOT/etc/app.conf``.
+    """
+    if summary is None:
+        summary = RunSummary()
+    if templates is None:
+        templates = shared_environment()
 
     if not config.get('files') is None:
         for file in config['files']:
@@ -170,24 +334,63 @@ def render_files(args, config, resolved_properties):
 
             template = Template(file["src"])
             resolved_filename = template.safe_substitute(resolved_properties)
+            dest = file['dest'] if root is None else reroot(file['dest'], root)
+
+            use_manifest = manifest is not None and not args.dry_run
+            if use_manifest and manifest.current(dest, config_digest, resolved_filename, resolved_properties):
+                # Nothing this output is built from has changed, so skip loading and rendering its template.
+                logger.info("Unchanged inputs for '{}'".format(dest))
+                summary.skip(dest)
+                continue
+
+            span = tracer.span(dest, "render", {"template": resolved_filename}) if tracer is not None else untraced()
+            with span:
+                template = templates.get_template(resolved_filename)
+
+                # Rendered a chunk at a time, so large outputs are never held in memory whole.
+                chunks = template.generate(resolved_properties)
+                if args.dry_run:
+                    print("DRYRUN: Rendering content for '{}'".format(dest))
+                    print("----------------------")
+                    for chunk in chunks:
+                        sys.stdout.write(chunk)
+                    print("")
+                    print("----------------------")
+                    print("")
+                else:
+                    if root is not None:
+                        _make_parent(dest)
+                    changed = stream_file(dest, chunks)
+                    logger.info("{} '{}'".format("Updated" if changed else "Unchanged", dest))
+                    summary.record(dest, changed)
+                    if changed and hooks is not None:
+                        hooks.add(file.get('on_change'), dest, resolved_properties)
+
+            if use_manifest:
+                manifest.record(dest, config_digest, resolved_filename,
+                                template_inputs(templates.env, resolved_filename, templates.source_loader), resolved_properties)
+
+    return summary
+
+
+def reroot(dest, root):
+    return os.path.join(root, os.path.relpath(os.path.abspath(dest), os.path.sep))
 
-            template = env.get_template(resolved_filename)
 
-            contents = template.render(resolved_properties)
-            if args.dry_run:
-                print("DRYRUN: Rendering content for '{}'".format(file['dest']))
-                print("----------------------")
-                print(contents)
-                print("----------------------")
-                print("")
-            else:
-                with open(file['dest'], 'w') as out:
-                    out.write(contents)
+def _make_parent(path):
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            # Created concurrently by another worker.
+            if not os.path.isdir(directory):
+                raise
 
 
 def main():
     cli_args = sys.argv[1:]
-    cli(cli_args)
+    sys.exit(cli(cli_args))
 
 
 if __name__ == '__main__':
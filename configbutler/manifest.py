@@ -0,0 +1,131 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+
+from .output import file_digest, write_file
+
+logger = logging.getLogger("configbutler")
+
+
+def properties_digest(names, resolved_properties):
+    """
+    The sha256 digest of the named properties' resolved values.
+    """
+    values = [[name, resolved_properties.get(name)] for name in sorted(names)]
+    return hashlib.sha256(json.dumps(values, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def template_inputs(env, name, loader=None):
+    """
+    Find the source files a template is built from (the template itself and
+    everything it includes, imports or extends) and the variables they read.
+
+    Returns ``(templates, variables)``, where ``templates`` maps each source
+    file to its digest, or None when a referenced template is only known at
+    render time. Sources are read through ``loader``, the environment's own
+    loader by default.
+    """
+    from jinja2 import meta
+
+    if loader is None:
+        loader = env.loader
+
+    templates = dict()
+    variables = set()
+    pending = [name]
+    seen = set()
+
+    while len(pending) > 0:
+        current = pending.pop()
+        if current in seen:
+            continue
+        seen.add(current)
+
+        source, filename, _ = loader.get_source(env, current)
+        ast = env.parse(source)
+        templates[filename] = file_digest(filename)
+        variables.update(meta.find_undeclared_variables(ast))
+
+        for referenced in meta.find_referenced_templates(ast):
+            if referenced is None:
+                return None
+            pending.append(referenced)
+
+    return templates, variables
+
+
+class Manifest(object):
+    """
+    Records, for every output file, the inputs it was last rendered from: the
+    service definition, the template sources, and the resolved values of the
+    properties the templates read. An output whose inputs are unchanged, and
+    which has not been modified since, does not need to be rendered again.
+
+    Without a ``directory`` the manifest is only kept in memory, for as long
+    as the process runs.
+    """
+
+    FILE_NAME = "manifest.json"
+
+    def __init__(self, directory=None):
+        self.directory = directory
+        self.path = os.path.join(directory, self.FILE_NAME) if directory is not None else None
+        self.entries = None
+        self.dirty = False
+        self.lock = threading.Lock()
+
+    def _entries(self):
+        if self.entries is None:
+            self.entries = dict()
+            if self.path is None:
+                return self.entries
+            try:
+                with open(self.path, "r") as manifest_file:
+                    self.entries = json.load(manifest_file)
+            except (IOError, OSError):
+                pass
+            except ValueError as ex:
+                logger.warning("Ignoring unreadable manifest '{}' - cause {}".format(self.path, ex))
+        return self.entries
+
+    def current(self, dest, config_digest, template_name, resolved_properties):
+        with self.lock:
+            entry = self._entries().get(dest)
+        if entry is None:
+            return False
+
+        if entry["config"] != config_digest or entry["template"] != template_name:
+            return False
+        for filename, digest in entry["templates"].items():
+            if file_digest(filename) != digest:
+                return False
+        if entry["properties"] != properties_digest(entry["variables"], resolved_properties):
+            return False
+        return file_digest(dest) == entry["output"]
+
+    def record(self, dest, config_digest, template_name, inputs, resolved_properties):
+        with self.lock:
+            if inputs is None:
+                self._entries().pop(dest, None)
+            else:
+                templates, variables = inputs
+                self._entries()[dest] = {
+                    "config": config_digest,
+                    "template": template_name,
+                    "templates": templates,
+                    "variables": sorted(variables),
+                    "properties": properties_digest(variables, resolved_properties),
+                    "output": file_digest(dest),
+                }
+            self.dirty = True
+
+    def save(self):
+        with self.lock:
+            if not self.dirty or self.directory is None:
+                return
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory, 0o700)
+            write_file(self.path, json.dumps(self.entries, sort_keys=True))
+            self.dirty = False
@@ -0,0 +1,151 @@
+import logging
+import threading
+import time
+from collections import Counter
+
+from .output import write_file
+from .trace import Tracer
+
+logger = logging.getLogger("configbutler")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+THROTTLE_CODES = frozenset([
+    "Throttling",
+    "ThrottlingException",
+    "ThrottledException",
+    "RequestLimitExceeded",
+    "RequestThrottled",
+    "TooManyRequestsException",
+])
+
+
+def _labels(**labels):
+    if len(labels) == 0:
+        return ""
+    escaped = ['{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+               for name, value in sorted(labels.items())]
+    return "{" + ",".join(escaped) + "}"
+
+
+def _error_code(parsed):
+    if isinstance(parsed, dict):
+        return parsed.get("Error", {}).get("Code")
+    return None
+
+
+class RunMetrics(object):
+    """
+    The metrics of a single run, written in the node_exporter textfile
+    collector format.
+
+    Resolver calls and cache hits are taken from the spans of ``tracer``, AWS
+    API calls and throttles are counted by the botocore event ``hooks``, and
+    the output files from the run's ``RunSummary``.
+    """
+
+    def __init__(self):
+        self.start = time.time()
+        self.tracer = Tracer()
+        self.api_calls = Counter()
+        self.api_errors = Counter()
+        self.throttles = Counter()
+        self.lock = threading.Lock()
+
+    def hooks(self):
+        return [("after-call", self._after_call), ("needs-retry", self._needs_retry)]
+
+    def _after_call(self, model=None, parsed=None, **kwargs):
+        operation = (model.service_model.service_name, model.name)
+        with self.lock:
+            self.api_calls[operation] += 1
+            code = _error_code(parsed)
+            if code is not None:
+                self.api_errors[operation + (code,)] += 1
+
+    def _needs_retry(self, operation=None, response=None, **kwargs):
+        # Called after every attempt, including those that are retried within a single call.
+        if response is None or _error_code(response[1]) not in THROTTLE_CODES:
+            return None
+        with self.lock:
+            self.throttles[(operation.service_model.service_name, operation.name)] += 1
+        return None
+
+    def render(self, summary=None, success=True):
+        lines = []
+
+        def metric(name, metric_type, description, samples):
+            lines.append("# HELP {} {}".format(name, description))
+            lines.append("# TYPE {} {}".format(name, metric_type))
+            for suffix, labels, value in samples:
+                lines.append("{}{}{} {}".format(name, suffix, labels, value))
+
+        metric("configbutler_run_duration_seconds", "gauge", "Wall time of the last run.",
+               [("", "", "{:.6f}".format(time.time() - self.start))])
+        metric("configbutler_last_run_timestamp_seconds", "gauge", "When the last run started.",
+               [("", "", "{:.3f}".format(self.start))])
+        metric("configbutler_run_success", "gauge", "Whether the last run completed.",
+               [("", "", 1 if success else 0)])
+
+        calls = dict()
+        cache = Counter()
+        for event in self.tracer.events:
+            if event["cat"] != "property":
+                continue
+            args = event["args"]
+            outcome = args.get("cache")
+            if outcome is not None:
+                cache[outcome] += 1
+            if outcome in ("hit", "memo"):
+                continue
+            calls.setdefault((args["resolver"], args.get("sub_resolver") or ""), []).append(event["dur"] / 1000000.0)
+
+        metric("configbutler_resolver_calls_total", "counter", "Resolver invocations, by resolver.",
+               [("", _labels(resolver=resolver, sub_resolver=sub_resolver), len(durations))
+                for (resolver, sub_resolver), durations in sorted(calls.items())])
+
+        samples = []
+        for (resolver, sub_resolver), durations in sorted(calls.items()):
+            for bound in LATENCY_BUCKETS:
+                samples.append(("_bucket", _labels(resolver=resolver, sub_resolver=sub_resolver, le=bound),
+                                len([duration for duration in durations if duration <= bound])))
+            samples.append(("_bucket", _labels(resolver=resolver, sub_resolver=sub_resolver, le="+Inf"), len(durations)))
+            samples.append(("_sum", _labels(resolver=resolver, sub_resolver=sub_resolver), "{:.6f}".format(sum(durations))))
+            samples.append(("_count", _labels(resolver=resolver, sub_resolver=sub_resolver), len(durations)))
+        metric("configbutler_resolver_duration_seconds", "histogram", "Resolver latency, by resolver.", samples)
+
+        metric("configbutler_cache_lookups_total", "counter",
+               "Property lookups by outcome: hit or miss in the persistent cache, memo for values already resolved in the run, stale for last known values used after an error.",
+               [("", _labels(outcome=outcome), count) for outcome, count in sorted(cache.items())])
+
+        with self.lock:
+            metric("configbutler_aws_api_calls_total", "counter", "AWS API calls, by operation.",
+                   [("", _labels(service=service, operation=operation), count)
+                    for (service, operation), count in sorted(self.api_calls.items())])
+            metric("configbutler_aws_api_errors_total", "counter", "AWS API calls that failed, by operation and error code.",
+                   [("", _labels(service=service, operation=operation, code=code), count)
+                    for (service, operation, code), count in sorted(self.api_errors.items())])
+            metric("configbutler_aws_api_throttles_total", "counter", "AWS API attempts that were throttled, by operation.",
+                   [("", _labels(service=service, operation=operation), count)
+                    for (service, operation), count in sorted(self.throttles.items())])
+
+        if summary is not None:
+            metric("configbutler_files", "gauge", "Output files of the last run, by state.", [
+                ("", _labels(state="rendered"), len(summary.changed) + len(summary.unchanged) - len(summary.skipped)),
+                ("", _labels(state="changed"), len(summary.changed)),
+                ("", _labels(state="unchanged"), len(summary.unchanged)),
+                ("", _labels(state="skipped"), len(summary.skipped)),
+            ])
+            failed = len(summary.failed_hooks())
+            metric("configbutler_hooks", "gauge", "on_change commands run in the last run, by outcome.", [
+                ("", _labels(outcome="succeeded"), len(summary.hooks) - failed),
+                ("", _labels(outcome="failed"), failed),
+            ])
+
+        return "\n".join(lines) + "\n"
+
+    def write(self, path, summary=None, success=True):
+        """
+        Write the metrics to ``path``, atomically, so the collector never reads a partial file.
+        """
+        write_file(path, self.render(summary, success))
@@ -0,0 +1,141 @@
+import hashlib
+import logging
+import os
+import tempfile
+
+logger = logging.getLogger("configbutler")
+
+
+def file_digest(path):
+    """
+    The sha256 digest of a file's contents, or None when it does not exist.
+    """
+    digest = hashlib.sha256()
+    try:
+        with open(path, "rb") as existing:
+            for chunk in iter(lambda: existing.read(65536), b""):
+                digest.update(chunk)
+    except (IOError, OSError):
+        return None
+    return digest.hexdigest()
+
+
+def _default_mode():
+    umask = os.umask(0)
+    os.umask(umask)
+    return 0o666 & ~umask
+
+
+def write_file(dest, contents):
+    """
+    Write ``contents`` to ``dest`` unless it already holds exactly that content.
+
+    The new content is written to a temporary file beside ``dest``, synced, and
+    renamed over it, so readers only ever see the old or the new file. An
+    existing file's mode and ownership are carried over, and a symlinked
+    ``dest`` has its target replaced, leaving the link in place. Returns whether the
+    file was changed. Text is written as UTF-8, and bytes as they are.
+    """
+    data = contents if isinstance(contents, bytes) else contents.encode("utf-8")
+    if file_digest(dest) == hashlib.sha256(data).hexdigest():
+        return False
+    return _replace(dest, [data], None)
+
+
+def stream_file(dest, chunks):
+    """
+    Like ``write_file``, but writes the text ``chunks`` as they are produced,
+    such as those of a template's ``generate()``, so the whole content is
+    never held in memory. It is hashed as it is written, and the temporary
+    file discarded when it matches what ``dest`` already holds.
+    """
+    return _replace(dest, (chunk.encode("utf-8") for chunk in chunks), file_digest(dest))
+
+
+def _replace(dest, chunks, existing_digest):
+    # Write through symlinks, replacing the file they point at rather than the link.
+    dest = os.path.realpath(dest)
+    directory = os.path.dirname(dest)
+    try:
+        existing = os.stat(dest)
+    except OSError:
+        existing = None
+
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix="." + os.path.basename(dest) + ".")
+    try:
+        digest = hashlib.sha256()
+        with os.fdopen(fd, "wb") as out:
+            for data in chunks:
+                digest.update(data)
+                out.write(data)
+            if digest.hexdigest() == existing_digest:
+                os.remove(temp_path)
+                return False
+
+            out.flush()
+            os.fsync(out.fileno())
+
+            if existing is None:
+                os.fchmod(out.fileno(), _default_mode())
+            else:
+                os.fchmod(out.fileno(), existing.st_mode & 0o7777)
+                try:
+                    os.fchown(out.fileno(), existing.st_uid, existing.st_gid)
+                except OSError as ex:
+                    logger.warning("Unable to preserve ownership of '{}' - cause {}".format(dest, ex))
+
+        os.rename(temp_path, dest)
+    except:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+    _fsync_directory(directory)
+    return True
+
+
+def _fsync_directory(directory):
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class RunSummary(object):
+    """
+    The output files of a run, split by whether their content changed. Files
+    skipped without rendering, as their inputs were unchanged, are also
+    counted as unchanged. ``hooks`` holds the results of the ``on_change``
+    commands run for the changed files.
+    """
+
+    def __init__(self):
+        self.changed = []
+        self.unchanged = []
+        self.skipped = []
+        self.hooks = []
+
+    def record(self, dest, changed):
+        if changed:
+            self.changed.append(dest)
+        else:
+            self.unchanged.append(dest)
+
+    def skip(self, dest):
+        self.skipped.append(dest)
+        self.unchanged.append(dest)
+
+    def failed_hooks(self):
+        return [hook for hook in self.hooks if not hook.succeeded]
+
+    def report(self):
+        lines = ["Changed '{}'".format(dest) for dest in self.changed]
+        lines.extend(hook.report() for hook in self.hooks)
+        lines.append("{} file(s) changed, {} unchanged".format(len(self.changed), len(self.unchanged)))
+        return "\n".join(lines)
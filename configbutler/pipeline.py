@@ -0,0 +1,133 @@
+import logging
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+logger = logging.getLogger("configbutler")
+
+
+class PipelineError(ValueError):
+
+    def __init__(self, message):
+        super(PipelineError, self).__init__(message)
+
+
+def _as_list(value):
+    if value is None:
+        return []
+    if not isinstance(value, list):
+        return [value]
+    return value
+
+
+def _dependencies(filename, config, known, earlier_exporters):
+    dependencies = list(earlier_exporters)
+    for name in _as_list(config.get('depends_on')):
+        if name not in known:
+            raise PipelineError("Unknown dependency '{}' of '{}'".format(name, filename))
+        if known[name] not in dependencies:
+            dependencies.append(known[name])
+    return dependencies
+
+
+def exported_properties(dependencies):
+    """
+    The properties a service file imports from the ``(config, resolved)`` results
+    of its dependencies: each one's ``exports``, with later files overriding
+    earlier ones.
+    """
+    context = dict()
+    for config, resolved_properties in dependencies:
+        for name in _as_list(config.get('exports')):
+            if name not in resolved_properties:
+                logger.warning("Exported property '{}' is not defined".format(name))
+                continue
+            context[name] = resolved_properties[name]
+    return context
+
+
+def _check_acyclic(dependencies):
+    state = dict()
+
+    def visit(filename, chain):
+        if state.get(filename) == "done":
+            return
+        if state.get(filename) == "visiting":
+            raise PipelineError("Circular service dependency ({})".format(
+                " -> ".join(os.path.basename(name) for name in chain[chain.index(filename):] + [filename])))
+        state[filename] = "visiting"
+        for dependency in dependencies[filename]:
+            visit(dependency, chain + [filename])
+        state[filename] = "done"
+
+    for filename in dependencies:
+        visit(filename, [])
+
+
+def run_pipeline(filenames, load, resolve, workers=1):
+    """
+    Load and resolve a set of service definitions in the background, and
+    generate ``(filename, config, resolved)`` for each in the given order.
+
+    Files are loaded concurrently, then each is resolved, on a pool of
+    ``workers`` threads, as soon as the files it depends on are resolved: those
+    named in its ``depends_on`` list and every earlier file with ``exports``.
+    Later files progress while the caller handles earlier ones.
+
+    ``load`` is called with each file name, and ``resolve`` with each file name,
+    its loaded config and the ``(config, resolved)`` results of its dependencies
+    in order.
+    """
+    known = dict((os.path.basename(filename), filename) for filename in filenames)
+    position = dict((filename, index) for index, filename in enumerate(filenames))
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        loaded = [pool.submit(load, filename) for filename in filenames]
+        configs = dict((filename, future.result()) for filename, future in zip(filenames, loaded))
+
+        dependencies = dict()
+        exporters = []
+        for filename in filenames:
+            dependencies[filename] = sorted(_dependencies(filename, configs[filename], known, exporters), key=position.get)
+            if configs[filename].get('exports'):
+                exporters.append(filename)
+        _check_acyclic(dependencies)
+
+        results = dict((filename, Future()) for filename in filenames)
+        remaining = dict((filename, set(dependencies[filename])) for filename in filenames)
+        lock = threading.Lock()
+
+        def start(filename):
+            inputs = [(configs[name], results[name].result()) for name in dependencies[filename]]
+            future = pool.submit(resolve, filename, configs[filename], inputs)
+            future.add_done_callback(lambda done: finish(filename, done))
+
+        def finish(filename, done):
+            error = done.exception()
+            if error is not None:
+                results[filename].set_exception(error)
+            else:
+                results[filename].set_result(done.result())
+
+            ready = []
+            with lock:
+                for dependent in filenames:
+                    if filename in remaining[dependent]:
+                        remaining[dependent].discard(filename)
+                        if len(remaining[dependent]) == 0:
+                            ready.append(dependent)
+
+            for dependent in ready:
+                failed = [name for name in dependencies[dependent] if results[name].exception() is not None]
+                if len(failed) > 0:
+                    # a file whose dependency failed fails the same way, as do its own dependents
+                    finish(dependent, results[failed[0]])
+                else:
+                    start(dependent)
+
+        for filename in filenames:
+            if len(remaining[filename]) == 0:
+                start(filename)
+
+        for filename in filenames:
+            yield filename, configs[filename], results[filename].result()
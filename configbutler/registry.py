@@ -0,0 +1,90 @@
+import logging
+import threading
+
+from .resolvers import StringResolver, AWSResolver, LocalHostResolver, MathResolver, AWSClientPool
+
+logger = logging.getLogger("configbutler")
+
+ENTRY_POINT_GROUP = "configbutler.resolvers"
+
+
+def _entry_points():
+    """
+    The resolvers installed by other distributions under the ``configbutler.resolvers``
+    entry point group, keyed by resolver name.
+    """
+    try:
+        from importlib.metadata import entry_points
+    except ImportError:
+        from pkg_resources import iter_entry_points
+        return dict((ep.name, ep) for ep in iter_entry_points(ENTRY_POINT_GROUP))
+
+    eps = entry_points()
+    if hasattr(eps, "select"):
+        eps = eps.select(group=ENTRY_POINT_GROUP)
+    else:
+        eps = eps.get(ENTRY_POINT_GROUP, [])
+    return dict((ep.name, ep) for ep in eps)
+
+
+class ResolverRegistry(object):
+    """
+    The resolvers available to a single run of configbutler.
+
+    Each resolver is constructed on first use and then shared by every property
+    that names it, so any state it holds (boto3 clients, fetched tags, metadata)
+    is built once per run. Resolvers beyond the built in set are discovered from
+    the ``configbutler.resolvers`` entry point group, where each entry point
+    names a callable returning the resolver instance.
+    """
+
+    def __init__(self, aws=None, tags_deadline=None):
+        self.aws = aws if aws is not None else AWSClientPool()
+        self.resolvers = dict()
+        self.factories = {
+            "string": StringResolver,
+            "aws": lambda: AWSResolver(self.aws, tags_deadline=tags_deadline),
+            "host": LocalHostResolver,
+            "math": MathResolver,
+        }
+        self.plugins = None
+        self.lock = threading.Lock()
+
+    def register(self, name, factory):
+        self.factories[name] = factory
+        self.resolvers.pop(name, None)
+
+    def _factory(self, resolver_name):
+        if resolver_name in self.factories:
+            return self.factories[resolver_name]
+
+        if self.plugins is None:
+            self.plugins = _entry_points()
+
+        entry_point = self.plugins.get(resolver_name)
+        if entry_point is None:
+            return None
+
+        logger.debug("Loading resolver '{}' from {}".format(resolver_name, entry_point))
+        factory = entry_point.load()
+        self.factories[resolver_name] = factory
+        return factory
+
+    def refresh(self):
+        """
+        Refresh every resolver constructed so far that supports it, see ``AWSResolver.refresh``.
+        """
+        with self.lock:
+            resolvers = list(self.resolvers.values())
+        for resolver in resolvers:
+            if hasattr(resolver, "refresh"):
+                resolver.refresh()
+
+    def get(self, resolver_name):
+        with self.lock:
+            if resolver_name not in self.resolvers:
+                factory = self._factory(resolver_name)
+                if factory is None:
+                    return None
+                self.resolvers[resolver_name] = factory()
+            return self.resolvers[resolver_name]
@@ -1,14 +1,17 @@
 
 import logging
 import socket
-import boto3
 import time
+import random
 
 from string import Template
-from botocore.exceptions import ClientError
-from psutil import virtual_memory
-from ec2_metadata import EC2Metadata
 import multiprocessing
+import threading
+from collections import OrderedDict
+
+from .arithmetic import evaluate
+from .imds import InstanceMetadata, InstanceMetadataError
+from .trace import annotate
 
 logger = logging.getLogger("configbutler")
 
@@ -19,7 +22,86 @@ class UnsafeSubstitution(Exception):
         super(UnsafeSubstitution, self).__init__(cause)
 
 
-class BaseResolver(object):
+class ResolverError(Exception):
+    """
+    Raised when a resolver could not reach its source, as opposed to the source
+    answering that the value does not exist.
+    """
+
+    def __init__(self, message):
+        super(ResolverError, self).__init__(message)
+
+
+def _aws_errors():
+    """
+    The botocore exceptions raised by a failed AWS call. botocore is only
+    imported once an AWS resolver is actually used, to keep startup fast.
+    """
+    from botocore.exceptions import BotoCoreError, ClientError
+    return BotoCoreError, ClientError
+
+
+class AWSClientPool(object):
+    """
+    A single boto3 session, with its clients and the instance metadata, shared
+    by every AWS resolver for the duration of a run.
+
+    Building the session once means credentials are looked up once per run,
+    rather than once for every client. ``hooks`` are ``(event_name, handler)``
+    pairs registered with the session's botocore events before any client is made.
+    """
+
+    def __init__(self, session=None, metadata_url=None, hooks=None):
+        self.session = session
+        self.clients = dict()
+        self.metadata = None
+        self.metadata_url = metadata_url
+        self.hooks = hooks or []
+        self.hooked = False
+        self.lock = threading.Lock()
+
+    def client(self, service_name):
+        with self.lock:
+            if self.session is None:
+                import boto3
+                self.session = boto3.session.Session()
+            if not self.hooked:
+                for event_name, handler in self.hooks:
+                    self.session.events.register(event_name, handler)
+                self.hooked = True
+            if service_name not in self.clients:
+                self.clients[service_name] = self.session.client(service_name)
+            return self.clients[service_name]
+
+    def instance_metadata(self):
+        with self.lock:
+            if self.metadata is None:
+                self.metadata = InstanceMetadata(self.metadata_url)
+            return self.metadata
+
+
+class ThreadLocalSafeMode(object):
+    """
+    Keeps ``safe_mode`` per thread, as a single resolver instance is shared by
+    properties resolving concurrently.
+    """
+
+    @property
+    def safe_mode(self):
+        return getattr(self._local(), "safe_mode", False)
+
+    @safe_mode.setter
+    def safe_mode(self, value):
+        self._local().safe_mode = value
+
+    def _local(self):
+        local = self.__dict__.get("_thread_local")
+        if local is None:
+            local = self.__dict__.setdefault("_thread_local", threading.local())
+        return local
+
+
+class BaseResolver(ThreadLocalSafeMode):
 
     def __init__(self):
         self.safe_mode = False
@@ -36,7 +118,10 @@ class BaseResolver(object):
         return value
 
 
-class BaseSubResolver(object):
+class BaseSubResolver(ThreadLocalSafeMode):
+
+    def __init__(self):
+        self.safe_mode = False
 
     def lookup_sub_resolver(self, resolver_name):
         pass
@@ -44,6 +129,7 @@ class BaseSubResolver(object):
     def resolve(self, parts, current_properties):
         sub_resolver = self.lookup_sub_resolver(parts[0])
         if sub_resolver is not None:
+            sub_resolver.safe_mode = self.safe_mode
             return sub_resolver.resolve(parts[1], current_properties)
 
 
@@ -55,106 +141,151 @@ class StringResolver(BaseResolver):
 
 class AWSInstanceMetadataResolver(BaseResolver):
 
-    def __init__(self):
+    def __init__(self, aws=None):
         super(AWSInstanceMetadataResolver, self).__init__()
+        self.aws = aws if aws is not None else AWSClientPool()
         self.metadata = None
 
     def _metadata(self):
         if self.metadata is None:
-            self.metadata = EC2Metadata()
+            self.metadata = self.aws.instance_metadata()
         return self.metadata
 
+    def prefetch(self, keys, current_properties):
+        metadata = self._metadata()
+        if hasattr(metadata, "prefetch"):
+            metadata.prefetch([key for key in keys if key in InstanceMetadata.ATTRIBUTES])
+
     def resolve(self, parts, current_properties):
 
-        if parts == "account_id":
-            return self._metadata().account_id
-        elif parts == "ami_id":
-            return self._metadata().ami_id
-        elif parts == "ami_launch_index":
-            return self._metadata().ami_launch_index
-        elif parts == "availability_zone":
-            return self._metadata().availability_zone
-        elif parts == "iam_info":
-            return self._metadata().iam_info
-        elif parts == "instance_action":
-            return self._metadata().instance_action
-        elif parts == "instance_id":
-            return self._metadata().instance_id
-        elif parts == "instance_profile_arn":
-            return self._metadata().instance_profile_arn
-        elif parts == "instance_profile_id":
-            return self._metadata().instance_profile_id
-        elif parts == "instance_type":
-            return self._metadata().instance_type
-        elif parts == "private_hostname":
-            return self._metadata().private_hostname
-        elif parts == "private_ipv4":
-            return self._metadata().private_ipv4
-        elif parts == "public_hostname":
-            return self._metadata().public_hostname
-        elif parts == "public_ipv4":
-            return self._metadata().public_ipv4
-        elif parts == "security_groups":
-            return self._metadata().security_groups
-        elif parts == "region":
-            return self._metadata().region
-        else:
+        if parts not in InstanceMetadata.ATTRIBUTES:
             logger.error("Unable to resolve AWS instance attribute '{}'".format(parts))
+            return None
+
+        try:
+            return getattr(self._metadata(), parts)
+        except InstanceMetadataError as ex:
+            raise ResolverError(str(ex))
+
+    def refresh(self):
+        """
+        Forget the metadata that can change while the instance runs, keeping its identity.
+        """
+        if self.metadata is not None and hasattr(self.metadata, "refresh"):
+            self.metadata.refresh()
 
 
 class AWSTagResolver(BaseResolver):
+    """
+    Resolves the tags of the current instance, fetched once per run into an index.
+
+    Tags are read from the instance metadata tags endpoint when it is enabled
+    for the instance, as it is local and not subject to API throttling, and
+    otherwise from the EC2 ``DescribeTags`` API. Tags can be missing for a
+    short while after launch, so an empty tag set is retried with jittered,
+    doubling waits, for at most ``RETRY_COUNT`` attempts and ``deadline``
+    seconds in total.
+    """
 
     RETRY_COUNT = 5
+    RETRY_BACKOFF = 1
+    DEADLINE = 30
 
-    def __init__(self):
+    def __init__(self, aws=None, deadline=None):
         super(AWSTagResolver, self).__init__()
+        self.aws = aws if aws is not None else AWSClientPool()
+        self.deadline = deadline if deadline is not None else self.DEADLINE
+        self.use_metadata = True
         self.client = None
         self.tags = None
+        self.tags_error = None
         self.metadata = None
+        self.lock = threading.Lock()
 
     def _metadata(self):
         if self.metadata is None:
-            self.metadata = EC2Metadata()
+            self.metadata = self.aws.instance_metadata()
         return self.metadata
 
     def _ec2_client(self):
         if self.client is None:
-            self.client = boto3.client('ec2')
+            self.client = self.aws.client('ec2')
         return self.client
 
     def resolve(self, key, current_properties):
 
-        if self.tags is None:
-            self.tags = []
-            backoff_time = 1
-            count = 0
-
-            while len(self.tags) == 0 and count < self.RETRY_COUNT:
-                response = self._ec2_client().describe_tags(
-                    Filters=[
-                        {
-                            'Name': 'resource-id',
-                            'Values': [self._metadata().instance_id]
-                        },
-                    ]
-                )
-                self.tags = response["Tags"]
-                if len(self.tags) == 0:
-                    logger.error("No AWS::tag values found, waiting {}sec to retry.".format(backoff_time))
-                    time.sleep(backoff_time)
-                    backoff_time = backoff_time * 2
-                    count += 1
-
-            if len(self.tags) == 0:
-                logger.error("No AWS::tag values found, continuing with no tags.")
+        with self.lock:
+            if self.tags_error is not None:
+                raise self.tags_error
+            if self.tags is None:
+                try:
+                    self.tags = self._fetch_tags()
+                except _aws_errors() + (InstanceMetadataError,) as ex:
+                    # Remember the failure, so every tag property does not repeat the failing call.
+                    self.tags_error = ResolverError("Unable to lookup AWS::tag values - cause {}".format(ex))
+                    raise self.tags_error
 
         return self.lookup_tag(key=self.resolve_embedded(key, current_properties), tags=self.tags)
 
+    def refresh(self):
+        """
+        Forget the fetched tags, so they are fetched again when next resolved.
+        """
+        with self.lock:
+            self.tags = None
+            self.tags_error = None
+
+    def _instance_tags(self):
+        if self.use_metadata:
+            tags = self._metadata().instance_tags()
+            if tags is not None:
+                return tags
+            logger.debug("Instance metadata tags are not enabled, using the EC2 API")
+            self.use_metadata = False
+
+        return dict((tag["Key"], tag["Value"]) for tag in self._describe_tags())
+
+    def _describe_tags(self):
+        request = {
+            "Filters": [
+                {
+                    'Name': 'resource-id',
+                    'Values': [self._metadata().instance_id]
+                },
+            ]
+        }
+        tags = []
+        while True:
+            response = self._ec2_client().describe_tags(**request)
+            tags.extend(response["Tags"])
+            if not response.get("NextToken"):
+                return tags
+            request["NextToken"] = response["NextToken"]
+
+    def _fetch_tags(self):
+        give_up = time.time() + self.deadline
+        backoff_time = self.RETRY_BACKOFF
+        count = 1
+
+        tags = self._instance_tags()
+        while len(tags) == 0 and count < self.RETRY_COUNT and time.time() < give_up:
+            wait_time = min(backoff_time / 2.0 + random.uniform(0, backoff_time / 2.0), give_up - time.time())
+            logger.error("No AWS::tag values found, waiting {:.1f}sec to retry.".format(wait_time))
+            time.sleep(wait_time)
+            backoff_time = backoff_time * 2
+            count += 1
+            tags = self._instance_tags()
+
+        if len(tags) == 0:
+            logger.error("No AWS::tag values found, continuing with no tags.")
+
+        annotate(retries=count - 1, tags_source="metadata" if self.use_metadata else "ec2")
+        return tags
+
     @staticmethod
     def lookup_tag(key, tags):
-        for tag in tags:
-            if tag["Key"] == key:
-                return tag["Value"]
+        if key in tags:
+            return tags[key]
 
         logger.error("Unable to find AWS::tag named '{}'".format(key))
         return None
@@ -162,33 +293,244 @@ class AWSTagResolver(BaseResolver):
 
 class AWSParamStoreResolver(BaseResolver):
 
-    def __init__(self):
+    BATCH_SIZE = 10
+    DESCRIBE_BATCH_SIZE = 50
+
+    def __init__(self, aws=None):
         super(AWSParamStoreResolver, self).__init__()
+        self.aws = aws if aws is not None else AWSClientPool()
         self.client = None
+        self.pending = []
+        self.pending_paths = []
+        self.paths = set()
+        self.values = dict()
+        self.versions = dict()
+        self.invalid = set()
+        self.lock = threading.Lock()
 
     def _ssm_client(self):
         if self.client is None:
-            self.client = boto3.client('ssm')
+            self.client = self.aws.client('ssm')
         return self.client
 
+    @staticmethod
+    def _prefix(path):
+        return path.rstrip("/") + "/"
+
+    def _covering_path(self, param_key):
+        for prefix in list(self.paths) + self.pending_paths:
+            if param_key.startswith(prefix):
+                return prefix
+        return None
+
+    def prefetch(self, keys, current_properties):
+        """
+        Queue parameter names to be fetched together, in batches of ``BATCH_SIZE``,
+        the first time any one of them is resolved.
+        """
+        with self.lock:
+            for key in keys:
+                try:
+                    param_key = Template(key).substitute(current_properties)
+                except (KeyError, ValueError):
+                    continue
+                if param_key in self.values or param_key in self.invalid or param_key in self.pending:
+                    continue
+                if self._covering_path(param_key) is None:
+                    self.pending.append(param_key)
+
+    def prefetch_path(self, paths, current_properties):
+        """
+        Queue parameter paths to be loaded into the index the first time they,
+        or any parameter beneath them, are resolved.
+        """
+        with self.lock:
+            for path in paths:
+                try:
+                    prefix = self._prefix(Template(path).substitute(current_properties))
+                except (KeyError, ValueError):
+                    continue
+                if prefix not in self.paths and prefix not in self.pending_paths:
+                    self.pending_paths.append(prefix)
+
+    def _fetch_pending(self):
+        pending, self.pending = self.pending, []
+        annotate(batched=len(pending))
+
+        for start in range(0, len(pending), self.BATCH_SIZE):
+            batch = pending[start:start + self.BATCH_SIZE]
+            logger.info("Resolving SSM parameters {}".format(batch))
+            try:
+                response = self._ssm_client().get_parameters(Names=batch, WithDecryption=True)
+            except _aws_errors() as ex:
+                # Leave the batch unfetched, each parameter then falls back to its own lookup.
+                logger.warning("Unable to SSM:paramstore batch lookup {} - cause {}".format(batch, ex))
+                continue
+
+            for param in response["Parameters"]:
+                self._store(param["Name"] + param.get("Selector", ""), param)
+            self.invalid.update(response.get("InvalidParameters", []))
+
+    def _store(self, param_key, param):
+        self.values[param_key] = param["Value"]
+        # A parameter requested with a version or label selector never changes.
+        if param_key == param["Name"] and "Version" in param:
+            self.versions[param_key] = param["Version"]
+
+    def _load_path(self, prefix):
+        if prefix in self.pending_paths:
+            self.pending_paths.remove(prefix)
+
+        logger.info("Resolving SSM parameters under '{}'".format(prefix))
+        request = {
+            "Path": prefix if prefix == "/" else prefix.rstrip("/"),
+            "Recursive": True,
+            "WithDecryption": True,
+        }
+        params = []
+        try:
+            while True:
+                response = self._ssm_client().get_parameters_by_path(**request)
+                params.extend(response["Parameters"])
+                if not response.get("NextToken"):
+                    break
+                request["NextToken"] = response["NextToken"]
+        except _aws_errors() as ex:
+            # Leave the path unloaded, each parameter beneath it then falls back to its own lookup.
+            logger.error("Unable to SSM:paramstore path lookup '{}' - cause {}".format(prefix, ex))
+            return False
+
+        for param in params:
+            self._store(param["Name"], param)
+        self.paths.add(prefix)
+        return True
+
+    def refresh(self):
+        """
+        Compare the versions of the parameters fetched so far with those in
+        Parameter Store, using DescribeParameters which returns no values, and
+        drop the changed parameters from the index so only they are fetched
+        again. A loaded path with any parameter added, changed or removed is
+        loaded again, and parameters that did not exist are looked up again.
+
+        Returns the names of the parameters that changed. When the versions
+        cannot be checked, everything already fetched is kept.
+        """
+        with self.lock:
+            self.invalid = set()
+            paths = sorted(self.paths)
+            names = [name for name in self.versions if not any(name.startswith(prefix) for prefix in paths)]
+            try:
+                current = self._describe_versions(names, paths)
+            except _aws_errors() as ex:
+                logger.warning("Unable to check SSM:paramstore versions, keeping the current values - cause {}".format(ex))
+                return []
+
+            changed = sorted(name for name, version in self.versions.items() if current.get(name) != version)
+            for prefix in paths:
+                known = dict((name, version) for name, version in self.versions.items() if name.startswith(prefix))
+                found = dict((name, version) for name, version in current.items() if name.startswith(prefix))
+                if known != found:
+                    logger.info("SSM parameters under '{}' changed".format(prefix))
+                    self.paths.discard(prefix)
+                    self.pending_paths.append(prefix)
+                    changed.extend(name for name in found if name not in known)
+
+            for name in changed:
+                logger.info("SSM parameter '{}' changed".format(name))
+                self.values.pop(name, None)
+                self.versions.pop(name, None)
+            return changed
+
+    def _describe_versions(self, names, paths):
+        filters = [[{"Key": "Name", "Option": "Equals", "Values": names[start:start + self.DESCRIBE_BATCH_SIZE]}]
+                   for start in range(0, len(names), self.DESCRIBE_BATCH_SIZE)]
+        filters.extend([{"Key": "Path", "Option": "Recursive", "Values": [prefix if prefix == "/" else prefix.rstrip("/")]}]
+                       for prefix in paths)
+
+        versions = dict()
+        for parameter_filters in filters:
+            request = {"ParameterFilters": parameter_filters, "MaxResults": 50}
+            while True:
+                response = self._ssm_client().describe_parameters(**request)
+                for param in response["Parameters"]:
+                    versions[param["Name"]] = param["Version"]
+                if not response.get("NextToken"):
+                    break
+                request["NextToken"] = response["NextToken"]
+        return versions
+
+    def resolve_path(self, path, current_properties):
+        """
+        Resolve every parameter beneath ``path``, keyed by its name relative to the path.
+        """
+        prefix = self._prefix(self.resolve_embedded(path, current_properties))
+
+        with self.lock:
+            if prefix not in self.paths and not self._load_path(prefix):
+                raise ResolverError("Unable to SSM:paramstore path lookup '{}'".format(prefix))
+
+            return dict((name[len(prefix):], value) for name, value in self.values.items() if name.startswith(prefix))
+
     def resolve(self, key, current_properties):
 
         param_key = self.resolve_embedded(key, current_properties)
 
+        with self.lock:
+            if param_key in self.pending:
+                self._fetch_pending()
+
+            prefix = self._covering_path(param_key)
+            if prefix is not None and (prefix in self.paths or self._load_path(prefix)):
+                # Everything beneath a loaded path is in the index, so anything missing does not exist.
+                if param_key not in self.values:
+                    self.invalid.add(param_key)
+
+            if param_key in self.values:
+                annotate(lookup="index")
+                return self.values[param_key]
+            if param_key in self.invalid:
+                logger.error("Unable to SSM:paramstore lookup '{}' - cause parameter not found".format(param_key))
+                return None
+
         logger.info("Resolving SSM parameter '{}'".format(param_key))
+        annotate(lookup="GetParameter")
         try:
             param = self._ssm_client().get_parameter(Name=param_key, WithDecryption=True)
             logger.debug(param)
+            with self.lock:
+                self._store(param_key, param["Parameter"])
             return param["Parameter"]["Value"]
-        except ClientError as ex:
+        except _aws_errors() as ex:
+            # Only a ClientError carries a response, and only ParameterNotFound means the value does not exist.
+            if getattr(ex, "response", {}).get("Error", {}).get("Code") != "ParameterNotFound":
+                raise ResolverError("Unable to SSM:paramstore lookup '{}' - cause {}".format(param_key, ex))
             logger.error("Unable to SSM:paramstore lookup '{}' - cause {}".format(param_key, ex))
 
 
+class AWSParamStorePathResolver(BaseResolver):
+    """
+    Resolves a whole Parameter Store subtree, sharing its index with the
+    ``paramstore`` resolver so later lookups beneath the path need no API call.
+    """
+
+    def __init__(self, paramstore_resolver):
+        super(AWSParamStorePathResolver, self).__init__()
+        self.paramstore_resolver = paramstore_resolver
+
+    def prefetch(self, keys, current_properties):
+        self.paramstore_resolver.prefetch_path(keys, current_properties)
+
+    def resolve(self, key, current_properties):
+        self.paramstore_resolver.safe_mode = self.safe_mode
+        return self.paramstore_resolver.resolve_path(key, current_properties)
+
+
 class LocalHostResolver(BaseResolver):
 
     def __init__(self):
         super(LocalHostResolver, self).__init__()
-        self.mem = virtual_memory()
+        self.mem = None
 
     def resolve(self, key, current_properties):
         if key[0] == "hostname":
@@ -196,6 +538,9 @@ class LocalHostResolver(BaseResolver):
         elif key[0] == "fqdn":
             return socket.getfqdn()
         elif key[0] == "total_memory":
+            if self.mem is None:
+                from psutil import virtual_memory
+                self.mem = virtual_memory()
             return self.mem.total
         elif key[0] == "cpu_count":
             return multiprocessing.cpu_count()
@@ -205,27 +550,59 @@ class LocalHostResolver(BaseResolver):
 
 class AWSResolver(BaseSubResolver):
 
-    def __init__(self):
+    def __init__(self, aws=None, tags_deadline=None):
         super(AWSResolver, self).__init__()
-        self.tags_resolver = AWSTagResolver()
-        self.paramstore_resolver = AWSParamStoreResolver()
-        self.metadata_resolver = AWSInstanceMetadataResolver()
+        self.aws = aws if aws is not None else AWSClientPool()
+        self.tags_resolver = AWSTagResolver(self.aws, deadline=tags_deadline)
+        self.paramstore_resolver = AWSParamStoreResolver(self.aws)
+        self.paramstore_path_resolver = AWSParamStorePathResolver(self.paramstore_resolver)
+        self.metadata_resolver = AWSInstanceMetadataResolver(self.aws)
+
+    def refresh(self):
+        """
+        Bring a long lived resolver up to date before properties are resolved
+        again: tags are fetched again, and only the SSM parameters that have
+        changed. Of the instance metadata, only the instance's identity is kept.
+        """
+        self.tags_resolver.refresh()
+        self.paramstore_resolver.refresh()
+        self.metadata_resolver.refresh()
+
+    def sub_resolvers(self):
+        return OrderedDict([
+            ("tags", self.tags_resolver),
+            # Paths first, so parameters beneath them are served from the path index rather than batched.
+            ("paramstore-path", self.paramstore_path_resolver),
+            ("paramstore", self.paramstore_resolver),
+            ("metadata", self.metadata_resolver),
+        ])
 
     def lookup_sub_resolver(self, resolver_name):
-        if resolver_name == "tags":
-            return self.tags_resolver
-        elif resolver_name == "paramstore":
-            return self.paramstore_resolver
-        elif resolver_name == "metadata":
-            return self.metadata_resolver
-        else:
+        sub_resolver = self.sub_resolvers().get(resolver_name)
+        if sub_resolver is None:
             logger.error("Unable to locate AWS sub-resolver '{}'".format(resolver_name))
+        return sub_resolver
+
+    def prefetch(self, parts_list, current_properties):
+        requests = dict()
+        for parts in parts_list:
+            if len(parts) > 1:
+                requests.setdefault(parts[0], []).append(parts[1])
+
+        for resolver_name, sub_resolver in self.sub_resolvers().items():
+            if resolver_name in requests and hasattr(sub_resolver, "prefetch"):
+                sub_resolver.prefetch(requests[resolver_name], current_properties)
 
 
 class MathResolver(BaseResolver):
 
+    OUTPUT_TYPES = {"int": int, "float": float}
+
     def resolve(self, key, current_properties):
 
+        if key[0] == "expr":
+            return self.resolve_expression(key[1:], current_properties)
+
         val1 = self.resolve_embedded(key[1], current_properties)
         val2 = self.resolve_embedded(key[2], current_properties)
 
@@ -239,3 +616,23 @@ class MathResolver(BaseResolver):
             return float(val1) / float(val2)
         else:
             logger.error("Unable to locate math function '{}'".format(key[0]))
+
+    def resolve_expression(self, key, current_properties):
+        """
+        Evaluate ``math|expr|<expression>``, optionally followed by ``|int`` or
+        ``|float`` to convert the result, eg. ``math|expr|max(${HOST_MEMORY} * 0.8 // 1024, 512)|int``.
+        """
+        expression = self.resolve_embedded(key[0], current_properties)
+        output = key[1] if len(key) > 1 else None
+        if output is not None and output not in self.OUTPUT_TYPES:
+            logger.error("Unknown math expression output '{}', expected int or float".format(output))
+            return None
+
+        try:
+            value = evaluate(expression)
+            if output is not None:
+                value = self.OUTPUT_TYPES[output](value)
+        except (ValueError, ArithmeticError, TypeError) as ex:
+            logger.error("Unable to evaluate '{}' - cause {}".format(expression, ex))
+            return None
+        return value
@@ -0,0 +1,209 @@
+import json
+import logging
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+
+try:
+    from socketserver import StreamRequestHandler, ThreadingMixIn, UnixStreamServer
+except ImportError:
+    from SocketServer import StreamRequestHandler, ThreadingMixIn, UnixStreamServer
+
+from .cache import IDENTITY_TTLS
+from .manifest import Manifest
+from .output import write_file
+
+logger = logging.getLogger("configbutler")
+
+UNIT_PATH = "/etc/systemd/system/configbutler.service"
+
+UNIT = """[Unit]
+Description=Generate configuration files with configbutler
+Wants=network-online.target
+After=network-online.target
+
+[Service]
+ExecStart={command} --daemon --control-socket {socket} {entrypoint}
+Restart=on-failure
+ExecReload=/bin/kill -HUP $MAINPID
+
+[Install]
+WantedBy=multi-user.target
+"""
+
+
+class _ControlServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+
+class ConvergenceDaemon(object):
+    """
+    Keeps the configuration converged, resolving and rendering it every
+    ``interval`` seconds, and whenever asked through the control socket.
+
+    Resolvers, their clients, the instance metadata and the compiled templates
+    stay warm between runs. Before each run after the first the resolvers are
+    refreshed, which for SSM compares parameter versions and fetches only the
+    values that changed, and the manifest then re-renders only the outputs
+    whose inputs changed.
+
+    The control socket takes one command per connection: ``run`` converges
+    immediately and replies with the run summary, ``status`` replies with the
+    state of the last run as JSON, and ``stop`` stops the daemon.
+    """
+
+    def __init__(self, args, interval=300, socket_path=None):
+        from .main import RunState
+
+        self.args = args
+        self.interval = interval
+        self.socket_path = socket_path
+        # The resolvers' own refreshed state replaces the TTL cache, which
+        # would hide changes, so only the instance's identity is persisted.
+        self.state = RunState(args, ttls=IDENTITY_TTLS, manifest=None if args.cache_dir is not None else Manifest())
+        self.trigger = threading.Event()
+        self.stopping = threading.Event()
+        self.lock = threading.Lock()
+        self.server = None
+        self.runs = 0
+        self.last_run = None
+        self.last_summary = None
+        self.last_error = None
+
+    def converge(self):
+        """
+        Run once, returning the run summary. Runs never overlap.
+        """
+        from .main import process
+
+        with self.lock:
+            start = time.time()
+            try:
+                if self.runs > 0:
+                    self.state.registry.refresh()
+                summary = process(self.args, state=self.state)
+            except Exception as ex:
+                logger.error("Configuration run failed - cause {}".format(ex))
+                self.last_error = str(ex)
+                raise
+            finally:
+                self.runs += 1
+                self.last_run = start
+
+            self.last_error = None
+            self.last_summary = summary
+            logger.info("Configuration run took {:.3f}s".format(time.time() - start))
+            return summary
+
+    def status(self):
+        status = {
+            "runs": self.runs,
+            "last_run": self.last_run,
+            "interval": self.interval,
+            "error": self.last_error,
+        }
+        if self.last_summary is not None:
+            status["changed"] = self.last_summary.changed
+            status["unchanged"] = len(self.last_summary.unchanged)
+            status["failed_hooks"] = [hook.command for hook in self.last_summary.failed_hooks()]
+        return status
+
+    def handle(self, command):
+        if command == "run":
+            try:
+                return self.converge().report()
+            except Exception as ex:
+                return "Failed: {}".format(ex)
+        if command == "status":
+            return json.dumps(self.status(), sort_keys=True)
+        if command == "stop":
+            self.stop()
+            return "Stopping"
+        return "Unknown command '{}'".format(command)
+
+    def _serve_control_socket(self):
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+        daemon = self
+
+        class Handler(StreamRequestHandler):
+
+            def handle(self):
+                command = self.rfile.readline().decode("utf-8").strip()
+                self.wfile.write((daemon.handle(command) + "\n").encode("utf-8"))
+
+        # Only the owner may trigger runs.
+        umask = os.umask(0o177)
+        try:
+            self.server = _ControlServer(self.socket_path, Handler)
+        finally:
+            os.umask(umask)
+
+        thread = threading.Thread(target=self.server.serve_forever, args=(0.5,))
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        self.stopping.set()
+        self.trigger.set()
+
+    def serve_forever(self):
+        if self.socket_path is not None:
+            self._serve_control_socket()
+
+        try:
+            signal.signal(signal.SIGTERM, lambda *args: self.stop())
+            signal.signal(signal.SIGHUP, lambda *args: self.trigger.set())
+        except ValueError:
+            # Signal handlers can only be installed from the main thread.
+            pass
+
+        try:
+            while not self.stopping.is_set():
+                try:
+                    print(self.converge().report())
+                except Exception:
+                    pass
+                self.trigger.wait(self.interval)
+                self.trigger.clear()
+        finally:
+            if self.server is not None:
+                self.server.shutdown()
+                self.server.server_close()
+                os.remove(self.socket_path)
+
+
+def send_command(socket_path, command, timeout=None):
+    """
+    Send a command to a running daemon's control socket and return its reply.
+    """
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.settimeout(timeout)
+    try:
+        client.connect(socket_path)
+        client.sendall((command + "\n").encode("utf-8"))
+        reply = []
+        while True:
+            data = client.recv(4096)
+            if not data:
+                break
+            reply.append(data)
+    finally:
+        client.close()
+    return b"".join(reply).decode("utf-8").rstrip("\n")
+
+
+def install_service(args, unit_path=UNIT_PATH):
+    """
+    Install a systemd unit running configbutler as a daemon on boot.
+    """
+    unit = UNIT.format(command="{} -m configbutler.main".format(sys.executable), socket=args.control_socket or "/run/configbutler.sock",
+                       entrypoint=os.path.abspath(args.entrypoint))
+    if write_file(unit_path, unit):
+        print("Installed {}, enable it with 'systemctl enable --now configbutler'".format(unit_path))
+    else:
+        print("{} is up to date".format(unit_path))
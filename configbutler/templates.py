@@ -0,0 +1,151 @@
+import glob
+import logging
+import os
+import re
+
+logger = logging.getLogger("configbutler")
+
+PLACEHOLDER = re.compile(r"\$\{[^}]*\}|\$[_a-zA-Z][_a-zA-Z0-9]*")
+
+
+def _listed_loader(names):
+    """
+    A filesystem loader that lists only the given templates, so they can be
+    compiled without walking the whole filesystem.
+    """
+    from jinja2 import FileSystemLoader
+
+    class ListedLoader(FileSystemLoader):
+
+        def list_templates(self):
+            return sorted(names)
+
+    return ListedLoader('/')
+
+
+def _environment(loader, bytecode_cache=None):
+    from jinja2 import Environment, select_autoescape
+
+    return Environment(
+        loader=loader,
+        autoescape=select_autoescape(['html', 'xml']),
+        bytecode_cache=bytecode_cache,
+    )
+
+
+class TemplateEnvironment(object):
+    """
+    The single Jinja environment shared by every service definition in a process.
+
+    Compiled templates are kept in a ``FileSystemBytecodeCache`` between runs,
+    and when given an ``archive`` built by ``compile_templates`` the templates
+    in it are loaded precompiled, falling back to the filesystem for the rest.
+
+    The environment, and jinja2 itself, are only loaded when first needed, so a
+    run that renders nothing does not pay for them.
+    """
+
+    def __init__(self, cache_dir=None, archive=None):
+        self.cache_dir = cache_dir
+        self.archive = archive
+        self._env = None
+        self._source_loader = None
+
+    def _load(self):
+        from jinja2 import ChoiceLoader, FileSystemBytecodeCache, FileSystemLoader, ModuleLoader
+
+        self._source_loader = FileSystemLoader('/')
+
+        if self.archive is not None:
+            loader = ChoiceLoader([ModuleLoader(self.archive), self._source_loader])
+        else:
+            loader = self._source_loader
+
+        if self.cache_dir is not None:
+            bytecode_dir = os.path.join(self.cache_dir, "jinja")
+            if not os.path.isdir(bytecode_dir):
+                os.makedirs(bytecode_dir, 0o700)
+            bytecode_cache = FileSystemBytecodeCache(bytecode_dir)
+        else:
+            bytecode_cache = FileSystemBytecodeCache()
+
+        self._env = _environment(loader, bytecode_cache)
+
+    @property
+    def env(self):
+        if self._env is None:
+            self._load()
+        return self._env
+
+    @property
+    def source_loader(self):
+        if self._source_loader is None:
+            self._load()
+        return self._source_loader
+
+    def get_template(self, name):
+        return self.env.get_template(name)
+
+
+_shared = dict()
+
+
+def shared_environment(cache_dir=None, archive=None):
+    """
+    The ``TemplateEnvironment`` for this process, created on first use.
+    """
+    key = (cache_dir, archive)
+    if key not in _shared:
+        _shared[key] = TemplateEnvironment(cache_dir, archive)
+    return _shared[key]
+
+
+def template_names(src):
+    """
+    The template names a file's ``src`` can refer to. Placeholders that are only
+    resolved at runtime (eg. ``files/${ENVIRONMENT}/app.conf.j2``) match every
+    existing file in their place.
+    """
+    if PLACEHOLDER.search(src) is None:
+        return [src]
+
+    pattern = PLACEHOLDER.sub("*", src)
+    names = []
+    for path in sorted(glob.glob(os.path.join('/', pattern))):
+        if os.path.isfile(path):
+            names.append(path if os.path.isabs(src) else os.path.relpath(path, '/'))
+    return names
+
+
+def compile_templates(configs, target):
+    """
+    Precompile every template referenced by the given service definitions, and
+    everything those templates include, into a zip archive for ``ModuleLoader``.
+    Returns the names of the compiled templates.
+    """
+    from jinja2 import FileSystemLoader, meta
+
+    env = _environment(FileSystemLoader('/'))
+
+    names = set()
+    pending = []
+    for config in configs:
+        for file in config.get('files') or []:
+            pending.extend(template_names(file["src"]))
+
+    while len(pending) > 0:
+        name = pending.pop()
+        if name in names:
+            continue
+        names.add(name)
+
+        source = env.loader.get_source(env, name)[0]
+        for referenced in meta.find_referenced_templates(env.parse(source)):
+            if referenced is None:
+                logger.warning("Template '{}' has a dynamic include which will not be precompiled".format(name))
+            else:
+                pending.append(referenced)
+
+    compile_env = _environment(_listed_loader(names))
+    compile_env.compile_templates(target, zip="deflated", ignore_errors=False)
+    return sorted(names)
@@ -0,0 +1,119 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from .output import write_file
+
+_local = threading.local()
+
+
+def _open_spans():
+    spans = getattr(_local, "spans", None)
+    if spans is None:
+        spans = _local.spans = []
+    return spans
+
+
+def annotate(**values):
+    """
+    Add details to the innermost span open on the current thread, if any.
+    Resolvers use this to report what only they know, such as retries.
+    """
+    spans = _open_spans()
+    if len(spans) > 0:
+        spans[-1]["args"].update(values)
+
+
+@contextmanager
+def untraced():
+    """
+    A stand in for ``Tracer.span`` when nothing is being traced.
+    """
+    yield None
+
+
+class Tracer(object):
+    """
+    Records timed spans of a run (each property resolved, each batch fetched,
+    each file rendered) and writes them as Chrome trace-event JSON, which can
+    be loaded into chrome://tracing or Perfetto.
+    """
+
+    def __init__(self):
+        self.start = time.time()
+        self.events = []
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name, category, args=None):
+        event = {
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "pid": os.getpid(),
+            "tid": threading.current_thread().ident,
+            "args": dict(args or {}),
+        }
+        spans = _open_spans()
+        spans.append(event)
+        start = time.time()
+        try:
+            yield event
+        finally:
+            end = time.time()
+            spans.pop()
+            event["ts"] = int((start - self.start) * 1000000)
+            event["dur"] = int((end - start) * 1000000)
+            with self.lock:
+                self.events.append(event)
+
+    def save(self, path):
+        with self.lock:
+            events = sorted(self.events, key=lambda event: event["ts"])
+        write_file(path, json.dumps({"traceEvents": events, "displayTimeUnit": "ms"}, default=str))
+
+    def critical_path(self):
+        """
+        The chain of property spans that determined when the last property
+        finished: starting from it, each step goes back to the referenced
+        property that finished last, following exported properties into the
+        service file that resolved them.
+        """
+        with self.lock:
+            spans = [event for event in self.events if event["cat"] == "property"]
+        if len(spans) == 0:
+            return []
+
+        def end(event):
+            return event["ts"] + event["dur"]
+
+        current = max(spans, key=end)
+        chain = [current]
+        while True:
+            candidates = []
+            for name in current["args"].get("references", []):
+                named = [event for event in spans if event["args"]["property"] == name]
+                same_file = [event for event in named if event["args"].get("file") == current["args"].get("file")]
+                if len(same_file) == 0:
+                    # An exported property, resolved by an earlier service file.
+                    same_file = [event for event in named if end(event) <= current["ts"]]
+                candidates.extend(same_file)
+            candidates = [event for event in candidates if event not in chain]
+            if len(candidates) == 0:
+                break
+            current = max(candidates, key=end)
+            chain.append(current)
+
+        return list(reversed(chain))
+
+    def summary(self):
+        total = time.time() - self.start
+        chain = self.critical_path()
+        lines = ["Critical path {:.3f}s of {:.3f}s total:".format(sum(event["dur"] for event in chain) / 1000000.0, total)]
+        for event in chain:
+            args = event["args"]
+            label = args["property"] if args.get("file") is None else "{} {}".format(os.path.basename(args["file"]), args["property"])
+            lines.append("  {:8.3f}s  {} = {}".format(event["dur"] / 1000000.0, label, args.get("expression")))
+        return "\n".join(lines)
@@ -90,7 +90,7 @@ setup(
     # requirements files see:
     # https://packaging.python.org/en/latest/requirements.html
     # install_requires=['peppercorn'],
-    install_requires=['boto3', 'psutil', 'PyYAML', 'Jinja2', 'ec2_metadata'],
+    install_requires=['boto3', 'psutil', 'PyYAML', 'Jinja2', 'futures; python_version < "3"'],
 
     # List additional groups of dependencies here (e.g. development
     # dependencies). You can install these using the following syntax,
@@ -0,0 +1,92 @@
+import json
+import threading
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+TOKEN = "fake-token"
+
+DEFAULT_PATHS = {
+    "/latest/meta-data/ami-id": "ami-12345",
+    "/latest/meta-data/ami-launch-index": "0",
+    "/latest/meta-data/placement/availability-zone": "ap-southeast-2a",
+    "/latest/meta-data/iam/info": json.dumps({
+        "InstanceProfileArn": "arn:aws:iam::123456789012:instance-profile/web",
+        "InstanceProfileId": "AIPA12345",
+    }),
+    "/latest/meta-data/instance-id": "i-12345",
+    "/latest/meta-data/instance-type": "t3.micro",
+    "/latest/meta-data/local-hostname": "ip-10-0-0-1.internal",
+    "/latest/meta-data/local-ipv4": "10.0.0.1",
+    "/latest/meta-data/security-groups": "web\nssh",
+    "/latest/dynamic/instance-identity/document": json.dumps({
+        "accountId": "123456789012",
+        "region": "ap-southeast-2",
+        "instanceId": "i-12345",
+    }),
+}
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class FakeIMDS(object):
+    """
+    A local stand in for the instance metadata service, requiring an IMDSv2
+    token and counting the requests made to it.
+    """
+
+    def __init__(self, paths=None):
+        self.paths = dict(DEFAULT_PATHS if paths is None else paths)
+        self.requests = []
+        self.lock = threading.Lock()
+
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, code, body=""):
+                data = body.encode("utf-8")
+                self.send_response(code)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_PUT(self):
+                with fake.lock:
+                    fake.requests.append(("PUT", self.path))
+                if self.path == "/latest/api/token" and self.headers.get("X-aws-ec2-metadata-token-ttl-seconds"):
+                    self._reply(200, TOKEN)
+                else:
+                    self._reply(400)
+
+            def do_GET(self):
+                with fake.lock:
+                    fake.requests.append(("GET", self.path))
+                if self.headers.get("X-aws-ec2-metadata-token") != TOKEN:
+                    self._reply(401)
+                elif self.path in fake.paths:
+                    self._reply(200, fake.paths[self.path])
+                else:
+                    self._reply(404)
+
+        self.server = _ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = "http://127.0.0.1:{}".format(self.server.server_address[1])
+        self.thread = threading.Thread(target=self.server.serve_forever, args=(0.05,))
+        self.thread.daemon = True
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
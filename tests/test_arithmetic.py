@@ -0,0 +1,29 @@
+import unittest
+
+from configbutler.arithmetic import ArithmeticExpressionError, compile_arithmetic, evaluate
+
+
+class TestEvaluate(unittest.TestCase):
+
+    def test_operators(self):
+        self.assertEqual(6.0, evaluate("8000 * 0.8 / 1024 // 1"))
+        self.assertEqual(7, evaluate("(1 + 2) * 3 - 2 ** 1 % 3"))
+        self.assertEqual(-3.5, evaluate("-7 / 2"))
+
+    def test_functions(self):
+        self.assertEqual(512, evaluate("max(100, 512, 3)"))
+        self.assertEqual(3, evaluate("min(3, 4)"))
+        self.assertEqual(2.57, evaluate("round(2.567, 2)"))
+        self.assertEqual(2, evaluate("floor(2.9)"))
+        self.assertEqual(3, evaluate("ceil(2.1)"))
+
+    def test_rejected(self):
+        for text in ["__import__('os').system('true')", "x + 1", "(1).real", "'a' * 3", "[1, 2]",
+                     "max([1, 2])", "round(1, 2, 3)", "True + 1", "1 if 1 else 2", "1 +"]:
+            self.assertRaises(ArithmeticExpressionError, evaluate, text)
+
+    def test_large_exponent(self):
+        self.assertRaises(ArithmeticExpressionError, evaluate, "9 ** 9 ** 9")
+
+    def test_cached(self):
+        self.assertIs(compile_arithmetic("1 + 2"), compile_arithmetic("1 + 2"))
@@ -0,0 +1,200 @@
+import unittest
+from mock import call, Mock, MagicMock
+import mock
+
+from botocore.exceptions import ClientError
+
+from configbutler.resolvers import AWSParamStoreResolver, AWSResolver, ResolverError
+
+
+def mock_get_parameters(Names, WithDecryption):
+    return {
+        "Parameters": [{"Name": name, "Value": name.upper()} for name in Names if not name.startswith("/missing")],
+        "InvalidParameters": [name for name in Names if name.startswith("/missing")],
+    }
+
+
+class TestAWSParamStoreResolver(unittest.TestCase):
+
+    def test_single(self):
+        undertest = AWSParamStoreResolver()
+        undertest.client = Mock()
+        undertest.client.get_parameter = MagicMock(return_value={"Parameter": {"Name": "/a", "Value": "da-param"}})
+
+        self.assertEqual("da-param", undertest.resolve("/${app}", {"app": "a"}))
+        self.assertEqual([call(Name="/a", WithDecryption=True)], undertest.client.get_parameter.mock_calls)
+
+    def test_prefetch_batches(self):
+        undertest = AWSParamStoreResolver()
+        undertest.client = Mock()
+        undertest.client.get_parameters = Mock(side_effect=mock_get_parameters)
+
+        names = ["/p{}".format(i) for i in range(23)]
+        undertest.prefetch(names + names[:2], {})
+
+        for name in names:
+            self.assertEqual(name.upper(), undertest.resolve(name, {}))
+
+        self.assertEqual([call(Names=names[0:10], WithDecryption=True),
+                          call(Names=names[10:20], WithDecryption=True),
+                          call(Names=names[20:23], WithDecryption=True)],
+                         undertest.client.get_parameters.mock_calls)
+        self.assertEqual([], undertest.client.get_parameter.mock_calls)
+
+    def test_prefetch_substitutes_and_skips_unresolvable(self):
+        undertest = AWSParamStoreResolver()
+
+        undertest.prefetch(["/${app}/a", "/${missing}/b"], {"app": "garden"})
+
+        self.assertEqual(["/garden/a"], undertest.pending)
+
+    @mock.patch("configbutler.resolvers.logger")
+    def test_prefetch_invalid_parameter(self, mock_logger):
+        undertest = AWSParamStoreResolver()
+        undertest.client = Mock()
+        undertest.client.get_parameters = Mock(side_effect=mock_get_parameters)
+
+        undertest.prefetch(["/a", "/missing"], {})
+
+        self.assertEqual(None, undertest.resolve("/missing", {}))
+        self.assertEqual("/A", undertest.resolve("/a", {}))
+        self.assertEqual([], undertest.client.get_parameter.mock_calls)
+        self.assertIn(call.error("Unable to SSM:paramstore lookup '/missing' - cause parameter not found"),
+                      mock_logger.mock_calls)
+
+    @mock.patch("configbutler.resolvers.logger")
+    def test_prefetch_failure_falls_back(self, mock_logger):
+        undertest = AWSParamStoreResolver()
+        undertest.client = Mock()
+        undertest.client.get_parameters = Mock(side_effect=ClientError({"Error": {"Code": "AccessDenied"}}, "GetParameters"))
+        undertest.client.get_parameter = MagicMock(return_value={"Parameter": {"Name": "/a", "Value": "da-param"}})
+
+        undertest.prefetch(["/a"], {})
+
+        self.assertEqual("da-param", undertest.resolve("/a", {}))
+        self.assertEqual([call(Name="/a", WithDecryption=True)], undertest.client.get_parameter.mock_calls)
+
+
+class TestAWSParamStorePathResolver(unittest.TestCase):
+
+    def setUp(self):
+        self.undertest = AWSParamStoreResolver()
+        self.undertest.client = Mock()
+        self.undertest.client.get_parameters_by_path = Mock(side_effect=[
+            {
+                "Parameters": [{"Name": "/garden/test/AppD/controller", "Value": "ctl"}],
+                "NextToken": "next",
+            },
+            {
+                "Parameters": [{"Name": "/garden/test/AppD/account-access-key", "Value": "key"}],
+            },
+        ])
+        self.path_resolver = AWSResolver(self.undertest.aws).paramstore_path_resolver
+        self.path_resolver.paramstore_resolver = self.undertest
+
+    def test_path_paginated(self):
+        self.assertEqual({"AppD/controller": "ctl", "AppD/account-access-key": "key"},
+                         self.path_resolver.resolve("/${app}/test/", {"app": "garden"}))
+
+        self.assertEqual([call(Path="/garden/test", Recursive=True, WithDecryption=True),
+                          call(Path="/garden/test", Recursive=True, WithDecryption=True, NextToken="next")],
+                         self.undertest.client.get_parameters_by_path.mock_calls)
+
+    @mock.patch("configbutler.resolvers.logger")
+    def test_lookups_served_from_index(self, mock_logger):
+        self.path_resolver.resolve("/garden/test", {})
+
+        self.assertEqual("ctl", self.undertest.resolve("/garden/test/AppD/controller", {}))
+        self.assertEqual(None, self.undertest.resolve("/garden/test/AppD/enabled", {}))
+
+        self.assertEqual(2, len(self.undertest.client.get_parameters_by_path.mock_calls))
+        self.assertEqual([], self.undertest.client.get_parameter.mock_calls)
+        self.assertEqual([], self.undertest.client.get_parameters.mock_calls)
+
+    def test_prefetch_defers_to_pending_path(self):
+        self.path_resolver.prefetch(["/garden/test/"], {})
+        self.undertest.prefetch(["/garden/test/AppD/controller", "/other"], {})
+
+        self.assertEqual(["/other"], self.undertest.pending)
+        self.assertEqual("ctl", self.undertest.resolve("/garden/test/AppD/controller", {}))
+        self.assertEqual(2, len(self.undertest.client.get_parameters_by_path.mock_calls))
+        self.assertEqual([], self.undertest.client.get_parameter.mock_calls)
+
+
+class TestAWSParamStoreResolverErrors(unittest.TestCase):
+
+    @mock.patch("configbutler.resolvers.logger")
+    def test_not_found(self, mock_logger):
+        undertest = AWSParamStoreResolver()
+        undertest.client = Mock()
+        undertest.client.get_parameter = Mock(side_effect=ClientError({"Error": {"Code": "ParameterNotFound"}}, "GetParameter"))
+
+        self.assertEqual(None, undertest.resolve("/a", {}))
+        self.assertEqual(1, len(mock_logger.error.mock_calls))
+
+    def test_throttled(self):
+        undertest = AWSParamStoreResolver()
+        undertest.client = Mock()
+        undertest.client.get_parameter = Mock(side_effect=ClientError({"Error": {"Code": "ThrottlingException"}}, "GetParameter"))
+
+        with self.assertRaises(ResolverError):
+            undertest.resolve("/a", {})
+
+
+class TestAWSParamStoreResolverRefresh(unittest.TestCase):
+
+    def setUp(self):
+        self.undertest = AWSParamStoreResolver()
+        self.undertest.client = Mock()
+        self.undertest.client.get_parameters = Mock(return_value={
+            "Parameters": [{"Name": "/a", "Value": "a", "Version": 1}, {"Name": "/b", "Value": "b", "Version": 3}],
+            "InvalidParameters": ["/missing"],
+        })
+        self.undertest.client.get_parameters_by_path = Mock(return_value={
+            "Parameters": [{"Name": "/app/x", "Value": "x", "Version": 1}],
+        })
+        self.undertest.client.get_parameter = Mock(return_value={"Parameter": {"Name": "/a", "Value": "a2", "Version": 2}})
+
+        self.undertest.prefetch(["/a", "/b", "/missing"], {})
+        self.undertest.resolve("/a", {})
+        self.undertest.resolve_path("/app", {})
+
+    def describe(self, versions):
+        def describe_parameters(ParameterFilters, MaxResults):
+            filter = ParameterFilters[0]
+            if filter["Key"] == "Name":
+                names = [name for name in filter["Values"] if name in versions]
+            else:
+                names = [name for name in versions if name.startswith(filter["Values"][0] + "/")]
+            return {"Parameters": [{"Name": name, "Version": versions[name]} for name in names]}
+        self.undertest.client.describe_parameters = Mock(side_effect=describe_parameters)
+
+    def test_only_changed_fetched_again(self):
+        self.describe({"/a": 2, "/b": 3, "/app/x": 1})
+
+        self.assertEqual(["/a"], self.undertest.refresh())
+        self.assertEqual("a2", self.undertest.resolve("/a", {}))
+        self.assertEqual("b", self.undertest.resolve("/b", {}))
+        self.assertEqual({"x": "x"}, self.undertest.resolve_path("/app", {}))
+
+        self.assertEqual([call(Name="/a", WithDecryption=True)], self.undertest.client.get_parameter.mock_calls)
+        self.assertEqual(1, len(self.undertest.client.get_parameters_by_path.mock_calls))
+        self.assertEqual([
+            call(ParameterFilters=[{"Key": "Name", "Option": "Equals", "Values": ["/a", "/b"]}], MaxResults=50),
+            call(ParameterFilters=[{"Key": "Path", "Option": "Recursive", "Values": ["/app"]}], MaxResults=50),
+        ], self.undertest.client.describe_parameters.mock_calls)
+
+    def test_path_with_new_parameter_loaded_again(self):
+        self.describe({"/a": 1, "/b": 3, "/app/x": 1, "/app/y": 1})
+
+        self.assertEqual(["/app/y"], self.undertest.refresh())
+        self.undertest.resolve("/app/x", {})
+        self.assertEqual(2, len(self.undertest.client.get_parameters_by_path.mock_calls))
+
+    @mock.patch("configbutler.resolvers.logger")
+    def test_values_kept_when_versions_unavailable(self, mock_logger):
+        self.undertest.client.describe_parameters = Mock(side_effect=ClientError({"Error": {"Code": "AccessDenied"}}, "DescribeParameters"))
+
+        self.assertEqual([], self.undertest.refresh())
+        self.assertEqual("b", self.undertest.resolve("/b", {}))
+        self.assertEqual([], self.undertest.client.get_parameter.mock_calls)
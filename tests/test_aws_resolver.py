@@ -39,3 +39,12 @@ class TestAWSResolver(unittest.TestCase):
         self.assertEqual(undertest.resolve(["metadata", "blart"], None), "da-metadata")
 
         self.assertEqual([call('blart', None)], undertest.metadata_resolver.resolve.mock_calls)
+
+    def test_prefetch(self):
+        undertest = AWSResolver()
+        undertest.paramstore_resolver = Mock()
+        undertest.tags_resolver = Mock(spec=[])
+
+        undertest.prefetch([["paramstore", "a"], ["tags", "b"], ["blart", "c"], ["paramstore", "d"]], None)
+
+        self.assertEqual([call.prefetch(["a", "d"], None)], undertest.paramstore_resolver.mock_calls)
@@ -1,25 +1,36 @@
 import unittest
 
-from ec2_metadata import EC2Metadata
 from mock import call, Mock, MagicMock
 import mock
 import logging
 
+from configbutler.imds import InstanceMetadata
 from configbutler.resolvers import AWSTagResolver
 
 
 logger = logging.getLogger("configbutler")
 logging.basicConfig()
 
+DEBUG_FALLBACK = call.debug("Instance metadata tags are not enabled, using the EC2 API")
+
 
 class TestAWSTagsResolver(unittest.TestCase):
 
+    @staticmethod
+    def metadata_without_tags():
+        # Tags are not enabled in instance metadata, so they come from the EC2 API.
+        metadata = mock.create_autospec(InstanceMetadata, instance=True)
+        metadata.instance_tags.return_value = None
+        metadata.instance_id = "i-12345"
+        return metadata
+
     @mock.patch("configbutler.resolvers.logger")
-    def test_no_tags_retries(self, mock_logger=None):
+    @mock.patch("configbutler.resolvers.random.uniform", lambda low, high: high)
+    @mock.patch("time.sleep")
+    def test_no_tags_retries(self, mock_sleep, mock_logger=None):
         undertest = AWSTagResolver()
         undertest.RETRY_COUNT = 2
-        undertest.metadata = mock.create_autospec(EC2Metadata)
-        undertest.metadata.instance_id = "i-12345"
+        undertest.metadata = self.metadata_without_tags()
 
         mock_tags = {
             "Tags": []
@@ -34,18 +45,20 @@ class TestAWSTagsResolver(unittest.TestCase):
                           call(Filters=[{'Values': ['i-12345'], 'Name': 'resource-id'}])],
                          undertest.client.describe_tags.mock_calls)
 
-        self.assertEqual([call.error('No AWS::tag values found, waiting 1sec to retry.'),
-                          call.error('No AWS::tag values found, waiting 2sec to retry.'),
+        self.assertEqual([DEBUG_FALLBACK,
+                          call.error('No AWS::tag values found, waiting 1.0sec to retry.'),
                           call.error('No AWS::tag values found, continuing with no tags.'),
                           call.error("Unable to find AWS::tag named 'blart'")],
                          mock_logger.mock_calls)
+        self.assertEqual([call(1.0)], mock_sleep.mock_calls)
 
     @mock.patch("configbutler.resolvers.logger")
-    def test_no_tags_multiple_tags_cache_results(self, mock_logger=None):
+    @mock.patch("configbutler.resolvers.random.uniform", lambda low, high: high)
+    @mock.patch("time.sleep")
+    def test_no_tags_multiple_tags_cache_results(self, mock_sleep, mock_logger=None):
         undertest = AWSTagResolver()
         undertest.RETRY_COUNT = 2
-        undertest.metadata = mock.create_autospec(EC2Metadata)
-        undertest.metadata.instance_id = "i-12345"
+        undertest.metadata = self.metadata_without_tags()
 
         mock_tags = {
             "Tags": []
@@ -62,8 +75,8 @@ class TestAWSTagsResolver(unittest.TestCase):
                           call(Filters=[{'Values': ['i-12345'], 'Name': 'resource-id'}])],
                          undertest.client.describe_tags.mock_calls)
 
-        self.assertEqual([call.error('No AWS::tag values found, waiting 1sec to retry.'),
-                          call.error('No AWS::tag values found, waiting 2sec to retry.'),
+        self.assertEqual([DEBUG_FALLBACK,
+                          call.error('No AWS::tag values found, waiting 1.0sec to retry.'),
                           call.error('No AWS::tag values found, continuing with no tags.'),
                           call.error("Unable to find AWS::tag named 'blart'"),
                           call.error("Unable to find AWS::tag named 'blerg'"),
@@ -71,7 +84,9 @@ class TestAWSTagsResolver(unittest.TestCase):
                          mock_logger.mock_calls)
 
     @mock.patch("configbutler.resolvers.logger")
-    def test_with_second_retries(self, mock_logger):
+    @mock.patch("configbutler.resolvers.random.uniform", lambda low, high: low)
+    @mock.patch("time.sleep")
+    def test_with_second_retries(self, mock_sleep, mock_logger):
 
         no_tags = {
             "Tags": []
@@ -88,8 +103,7 @@ class TestAWSTagsResolver(unittest.TestCase):
 
         undertest = AWSTagResolver()
         undertest.RETRY_COUNT = 2
-        undertest.metadata = mock.create_autospec(EC2Metadata)
-        undertest.metadata.instance_id = "i-12345"
+        undertest.metadata = self.metadata_without_tags()
 
         undertest.client = Mock()
         undertest.client.describe_tags = mock_tags_lookup
@@ -99,15 +113,16 @@ class TestAWSTagsResolver(unittest.TestCase):
         # Should be no values left in the array
         self.assertEqual(0, len(incr_return_values))
 
-        self.assertEqual([call.error('No AWS::tag values found, waiting 1sec to retry.')],
+        self.assertEqual([DEBUG_FALLBACK,
+                          call.error('No AWS::tag values found, waiting 0.5sec to retry.')],
                          mock_logger.mock_calls)
+        self.assertEqual([call(0.5)], mock_sleep.mock_calls)
 
     @mock.patch("configbutler.resolvers.logger")
     def test_with_missing_tag(self, mock_logger):
         undertest = AWSTagResolver()
         undertest.RETRY_COUNT = 2
-        undertest.metadata = mock.create_autospec(EC2Metadata)
-        undertest.metadata.instance_id = "i-12345"
+        undertest.metadata = self.metadata_without_tags()
 
         mock_tags = {
             "Tags": [{"Key": "aKey", "Value": "aValue"}]
@@ -121,15 +136,15 @@ class TestAWSTagsResolver(unittest.TestCase):
         self.assertEqual([call(Filters=[{'Values': ['i-12345'], 'Name': 'resource-id'}])],
                          undertest.client.describe_tags.mock_calls)
 
-        self.assertEqual([call.error("Unable to find AWS::tag named 'blart'")],
+        self.assertEqual([DEBUG_FALLBACK,
+                          call.error("Unable to find AWS::tag named 'blart'")],
                          mock_logger.mock_calls)
 
     @mock.patch("configbutler.resolvers.logger")
     def test_with_actual_tag(self, mock_logger):
         undertest = AWSTagResolver()
         undertest.RETRY_COUNT = 2
-        undertest.metadata = mock.create_autospec(EC2Metadata)
-        undertest.metadata.instance_id = "i-12345"
+        undertest.metadata = self.metadata_without_tags()
 
         mock_tags = {
             "Tags": [{"Key": "blart", "Value": "bling"}]
@@ -143,5 +158,56 @@ class TestAWSTagsResolver(unittest.TestCase):
         self.assertEqual([call(Filters=[{'Values': ['i-12345'], 'Name': 'resource-id'}])],
                          undertest.client.describe_tags.mock_calls)
 
-        self.assertEqual([],
-                         mock_logger.mock_calls)
+        self.assertEqual([DEBUG_FALLBACK], mock_logger.mock_calls)
+
+    @mock.patch("configbutler.resolvers.logger")
+    @mock.patch("configbutler.resolvers.random.uniform", lambda low, high: high)
+    @mock.patch("time.sleep")
+    def test_retries_capped_by_deadline(self, mock_sleep, mock_logger):
+        clock = [1000.0]
+        mock_sleep.side_effect = lambda seconds: clock.__setitem__(0, clock[0] + seconds)
+
+        undertest = AWSTagResolver(deadline=5)
+        undertest.metadata = self.metadata_without_tags()
+        undertest.client = Mock()
+        undertest.client.describe_tags = MagicMock(return_value={"Tags": []})
+
+        with mock.patch("time.time", lambda: clock[0]):
+            self.assertEqual(None, undertest.resolve("blart", dict))
+
+        # Waits of 1, 2 and then whatever is left of the 5 second deadline.
+        self.assertEqual([call(1.0), call(2.0), call(2.0)], mock_sleep.mock_calls)
+        self.assertEqual(4, len(undertest.client.describe_tags.mock_calls))
+
+    @mock.patch("configbutler.resolvers.logger")
+    def test_paginated(self, mock_logger):
+        undertest = AWSTagResolver()
+        undertest.metadata = self.metadata_without_tags()
+
+        undertest.client = Mock()
+        undertest.client.describe_tags = Mock(side_effect=[
+            {"Tags": [{"Key": "a", "Value": "1"}], "NextToken": "next"},
+            {"Tags": [{"Key": "b", "Value": "2"}]},
+        ])
+
+        self.assertEqual("1", undertest.resolve("a", dict))
+        self.assertEqual("2", undertest.resolve("b", dict))
+        self.assertEqual(None, undertest.resolve("c", dict))
+
+        self.assertEqual([call(Filters=[{'Values': ['i-12345'], 'Name': 'resource-id'}]),
+                          call(Filters=[{'Values': ['i-12345'], 'Name': 'resource-id'}], NextToken="next")],
+                         undertest.client.describe_tags.mock_calls)
+        self.assertEqual([DEBUG_FALLBACK,
+                          call.error("Unable to find AWS::tag named 'c'")], mock_logger.mock_calls)
+
+    @mock.patch("configbutler.resolvers.logger")
+    def test_metadata_tags(self, mock_logger):
+        undertest = AWSTagResolver()
+        undertest.metadata = mock.create_autospec(InstanceMetadata, instance=True)
+        undertest.metadata.instance_tags.return_value = {"blart": "bling"}
+        undertest.client = Mock()
+
+        self.assertEqual("bling", undertest.resolve("blart", dict))
+
+        self.assertEqual([], undertest.client.describe_tags.mock_calls)
+        self.assertEqual([], mock_logger.mock_calls)
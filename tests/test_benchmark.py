@@ -0,0 +1,61 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+from configbutler.benchmark import main, run_benchmark, synthetic_properties
+
+
+class TestSyntheticProperties(unittest.TestCase):
+
+    def test_levels(self):
+        properties, parameters, tags = synthetic_properties(6, depth=2, fanout=2, aws_refs=2)
+
+        self.assertEqual({
+            "p0": "aws|paramstore|/bench/param0",
+            "p1": "aws|tags|tag1",
+            "p2": "string|${p0}-${p1}",
+            "p3": "string|${p1}-${p0}",
+            "p4": "string|${p2}-${p3}",
+            "p5": "string|${p3}-${p2}",
+        }, properties)
+        self.assertEqual({"/bench/param0": "value0"}, parameters)
+        self.assertEqual({"tag1": "value1"}, tags)
+
+
+class TestBenchmark(unittest.TestCase):
+
+    def test_run(self):
+        results = run_benchmark(properties=40, depth=2, fanout=3, templates=3, aws_refs=24, repeat=2)
+
+        self.assertEqual(40, results["parameters"]["properties"])
+        # 5 parameters in one batch, the tags in one call, and the metadata attributes once each.
+        self.assertEqual(1, results["calls"]["ssm.GetParameters"])
+        self.assertEqual(1, results["calls"]["ec2.DescribeTags"])
+        self.assertNotIn("ssm.GetParameter", results["calls"])
+        # The first level only holds 14 properties, and two metadata lookups repeat ones before them.
+        self.assertEqual({"aws|paramstore": 5, "aws|tags": 5, "aws|metadata": 2, "string": 26},
+                         results["resolvers"]["calls"])
+        self.assertEqual({"memo": 2}, results["resolvers"]["cache"])
+        self.assertLessEqual(results["total_seconds"]["min"], results["total_seconds"]["max"])
+        self.assertGreater(results["peak_memory_bytes"], 0)
+
+    def test_imds_tags(self):
+        results = run_benchmark(properties=10, depth=1, fanout=1, templates=1, aws_refs=6, repeat=1, imds_tags=True)
+
+        self.assertNotIn("ec2.DescribeTags", results["calls"])
+
+    @mock.patch("sys.stdout")
+    def test_output_file(self, mock_stdout):
+        directory = tempfile.mkdtemp()
+        try:
+            output = os.path.join(directory, "results.json")
+            main(["--properties", "10", "--repeat", "1", "--output", output])
+
+            with open(output) as results:
+                self.assertEqual(10, json.load(results)["parameters"]["properties"])
+        finally:
+            shutil.rmtree(directory)
@@ -0,0 +1,110 @@
+import json
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+import mock
+
+from configbutler.cache import ResolverCache, FOREVER
+
+
+class TestResolverCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.directory, "cache")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_ttl(self):
+        undertest = ResolverCache(self.cache_dir)
+
+        self.assertEqual(FOREVER, undertest.ttl("aws|metadata|instance_id"))
+        self.assertEqual(FOREVER, undertest.ttl("aws|metadata|region"))
+        self.assertEqual(300, undertest.ttl("aws|metadata|public_ipv4"))
+        self.assertEqual(300, undertest.ttl("aws|metadata|iam_info"))
+        self.assertEqual(0, undertest.ttl("aws|metadata|instance_action"))
+        self.assertEqual(300, undertest.ttl("aws|tags|Name"))
+        self.assertEqual(300, undertest.ttl("aws|paramstore-path|/garden/"))
+        self.assertEqual(0, undertest.ttl("aws|paramstore-pathological|/garden/"))
+        self.assertEqual(0, undertest.ttl("string|a"))
+
+    def test_not_cached(self):
+        undertest = ResolverCache(self.cache_dir)
+        undertest.put("string|a", "a")
+        undertest.put("aws|tags|Name", None)
+
+        self.assertEqual((False, None), undertest.get("string|a"))
+        self.assertEqual((False, None), undertest.get("aws|tags|Name"))
+        self.assertEqual(False, undertest.dirty)
+
+    def test_persisted_privately(self):
+        undertest = ResolverCache(self.cache_dir)
+        undertest.put("aws|paramstore|/secret", "hunter2")
+        undertest.save()
+
+        self.assertEqual(0o700, stat.S_IMODE(os.stat(self.cache_dir).st_mode))
+        self.assertEqual(0o600, stat.S_IMODE(os.stat(undertest.path).st_mode))
+        self.assertEqual([ResolverCache.FILE_NAME], os.listdir(self.cache_dir))
+
+        self.assertEqual((True, "hunter2"), ResolverCache(self.cache_dir).get("aws|paramstore|/secret"))
+
+    @mock.patch("time.time")
+    def test_expiry_and_stale(self, mock_time):
+        mock_time.return_value = 1000
+        undertest = ResolverCache(self.cache_dir, stale_if_error=True)
+        undertest.put("aws|tags|Name", "web")
+        undertest.put("aws|metadata|instance_id", "i-12345")
+
+        mock_time.return_value = 1000 + 301
+        self.assertEqual((False, None), undertest.get("aws|tags|Name"))
+        self.assertEqual((True, "web"), undertest.get_stale("aws|tags|Name"))
+        self.assertEqual((True, "i-12345"), undertest.get("aws|metadata|instance_id"))
+
+    def test_stale_disabled(self):
+        undertest = ResolverCache(self.cache_dir)
+        undertest.put("aws|tags|Name", "web")
+
+        self.assertEqual((False, None), undertest.get_stale("aws|tags|Name"))
+
+    def test_unreadable(self):
+        os.makedirs(self.cache_dir)
+        with open(os.path.join(self.cache_dir, ResolverCache.FILE_NAME), "w") as cache_file:
+            cache_file.write("{not json")
+
+        self.assertEqual((False, None), ResolverCache(self.cache_dir).get("aws|tags|Name"))
+
+    def test_other_instance(self):
+        baked = ResolverCache(self.cache_dir, instance=lambda: "i-baker")
+        baked.put("aws|metadata|instance_id", "i-baker")
+        baked.put("aws|tags|Name", "web")
+        baked.save()
+
+        self.assertEqual((True, "i-baker"), ResolverCache(self.cache_dir, instance=lambda: "i-baker").get("aws|metadata|instance_id"))
+
+        undertest = ResolverCache(self.cache_dir, instance=lambda: "i-clone")
+        self.assertEqual((False, None), undertest.get("aws|metadata|instance_id"))
+        self.assertEqual((False, None), undertest.get("aws|tags|Name"))
+
+    def test_instance_unknown(self):
+        baked = ResolverCache(self.cache_dir, instance=lambda: "i-baker")
+        baked.put("aws|metadata|instance_id", "i-baker")
+        baked.put("aws|tags|Name", "baker-host")
+        baked.put("aws|paramstore|/secret", "hunter2")
+        baked.save()
+
+        # The metadata service is down, so the instance cannot be confirmed.
+        undertest = ResolverCache(self.cache_dir, stale_if_error=True, instance=mock.Mock(side_effect=IOError("no metadata")))
+        self.assertEqual((False, None), undertest.get("aws|metadata|instance_id"))
+        self.assertEqual((False, None), undertest.get("aws|tags|Name"))
+        self.assertEqual((False, None), undertest.get_stale("aws|tags|Name"))
+        self.assertEqual((False, None), undertest.get_stale("aws|paramstore|/secret"))
+
+    def test_unscoped_file_ignored(self):
+        os.makedirs(self.cache_dir)
+        with open(os.path.join(self.cache_dir, ResolverCache.FILE_NAME), "w") as cache_file:
+            json.dump({"aws|metadata|instance_id": {"time": 0, "value": "i-baker"}}, cache_file)
+
+        self.assertEqual((False, None), ResolverCache(self.cache_dir, instance=lambda: "i-clone").get("aws|metadata|instance_id"))
@@ -0,0 +1,75 @@
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+import mock
+
+from configbutler.configs import ConfigCache, compile_config
+from configbutler.expressions import Expression
+
+
+class TestCompileConfig(unittest.TestCase):
+
+    def test_properties_compiled(self):
+        config = compile_config(b"properties:\n    name: aws|paramstore|/${app}/name\nfiles: []\n")
+
+        name = config["properties"]["name"]
+        self.assertEqual("aws", name.call.name)
+        self.assertEqual(["app"], name.references)
+        self.assertEqual("aws|paramstore|/garden/name", name.substitute({"app": "garden"}))
+        self.assertEqual([], config["files"])
+
+    def test_expression_pickled(self):
+        expression = pickle.loads(pickle.dumps(Expression("string|${a}"), pickle.HIGHEST_PROTOCOL))
+        self.assertEqual(Expression("string|${a}"), expression)
+        self.assertEqual(["a"], expression.references)
+
+
+class TestConfigCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.config = os.path.join(self.directory, "001-app.yaml")
+        self.write("properties:\n    name: string|garden\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, contents, mtime=1000):
+        with open(self.config, "w") as config:
+            config.write(contents)
+        os.utime(self.config, (mtime, mtime))
+
+    def test_unchanged_not_parsed(self):
+        undertest = ConfigCache()
+        first = undertest.load(self.config)
+
+        with mock.patch("configbutler.configs.compile_config", side_effect=AssertionError("parsed")):
+            self.assertIs(first, undertest.load(self.config))
+
+    def test_changed_parsed(self):
+        undertest = ConfigCache()
+        undertest.load(self.config)
+        digest = undertest.digest(self.config)
+
+        self.write("properties:\n    name: string|orchard\n", mtime=2000)
+        self.assertEqual("string|orchard", undertest.load(self.config)["properties"]["name"].value)
+        self.assertNotEqual(digest, undertest.digest(self.config))
+
+    def test_saved(self):
+        cache_dir = os.path.join(self.directory, "cache")
+        undertest = ConfigCache(cache_dir)
+        undertest.load(self.config)
+        undertest.save()
+
+        with mock.patch("configbutler.configs.compile_config", side_effect=AssertionError("parsed")):
+            config = ConfigCache(cache_dir).load(self.config)
+        self.assertEqual(Expression("string|garden"), config["properties"]["name"])
+
+    def test_unreadable_ignored(self):
+        with open(os.path.join(self.directory, ConfigCache.FILE_NAME), "wb") as cache_file:
+            cache_file.write(b"not a pickle")
+
+        config = ConfigCache(self.directory).load(self.config)
+        self.assertEqual(["name"], list(config["properties"].keys()))
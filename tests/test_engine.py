@@ -0,0 +1,246 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from configbutler.cache import ResolverCache
+from configbutler.engine import find_references, PropertyEngine, PropertyGraph
+from configbutler.registry import ResolverRegistry
+from configbutler.resolvers import BaseResolver, ResolverError
+
+
+class TestFindReferences(unittest.TestCase):
+
+    def test_braced_and_named(self):
+        self.assertEqual(["a", "b"], find_references("string|${a}-$b"))
+
+    def test_duplicates(self):
+        self.assertEqual(["a"], find_references("string|${a}${a}"))
+
+    def test_escaped(self):
+        self.assertEqual([], find_references("string|$${a}"))
+
+    def test_not_a_string(self):
+        self.assertEqual([], find_references(1234))
+
+    def test_nested(self):
+        self.assertEqual(["env", "n"], find_references("aws|paramstore|/${env}/${math|add|${n}|1}"))
+
+
+class TestPropertyGraph(unittest.TestCase):
+
+    def test_declaration_order_when_independent(self):
+        graph = PropertyGraph({"b": "string|b", "a": "string|a"})
+
+        self.assertEqual([("b", False), ("a", False)], graph.order())
+
+    def test_dependency_order(self):
+        graph = PropertyGraph({
+            "the": "string|the ${end}",
+            "end": "string|end",
+        })
+
+        self.assertEqual([[("end", False)], [("the", False)]], list(graph.waves()))
+
+    def test_long_chain_resolved_once(self):
+        properties = dict(("p{}".format(i), "string|${{p{}}}".format(i + 1)) for i in range(200))
+        properties["p200"] = "string|end"
+        graph = PropertyGraph(properties)
+
+        order = [key for key, _ in graph.order()]
+        self.assertEqual(201, len(order))
+        self.assertEqual("p200", order[0])
+        self.assertEqual("p0", order[-1])
+
+    def test_missing(self):
+        graph = PropertyGraph({
+            "a": "string|a",
+            "ab": "string|${a}${b}",
+        })
+
+        self.assertEqual({"ab": ["b"]}, graph.missing)
+        self.assertEqual(["Property 'ab' references undefined property 'b' (ab -> b)"], graph.problems())
+        self.assertEqual([("a", False), ("ab", True)], graph.order())
+
+    def test_missing_chain(self):
+        graph = PropertyGraph({
+            "a": "string|${b}",
+            "b": "string|${c}",
+            "c": "string|${nope}",
+            "d": "string|${c}${b}",
+        })
+
+        self.assertEqual([["a", "b", "c"], ["d", "c"]], graph.chains("c"))
+        self.assertEqual([
+            "Property 'a' references undefined property 'nope' (a -> b -> c -> nope)",
+            "Property 'd' references undefined property 'nope' (d -> c -> nope)",
+        ], graph.problems())
+
+    def test_cycle(self):
+        graph = PropertyGraph({
+            "a": "string|${c}",
+            "b": "string|${a}",
+            "c": "string|${b}",
+            "d": "string|${c}",
+        })
+
+        self.assertEqual([["a", "c", "b", "a"]], graph.cycles())
+        self.assertEqual(["Circular property reference (a -> c -> b -> a)"], graph.problems())
+        self.assertEqual([("a", True), ("b", False), ("c", False), ("d", False)], graph.order())
+
+
+class SlowResolver(BaseResolver):
+
+    def __init__(self, delay):
+        super(SlowResolver, self).__init__()
+        self.delay = delay
+        self.calls = []
+
+    def resolve(self, parts, current_properties):
+        time.sleep(self.delay)
+        value = self.resolve_embedded(parts[0], current_properties)
+        self.calls.append(value)
+        return value
+
+
+class TestPropertyEngine(unittest.TestCase):
+
+    properties = {
+        "a": "slow|a",
+        "b": "slow|${a}b",
+        "c": "slow|${a}c",
+        "d": "slow|${b}${c}",
+        "e": "string|${d}${missing}",
+        "f": "math|add|1|2",
+        "g": "string|${h}",
+        "h": "string|${g}",
+        "i": "blart|i",
+    }
+
+    def engine(self, jobs, delay=0):
+        registry = ResolverRegistry()
+        registry.register("slow", lambda: SlowResolver(delay))
+        return PropertyEngine(registry, jobs=jobs)
+
+    def test_serial(self):
+        undertest = self.engine(jobs=1)
+        resolved = undertest.resolve(self.properties)
+
+        self.assertEqual(list(self.properties.keys()), list(resolved.keys()))
+        self.assertEqual("abac", resolved["d"])
+        self.assertEqual("abac${missing}", resolved["e"])
+        self.assertEqual(3.0, resolved["f"])
+        self.assertEqual("${h}", resolved["g"])
+        self.assertEqual("${h}", resolved["h"])
+        self.assertEqual("blart|i", resolved["i"])
+        self.assertEqual(4, len(undertest.registry.get("slow").calls))
+
+    def test_concurrent_matches_serial(self):
+        serial = self.engine(jobs=1).resolve(self.properties)
+        concurrent = self.engine(jobs=4).resolve(self.properties)
+
+        self.assertEqual(list(serial.items()), list(concurrent.items()))
+
+    def test_concurrent_overlaps_independent_properties(self):
+        properties = dict(("p{}".format(i), "slow|{}".format(i)) for i in range(8))
+        undertest = self.engine(jobs=8, delay=0.2)
+
+        start = time.time()
+        resolved = undertest.resolve(properties)
+
+        self.assertLess(time.time() - start, 1.0)
+        self.assertEqual(list(properties.keys()), list(resolved.keys()))
+        self.assertEqual(8, len(undertest.registry.get("slow").calls))
+
+    def test_context(self):
+        undertest = self.engine(jobs=1)
+        resolved = undertest.resolve({"b": "slow|${a}b", "c": "slow|c"}, {"a": "base", "c": "overridden"})
+
+        self.assertEqual({"a": "base", "b": "baseb", "c": "c"}, resolved)
+
+    def test_identical_expressions_resolved_once(self):
+        for jobs in [1, 4]:
+            undertest = self.engine(jobs=jobs)
+            first = undertest.resolve({"ENVIRONMENT": "slow|dev", "a": "slow|${ENVIRONMENT}-a"})
+            second = undertest.resolve({"env": "slow|dev", "b": "slow|dev-a", "c": "slow|${env}-a"})
+
+            self.assertEqual({"ENVIRONMENT": "dev", "a": "dev-a"}, first)
+            self.assertEqual({"env": "dev", "b": "dev-a", "c": "dev-a"}, second)
+            self.assertEqual(["dev", "dev-a"], undertest.registry.get("slow").calls)
+
+    def test_nested_calls(self):
+        for jobs in [1, 4]:
+            undertest = self.engine(jobs=jobs)
+            resolved = undertest.resolve({
+                "env": "slow|dev",
+                "key": "slow|/${env}/${slow|${math|add|${n}|1}}/key",
+                "n": "string|1",
+            })
+
+            self.assertEqual("/dev/2.0/key", resolved["key"])
+            self.assertEqual(["/dev/2.0/key", "2.0", "dev"], sorted(undertest.registry.get("slow").calls))
+
+    def test_escaped(self):
+        undertest = self.engine(jobs=1)
+        resolved = undertest.resolve({
+            "a": "slow|x",
+            "pipe": "string|a\\|b",
+            "dollar": "string|$$a \\$a ${a}",
+            "brace": "slow|${string|\\}}",
+        })
+
+        self.assertEqual("a|b", resolved["pipe"])
+        self.assertEqual("$a $a x", resolved["dollar"])
+        self.assertEqual("}", resolved["brace"])
+
+
+class FailingResolver(BaseResolver):
+
+    def __init__(self):
+        super(FailingResolver, self).__init__()
+        self.calls = 0
+
+    def resolve(self, parts, current_properties):
+        self.calls += 1
+        raise ResolverError("Unable to lookup '{}'".format(parts[0]))
+
+
+class TestPropertyEngineCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def engine(self, stale_if_error=False):
+        cache = ResolverCache(self.directory, {"slow": 300, "failing": 300}, stale_if_error=stale_if_error)
+        registry = ResolverRegistry()
+        registry.register("slow", lambda: SlowResolver(0))
+        registry.register("failing", FailingResolver)
+        return PropertyEngine(registry, cache=cache)
+
+    def test_cached_between_runs(self):
+        first = self.engine()
+        self.assertEqual({"a": "a", "b": "ab"}, first.resolve({"a": "slow|a", "b": "slow|${a}b"}))
+        first.cache.save()
+
+        second = self.engine()
+        self.assertEqual({"a": "a", "b": "ab"}, second.resolve({"a": "slow|a", "b": "slow|${a}b"}))
+        self.assertEqual([], second.registry.get("slow").calls)
+
+    def test_error_without_stale(self):
+        undertest = self.engine()
+
+        self.assertEqual({"a": None}, undertest.resolve({"a": "failing|a"}))
+
+    def test_stale_if_error(self):
+        with open(os.path.join(self.directory, ResolverCache.FILE_NAME), "w") as cache_file:
+            json.dump({"instance_id": None, "entries": {"failing|a": {"time": 0, "value": "last known"}}}, cache_file)
+
+        undertest = self.engine(stale_if_error=True)
+
+        self.assertEqual({"a": "last known"}, undertest.resolve({"a": "failing|a"}))
+        self.assertEqual(1, undertest.registry.get("failing").calls)
@@ -0,0 +1,76 @@
+import unittest
+
+from configbutler.expressions import Call, Expression, ExpressionError, Reference, Text, bind, find_references, parse
+
+
+class TestParse(unittest.TestCase):
+
+    def test_arguments(self):
+        call = parse("aws|paramstore|/${app}/$env/key")
+
+        self.assertEqual("aws", call.name)
+        self.assertEqual(2, len(call.args))
+        self.assertEqual(["/", "app", "/", "env", "/key"],
+                         [node.text if isinstance(node, Text) else node.name for node in call.args[1]])
+        self.assertIsInstance(call.args[1][1], Reference)
+
+    def test_nested(self):
+        call = parse("string|${math|add|${a}|1}!")
+
+        nested = call.args[0][0]
+        self.assertIsInstance(nested, Call)
+        self.assertEqual("math", nested.name)
+        self.assertEqual("${math|add|${a}|1}", nested.source)
+        self.assertEqual("!", call.args[0][1].text)
+        self.assertEqual([nested], call.innermost())
+
+    def test_escapes(self):
+        call = parse("string|a\\|b \\$c \\\\ $$d \\n}")
+
+        self.assertEqual(1, len(call.args))
+        self.assertEqual("a|b $c \\ $d \\n}", call.args[0][0].text)
+
+    def test_not_placeholders(self):
+        self.assertEqual("$ ${not valid} ${", parse("string|$ ${not valid} ${").args[0][0].text)
+
+    def test_unterminated_call(self):
+        self.assertRaises(ExpressionError, parse, "string|${math|add|1|2")
+
+
+class TestBind(unittest.TestCase):
+
+    def test_references(self):
+        key, args = bind(parse("aws|paramstore|/${app}/${missing}"), {"app": "gar$den"})
+
+        self.assertEqual("aws|paramstore|/gar$den/${missing}", key)
+        self.assertEqual(["paramstore", "/gar$$den/${missing}"], args)
+
+    def test_escaped_key(self):
+        key, args = bind(parse("string|a\\|b"), {})
+
+        self.assertEqual("string|a\\|b", key)
+        self.assertEqual(["a|b"], args)
+
+    def test_nested(self):
+        call = parse("string|${math|add|${a}|1}")
+
+        self.assertEqual("string|${math|add|${a}|1}", bind(call, {"a": 1})[0])
+        self.assertEqual(("string|2", ["2"]), bind(call, {"a": 1}, lambda nested: 2))
+
+
+class TestExpression(unittest.TestCase):
+
+    def test_references(self):
+        expression = Expression("string|${a}${math|add|$b|${a}}")
+
+        self.assertEqual(["a", "b"], expression.references)
+        self.assertTrue(expression.nested)
+        self.assertEqual("string|1${math|add|$b|${a}}", expression.substitute({"a": 1}))
+
+    def test_text(self):
+        expression = Expression(u"string|caf\xe9 ${a}")
+
+        self.assertEqual(u"string|caf\xe9 ${a}", expression.value)
+        self.assertEqual(["a"], expression.references)
+        self.assertEqual(["a"], find_references(u"string|caf\xe9 ${a}"))
+        self.assertEqual("2", Expression(2).value)
@@ -0,0 +1,104 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import mock
+
+import configbutler.main
+from configbutler.fleet import FleetError, load_facts
+
+
+class TestLoadFacts(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, name, contents):
+        path = os.path.join(self.directory, name)
+        with open(path, "w") as facts:
+            facts.write(contents)
+        return path
+
+    def test_jsonl(self):
+        path = self.write("hosts.jsonl", '{"name": "web-1", "tags": {"Environment": "prod"}}\n\n{"name": "web-2", "host": {"hostname": "w2"}}\n')
+
+        web1, web2 = load_facts(path)
+        self.assertEqual({"Environment": "prod"}, web1.tags)
+        self.assertEqual({"hostname": "web-1"}, web1.host)
+        self.assertEqual({"hostname": "w2"}, web2.host)
+
+    def test_csv(self):
+        path = self.write("hosts.csv", "name,tags:aws:cloudformation:stack-name,metadata:instance_id\nweb-1,prod,i-1\nweb-2,,i-2\n")
+
+        web1, web2 = load_facts(path)
+        self.assertEqual({"aws:cloudformation:stack-name": "prod"}, web1.tags)
+        self.assertEqual({}, web2.tags)
+        self.assertEqual({"instance_id": "i-2"}, web2.metadata)
+
+    def test_invalid(self):
+        self.assertRaises(FleetError, load_facts, self.write("hosts.csv", "name,colour\nweb-1,red\n"))
+        self.assertRaises(FleetError, load_facts, self.write("hosts.jsonl", '{"name": "../web-1"}\n'))
+        self.assertRaises(FleetError, load_facts, self.write("hosts.jsonl", '{"name": "web-1"}\n{"name": "web-1"}\n'))
+
+
+class TestFleet(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.output = os.path.join(self.directory, "out")
+        config_dir = os.path.join(self.directory, "configbutler")
+        os.mkdir(config_dir)
+
+        with open(os.path.join(self.directory, "app.j2"), "w") as template:
+            template.write("{{ env }} {{ instance }} {{ name }} {{ heap }}")
+        with open(os.path.join(config_dir, "001-base.yaml"), "w") as config:
+            config.write("exports: [env]\nproperties:\n    env: aws|tags|Environment\n")
+        with open(os.path.join(config_dir, "002-app.yaml"), "w") as config:
+            config.write("""
+properties:
+    instance: aws|metadata|instance_id
+    name: host|hostname
+    heap: math|expr|${{host|total_memory}} // 2|int
+files:
+    - mode: jinja2
+      src: {}
+      dest: /etc/app/app.conf
+""".format(os.path.join(self.directory, "app.j2")))
+
+        self.facts = os.path.join(self.directory, "hosts.jsonl")
+        with open(self.facts, "w") as facts:
+            for number in range(6):
+                facts.write(json.dumps({
+                    "name": "web-{}".format(number),
+                    "tags": {"Environment": "prod" if number % 2 else "test"},
+                    "metadata": {"instance_id": "i-{}".format(number)},
+                    "host": {"total_memory": 1024 * (number + 1)},
+                }) + "\n")
+        self.config_dir = config_dir
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def rendered(self, name):
+        with open(os.path.join(self.output, name, "etc", "app", "app.conf")) as output:
+            return output.read()
+
+    @mock.patch("sys.stdout")
+    def test_render(self, mock_stdout):
+        for workers in ["1", "2"]:
+            result = configbutler.main.cli(["--fleet", self.facts, "--fleet-output", self.output, "--fleet-workers", workers,
+                                            self.config_dir])
+
+            self.assertEqual(0, result)
+            self.assertEqual("test i-0 web-0 512", self.rendered("web-0"))
+            self.assertEqual("prod i-5 web-5 3072", self.rendered("web-5"))
+            self.assertEqual(sorted("web-{}".format(number) for number in range(6)), sorted(os.listdir(self.output)))
+
+    @mock.patch("sys.stdout")
+    def test_missing_output(self, mock_stdout):
+        self.assertEqual(0, configbutler.main.cli(["--fleet", self.facts, self.config_dir]))
+        self.assertFalse(os.path.exists(self.output))
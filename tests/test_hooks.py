@@ -0,0 +1,97 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from configbutler.hooks import ChangeHooks
+
+
+class TestChangeHooks(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.log = os.path.join(self.directory, "hooks.log")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def read_log(self):
+        with open(self.log) as log:
+            return log.read().splitlines()
+
+    def test_nothing_changed(self):
+        hooks = ChangeHooks()
+        hooks.add(None, "/etc/app.conf")
+        self.assertEqual([], hooks.run())
+
+    def test_deduplicated(self):
+        hooks = ChangeHooks()
+        hooks.add("echo reload >> {}".format(self.log), "/etc/a.conf")
+        hooks.add(["echo reload >> {}".format(self.log)], "/etc/b.conf")
+
+        results = hooks.run()
+        self.assertEqual(1, len(results))
+        self.assertEqual(["/etc/a.conf", "/etc/b.conf"], results[0].outputs)
+        self.assertEqual(0, results[0].returncode)
+        self.assertEqual(["reload"], self.read_log())
+
+    def test_properties(self):
+        hooks = ChangeHooks()
+        hooks.add("echo ${service} $missing >> " + self.log, "/etc/a.conf", {"service": "tomcat"})
+        hooks.run()
+        self.assertEqual(["tomcat"], self.read_log())
+
+    def test_properties_quoted(self):
+        hooks = ChangeHooks()
+        hooks.add("echo ${service} >> " + self.log, "/etc/a.conf", {"service": "x; echo injected"})
+        hooks.run()
+        self.assertEqual(["x; echo injected"], self.read_log())
+
+    def test_ordered_within_list(self):
+        hooks = ChangeHooks()
+        hooks.add(["sleep 0.2 && echo check >> {0}".format(self.log), "echo reload >> {0}".format(self.log)], "/etc/a.conf")
+        hooks.run()
+        self.assertEqual(["check", "reload"], self.read_log())
+
+    def test_skipped_after_failure(self):
+        hooks = ChangeHooks()
+        hooks.add(["exit 1", "echo reload >> {}".format(self.log)], "/etc/a.conf")
+        hooks.add("echo other >> {}".format(self.log), "/etc/b.conf")
+
+        failed, skipped, other = hooks.run()
+        self.assertEqual(1, failed.returncode)
+        self.assertEqual("exit 1", skipped.skipped_for)
+        self.assertFalse(skipped.succeeded)
+        self.assertTrue(other.succeeded)
+        self.assertEqual(["other"], self.read_log())
+        self.assertEqual("Ran 'echo reload >> {}' for 1 changed file(s) - skipped as 'exit 1' failed".format(self.log), skipped.report())
+
+    def test_independent_in_parallel(self):
+        hooks = ChangeHooks()
+        hooks.add("sleep 0.5", "/etc/a.conf")
+        hooks.add("sleep 0.5 ", "/etc/b.conf")
+
+        start = time.time()
+        self.assertEqual([0, 0], [result.returncode for result in hooks.run()])
+        self.assertLess(time.time() - start, 0.9)
+
+    def test_timeout(self):
+        hooks = ChangeHooks(timeout=10)
+        hooks.add({"command": "sleep 5; true", "timeout": 0.2}, "/etc/a.conf")
+        hooks.add({"command": "sleep 5 | cat", "timeout": 0.2}, "/etc/b.conf")
+
+        start = time.time()
+        results = hooks.run()
+        self.assertLess(time.time() - start, 1)
+        for result in results:
+            self.assertTrue(result.timed_out)
+            self.assertFalse(result.succeeded)
+
+    def test_output(self):
+        hooks = ChangeHooks()
+        hooks.add("echo failed; exit 2", "/etc/a.conf")
+
+        result, = hooks.run()
+        self.assertEqual(2, result.returncode)
+        self.assertEqual("failed\n", result.output)
@@ -0,0 +1,108 @@
+import unittest
+import mock
+
+from fake_imds import FakeIMDS
+
+from configbutler.imds import InstanceMetadata, InstanceMetadataError
+from configbutler.resolvers import AWSClientPool, AWSInstanceMetadataResolver, AWSTagResolver
+
+
+class TestInstanceMetadata(unittest.TestCase):
+
+    def test_attributes(self):
+        with FakeIMDS() as imds:
+            undertest = InstanceMetadata(imds.url)
+
+            self.assertEqual("123456789012", undertest.account_id)
+            self.assertEqual("ap-southeast-2", undertest.region)
+            self.assertEqual(0, undertest.ami_launch_index)
+            self.assertEqual(["web", "ssh"], undertest.security_groups)
+            self.assertEqual("AIPA12345", undertest.instance_profile_id)
+            self.assertEqual("i-12345", undertest.instance_identity_document["instanceId"])
+            self.assertEqual(None, undertest.public_ipv4)
+
+    def test_snapshot_request_count(self):
+        with FakeIMDS() as imds:
+            undertest = InstanceMetadata(imds.url)
+            names = ["account_id", "region", "instance_id", "instance_type", "private_ipv4", "availability_zone"]
+
+            undertest.prefetch(names)
+            for name in names:
+                undertest.get(name)
+            undertest.get("instance_id")
+
+            # One token, then one request per distinct path: account_id and region share the identity document.
+            self.assertEqual(1, imds.requests.count(("PUT", "/latest/api/token")))
+            self.assertEqual(5, len([request for request in imds.requests if request[0] == "GET"]))
+            self.assertEqual(6, len(imds.requests))
+
+    def test_unreachable(self):
+        undertest = InstanceMetadata("http://127.0.0.1:1")
+
+        undertest.prefetch(["instance_id"])
+        with self.assertRaises(InstanceMetadataError):
+            undertest.get("instance_id")
+
+
+class TestAWSInstanceMetadataResolverSnapshot(unittest.TestCase):
+
+    def test_prefetch(self):
+        with FakeIMDS() as imds:
+            undertest = AWSInstanceMetadataResolver(AWSClientPool(metadata_url=imds.url))
+
+            undertest.prefetch(["instance_id", "instance_type", "blart"], None)
+            requests = len(imds.requests)
+
+            self.assertEqual("i-12345", undertest.resolve("instance_id", None))
+            self.assertEqual("t3.micro", undertest.resolve("instance_type", None))
+            self.assertEqual(3, requests)
+            self.assertEqual(requests, len(imds.requests))
+
+
+TAGGED_PATHS = {
+    "/latest/meta-data/instance-id": "i-12345",
+    "/latest/meta-data/tags/instance": "Name\naws:cloudformation:stack-name",
+    "/latest/meta-data/tags/instance/Name": "web",
+    "/latest/meta-data/tags/instance/aws%3Acloudformation%3Astack-name": "garden-test",
+}
+
+
+class TestInstanceMetadataTags(unittest.TestCase):
+
+    def test_enabled(self):
+        with FakeIMDS(TAGGED_PATHS) as imds:
+            undertest = InstanceMetadata(imds.url)
+
+            self.assertEqual({"Name": "web", "aws:cloudformation:stack-name": "garden-test"}, undertest.instance_tags())
+
+    def test_disabled(self):
+        with FakeIMDS() as imds:
+            undertest = InstanceMetadata(imds.url)
+
+            self.assertEqual(None, undertest.instance_tags())
+
+
+class TestAWSTagResolverMetadata(unittest.TestCase):
+
+    def test_tags_from_metadata(self):
+        with FakeIMDS(TAGGED_PATHS) as imds:
+            undertest = AWSTagResolver(AWSClientPool(metadata_url=imds.url))
+            undertest.client = mock.Mock()
+
+            self.assertEqual("garden-test", undertest.resolve("aws:cloudformation:stack-name", {}))
+            self.assertEqual("web", undertest.resolve("Name", {}))
+
+            self.assertEqual([], undertest.client.mock_calls)
+            self.assertEqual(4, len(imds.requests))
+
+    def test_falls_back_to_api(self):
+        with FakeIMDS() as imds:
+            undertest = AWSTagResolver(AWSClientPool(metadata_url=imds.url))
+            undertest.client = mock.Mock()
+            undertest.client.describe_tags.return_value = {"Tags": [{"Key": "Name", "Value": "web"}]}
+
+            self.assertEqual("web", undertest.resolve("Name", {}))
+
+            self.assertEqual([mock.call.describe_tags(Filters=[{'Name': 'resource-id', 'Values': ['i-12345']}])],
+                             undertest.client.mock_calls)
+            self.assertEqual(False, undertest.use_metadata)
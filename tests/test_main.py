@@ -1,4 +1,9 @@
+import json
+import os
+import shutil
+import tempfile
 import unittest
+import mock
 
 import configbutler.main
 
@@ -47,6 +52,21 @@ class TestArgsParser(unittest.TestCase):
         self.assertEqual("/tmp", config.entrypoint)
         self.assertEqual(False, config.show_properties)
         self.assertEqual(False, config.install_service)
+        self.assertEqual(1, config.jobs)
+
+    def test_jobs(self):
+        config = configbutler.main.parse_args(["--jobs", "8", "/tmp"])
+        self.assertEqual(8, config.jobs)
+
+
+class TestConfigFiles(unittest.TestCase):
+
+    @mock.patch("os.path.isfile", return_value=True)
+    @mock.patch("os.path.isdir", return_value=True)
+    @mock.patch("os.listdir", return_value=["020-web.yaml", "001-base.yaml", "010-app.yaml"])
+    def test_sorted(self, mock_listdir, mock_isdir, mock_isfile):
+        self.assertEqual(["/etc/configbutler/001-base.yaml", "/etc/configbutler/010-app.yaml", "/etc/configbutler/020-web.yaml"],
+                         configbutler.main.config_files("/etc/configbutler"))
 
 
 class TestProcess(unittest.TestCase):
@@ -59,3 +79,171 @@ class TestProcess(unittest.TestCase):
             configbutler.main.process(args)
 
         self.assertEqual("Path not found 'blart'", str(ex.exception))
+
+    @mock.patch("sys.stdout")
+    def test_unknown_dependency(self, mock_stdout):
+        directory = tempfile.mkdtemp()
+        try:
+            with open(os.path.join(directory, "001-app.yaml"), "w") as config:
+                config.write("depends_on: [000-base.yaml]\nproperties: {}\n")
+            args = configbutler.main.parse_args([directory])
+
+            with self.assertRaises(configbutler.main.ExpectedException) as ex:
+                configbutler.main.process(args)
+            self.assertEqual("Unknown dependency '000-base.yaml' of '{}'".format(os.path.join(directory, "001-app.yaml")),
+                             str(ex.exception))
+        finally:
+            shutil.rmtree(directory)
+
+    @mock.patch("sys.stdout")
+    def test_invalid_expression(self, mock_stdout):
+        directory = tempfile.mkdtemp()
+        try:
+            with open(os.path.join(directory, "001-app.yaml"), "w") as config:
+                config.write("properties:\n    total: string|${math|add|1|2\n")
+            args = configbutler.main.parse_args([directory])
+
+            with self.assertRaises(configbutler.main.ExpectedException) as ex:
+                configbutler.main.process(args)
+            self.assertEqual("Invalid property 'total' - Unterminated '${{' in 'string|${{math|add|1|2' in '{}'".format(
+                os.path.join(directory, "001-app.yaml")), str(ex.exception))
+        finally:
+            shutil.rmtree(directory)
+
+
+class TestProcessFiles(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.template = os.path.join(self.directory, "setenv.sh.j2")
+        self.dest = os.path.join(self.directory, "setenv.sh")
+        self.config = os.path.join(self.directory, "001-app.yaml")
+
+        with open(self.template, "w") as template:
+            template.write("export NAME={{ name }}\n")
+        with open(self.config, "w") as config:
+            config.write("""
+properties:
+    name: string|garden
+files:
+    - mode: jinja2
+      src: {}
+      dest: {}
+""".format(self.template, self.dest))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    @mock.patch("sys.stdout")
+    def test_detailed_exitcode(self, mock_stdout):
+        self.assertEqual(2, configbutler.main.cli(["--detailed-exitcode", self.config]))
+        self.assertEqual(0, configbutler.main.cli(["--detailed-exitcode", self.config]))
+
+        with open(self.dest) as written:
+            self.assertEqual("export NAME=garden", written.read())
+
+    @mock.patch("sys.stdout")
+    def test_jobs_bounded(self, mock_stdout):
+        # Properties are looked up on --jobs threads, so files are resolved one at a time.
+        with mock.patch("configbutler.main.run_pipeline", wraps=configbutler.main.run_pipeline) as mock_pipeline:
+            configbutler.main.process(configbutler.main.parse_args(["--jobs", "4", self.config]))
+
+        self.assertEqual(1, mock_pipeline.call_args[1]["workers"])
+
+    @mock.patch("sys.stdout")
+    def test_summary(self, mock_stdout):
+        args = configbutler.main.parse_args([self.config])
+
+        summary = configbutler.main.process(args)
+        self.assertEqual([self.dest], summary.changed)
+
+        summary = configbutler.main.process(args)
+        self.assertEqual([self.dest], summary.unchanged)
+
+    @mock.patch("sys.stdout")
+    def test_exports(self, mock_stdout):
+        config_dir = os.path.join(self.directory, "configbutler")
+        os.mkdir(config_dir)
+        with open(os.path.join(config_dir, "000-base.yaml"), "w") as config:
+            config.write("exports: [ENVIRONMENT]\nproperties:\n    ENVIRONMENT: string|prod\n    PRIVATE: string|base\n")
+        shutil.copy(self.config, config_dir)
+        with open(os.path.join(config_dir, "001-app.yaml"), "a") as config:
+            config.write("    - mode: jinja2\n      src: {}\n      dest: {}\n".format(
+                os.path.join(self.directory, "env.j2"), os.path.join(self.directory, "env")))
+        with open(os.path.join(self.directory, "env.j2"), "w") as template:
+            template.write("{{ ENVIRONMENT }} {{ PRIVATE is defined }}")
+
+        args = configbutler.main.parse_args([config_dir])
+        configbutler.main.process(args)
+
+        with open(os.path.join(self.directory, "env")) as written:
+            self.assertEqual("prod False", written.read())
+
+    @mock.patch("sys.stdout")
+    def test_trace_and_profile(self, mock_stdout):
+        trace = os.path.join(self.directory, "trace.json")
+        profile = os.path.join(self.directory, "run.prof")
+        configbutler.main.cli(["--trace", trace, "--profile", profile, self.config])
+
+        with open(trace) as trace_file:
+            events = json.load(trace_file)["traceEvents"]
+        self.assertEqual([("name", "property"), (self.dest, "render")], [(event["name"], event["cat"]) for event in events])
+        self.assertTrue(os.path.getsize(profile) > 0)
+
+    @mock.patch("sys.stdout")
+    def test_metrics_file(self, mock_stdout):
+        metrics = os.path.join(self.directory, "configbutler.prom")
+        configbutler.main.cli(["--metrics-file", metrics, self.config])
+
+        with open(metrics) as metrics_file:
+            rendered = metrics_file.read().splitlines()
+        self.assertIn('configbutler_resolver_calls_total{resolver="string",sub_resolver=""} 1', rendered)
+        self.assertIn('configbutler_files{state="changed"} 1', rendered)
+        self.assertIn('configbutler_run_success 1', rendered)
+
+    @mock.patch("sys.stdout")
+    def test_manifest_skips_render(self, mock_stdout):
+        args = configbutler.main.parse_args(["--cache-dir", os.path.join(self.directory, "cache"), self.config])
+        configbutler.main.process(args)
+
+        with mock.patch("jinja2.Environment.get_template", side_effect=AssertionError("rendered")):
+            summary = configbutler.main.process(args)
+        self.assertEqual([self.dest], summary.unchanged)
+
+        with open(self.template, "w") as template:
+            template.write("export NAME={{ name }}-2")
+        summary = configbutler.main.process(args)
+        self.assertEqual([self.dest], summary.changed)
+
+    @mock.patch("sys.stdout")
+    def test_large_output_streamed(self, mock_stdout):
+        try:
+            import tracemalloc
+        except ImportError:
+            self.skipTest("tracemalloc needs Python 3")
+
+        with open(self.template, "w") as template:
+            template.write("{% for i in range(100000) %}allow 10.0.{{ i }}.0/24;\n{% endfor %}")
+        args = configbutler.main.parse_args([self.config])
+        configbutler.main.process(args)
+
+        tracemalloc.start()
+        try:
+            configbutler.main.process(args)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        self.assertGreater(os.path.getsize(self.dest), 2000000)
+        self.assertLess(peak, 1000000)
+
+    @mock.patch("sys.stdout")
+    def test_on_change(self, mock_stdout):
+        log = os.path.join(self.directory, "hooks.log")
+        with open(self.config, "a") as config:
+            config.write("      on_change:\n        - echo reload ${{name}} >> {}\n        - exit 3\n".format(log))
+
+        self.assertEqual(1, configbutler.main.cli([self.config]))
+        self.assertEqual(0, configbutler.main.cli([self.config]))
+
+        with open(log) as hook_log:
+            self.assertEqual("reload garden\n", hook_log.read())
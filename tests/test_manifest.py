@@ -0,0 +1,75 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from jinja2 import Environment, FileSystemLoader
+
+from configbutler.manifest import Manifest, template_inputs
+
+
+class TestManifest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.template = os.path.join(self.directory, "app.conf.j2")
+        self.include = os.path.join(self.directory, "common.j2")
+        self.dest = os.path.join(self.directory, "app.conf")
+
+        self.write(self.template, "name={{ name }}\n{% include '" + self.include + "' %}")
+        self.write(self.include, "port={{ port }}")
+        self.write(self.dest, "name=garden\nport=80")
+
+        self.env = Environment(loader=FileSystemLoader('/'))
+        self.properties = {"name": "garden", "port": 80, "unused": "a"}
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    @staticmethod
+    def write(path, contents):
+        with open(path, "w") as out:
+            out.write(contents)
+
+    def recorded(self):
+        undertest = Manifest(os.path.join(self.directory, "cache"))
+        undertest.record(self.dest, "config", self.template, template_inputs(self.env, self.template), self.properties)
+        undertest.save()
+        return Manifest(undertest.directory)
+
+    def test_template_inputs(self):
+        templates, variables = template_inputs(self.env, self.template)
+
+        self.assertEqual(set([self.template, self.include]), set(templates.keys()))
+        self.assertEqual(set(["name", "port"]), variables)
+
+    def test_dynamic_include(self):
+        self.write(self.template, "{% include name %}")
+
+        self.assertEqual(None, template_inputs(self.env, self.template))
+
+    def test_current(self):
+        undertest = self.recorded()
+
+        self.assertEqual(True, undertest.current(self.dest, "config", self.template, self.properties))
+        self.assertEqual(True, undertest.current(self.dest, "config", self.template, dict(self.properties, unused="b")))
+
+    def test_changed_inputs(self):
+        undertest = self.recorded()
+
+        self.assertEqual(False, undertest.current("/other", "config", self.template, self.properties))
+        self.assertEqual(False, undertest.current(self.dest, "changed", self.template, self.properties))
+        self.assertEqual(False, undertest.current(self.dest, "config", self.include, self.properties))
+        self.assertEqual(False, undertest.current(self.dest, "config", self.template, dict(self.properties, port=81)))
+
+    def test_changed_include(self):
+        undertest = self.recorded()
+        self.write(self.include, "port={{ port }}\n")
+
+        self.assertEqual(False, undertest.current(self.dest, "config", self.template, self.properties))
+
+    def test_modified_output(self):
+        undertest = self.recorded()
+        self.write(self.dest, "edited")
+
+        self.assertEqual(False, undertest.current(self.dest, "config", self.template, self.properties))
@@ -29,3 +29,18 @@ class TestMathResolver(unittest.TestCase):
     #     undertest = MathResolver()
     #
     #     self.assertEqual(undertest.resolve(["add", "one", "2"], dict), 3.0)
+
+    def test_expr(self):
+        undertest = MathResolver()
+        self.assertEqual(6.0, undertest.resolve(["expr", "${mem} * 0.8 / 1024 // 1"], {"mem": "8000"}))
+
+    def test_expr_output(self):
+        undertest = MathResolver()
+        self.assertEqual(6, undertest.resolve(["expr", "8000 * 0.8 / 1024", "int"], {}))
+        self.assertEqual(2.0, undertest.resolve(["expr", "max(1, 2)", "float"], {}))
+        self.assertEqual(None, undertest.resolve(["expr", "1", "str"], {}))
+
+    def test_expr_invalid(self):
+        undertest = MathResolver()
+        self.assertEqual(None, undertest.resolve(["expr", "1 / 0"], {}))
+        self.assertEqual(None, undertest.resolve(["expr", "__import__('os')"], {}))
@@ -0,0 +1,83 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import boto3
+import mock
+from botocore.stub import Stubber
+
+from configbutler.engine import PropertyEngine
+from configbutler.metrics import RunMetrics
+from configbutler.output import RunSummary
+from configbutler.registry import ResolverRegistry
+from configbutler.resolvers import AWSClientPool
+
+
+class TestRunMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_aws_calls(self):
+        undertest = RunMetrics()
+        session = boto3.session.Session(region_name="ap-southeast-2", aws_access_key_id="key", aws_secret_access_key="secret")
+        pool = AWSClientPool(session=session, hooks=undertest.hooks())
+
+        client = pool.client("ssm")
+        with Stubber(client) as stubber:
+            stubber.add_response("get_parameter", {"Parameter": {"Name": "/a", "Value": "a"}}, {"Name": "/a"})
+            stubber.add_client_error("get_parameter", "ParameterNotFound")
+            client.get_parameter(Name="/a")
+            with self.assertRaises(Exception):
+                client.get_parameter(Name="/b")
+
+        rendered = undertest.render()
+        self.assertIn('configbutler_aws_api_calls_total{operation="GetParameter",service="ssm"} 2', rendered)
+        self.assertIn('configbutler_aws_api_errors_total{code="ParameterNotFound",operation="GetParameter",service="ssm"} 1', rendered)
+
+    def test_throttles(self):
+        undertest = RunMetrics()
+        operation = mock.Mock()
+        operation.name = "DescribeTags"
+        operation.service_model.service_name = "ec2"
+
+        handler = dict(undertest.hooks())["needs-retry"]
+        self.assertEqual(None, handler(operation=operation, response=(None, {"Error": {"Code": "RequestLimitExceeded"}})))
+        handler(operation=operation, response=(None, {"Error": {"Code": "RequestLimitExceeded"}}))
+        handler(operation=operation, response=(None, {"Tags": []}))
+        handler(operation=operation, response=None)
+
+        self.assertIn('configbutler_aws_api_throttles_total{operation="DescribeTags",service="ec2"} 2', undertest.render())
+
+    def test_resolvers_and_files(self):
+        undertest = RunMetrics()
+        engine = PropertyEngine(ResolverRegistry(), tracer=undertest.tracer)
+        engine.resolve({"a": "string|a", "b": "string|a", "c": "math|add|1|2"})
+
+        summary = RunSummary()
+        summary.record("/etc/a", True)
+        summary.record("/etc/b", False)
+        summary.skip("/etc/c")
+
+        rendered = undertest.render(summary).splitlines()
+        self.assertIn('configbutler_resolver_calls_total{resolver="string",sub_resolver=""} 1', rendered)
+        self.assertIn('configbutler_resolver_calls_total{resolver="math",sub_resolver=""} 1', rendered)
+        self.assertIn('configbutler_resolver_duration_seconds_bucket{le="+Inf",resolver="string",sub_resolver=""} 1', rendered)
+        self.assertIn('configbutler_resolver_duration_seconds_count{resolver="math",sub_resolver=""} 1', rendered)
+        self.assertIn('configbutler_cache_lookups_total{outcome="memo"} 1', rendered)
+        self.assertIn('configbutler_files{state="rendered"} 2', rendered)
+        self.assertIn('configbutler_files{state="skipped"} 1', rendered)
+        self.assertIn('configbutler_files{state="unchanged"} 2', rendered)
+        self.assertIn('configbutler_run_success 1', rendered)
+
+    def test_write(self):
+        path = os.path.join(self.directory, "configbutler.prom")
+        RunMetrics().write(path, success=False)
+
+        self.assertEqual(["configbutler.prom"], os.listdir(self.directory))
+        with open(path) as metrics_file:
+            self.assertIn("configbutler_run_success 0\n", metrics_file.read())
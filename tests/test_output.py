@@ -0,0 +1,102 @@
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+
+from configbutler.output import RunSummary, file_digest, stream_file, write_file
+
+
+class TestWriteFile(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.dest = os.path.join(self.directory, "setenv.sh")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_new_file(self):
+        self.assertEqual(True, write_file(self.dest, "export A=1\n"))
+
+        with open(self.dest) as written:
+            self.assertEqual("export A=1\n", written.read())
+        self.assertEqual(["setenv.sh"], os.listdir(self.directory))
+
+    def test_unchanged_not_rewritten(self):
+        write_file(self.dest, "export A=1\n")
+        os.utime(self.dest, (1000, 1000))
+
+        self.assertEqual(False, write_file(self.dest, "export A=1\n"))
+        self.assertEqual(1000, os.stat(self.dest).st_mtime)
+
+    def test_changed_keeps_mode(self):
+        write_file(self.dest, "export A=1\n")
+        os.chmod(self.dest, 0o750)
+
+        self.assertEqual(True, write_file(self.dest, "export A=2\n"))
+
+        self.assertEqual(0o750, stat.S_IMODE(os.stat(self.dest).st_mode))
+        with open(self.dest) as written:
+            self.assertEqual("export A=2\n", written.read())
+        self.assertEqual(["setenv.sh"], os.listdir(self.directory))
+
+    def test_symlink_written_through(self):
+        target = os.path.join(self.directory, "real.conf")
+        write_file(target, "old\n")
+        os.symlink(target, self.dest)
+
+        self.assertEqual(True, stream_file(self.dest, iter(["new\n"])))
+        self.assertTrue(os.path.islink(self.dest))
+        with open(target) as written:
+            self.assertEqual("new\n", written.read())
+        self.assertEqual(False, write_file(self.dest, "new\n"))
+        self.assertEqual(True, write_file(self.dest, "newer\n"))
+        self.assertTrue(os.path.islink(self.dest))
+        self.assertEqual(["real.conf", "setenv.sh"], sorted(os.listdir(self.directory)))
+
+    def test_stream(self):
+        self.assertEqual(True, stream_file(self.dest, iter(["export ", "A=1", "\n"])))
+        os.utime(self.dest, (1000, 1000))
+
+        self.assertEqual(False, stream_file(self.dest, iter(["export A=1\n"])))
+        self.assertEqual(1000, os.stat(self.dest).st_mtime)
+        self.assertEqual(["setenv.sh"], os.listdir(self.directory))
+
+        self.assertEqual(True, stream_file(self.dest, iter(["export A=2\n"])))
+        with open(self.dest) as written:
+            self.assertEqual("export A=2\n", written.read())
+
+    def test_stream_failure_keeps_file(self):
+        write_file(self.dest, "export A=1\n")
+
+        def chunks():
+            yield "export A="
+            raise ValueError("undefined")
+
+        self.assertRaises(ValueError, stream_file, self.dest, chunks())
+        with open(self.dest) as written:
+            self.assertEqual("export A=1\n", written.read())
+        self.assertEqual(["setenv.sh"], os.listdir(self.directory))
+
+    def test_digest_missing(self):
+        self.assertEqual(None, file_digest(self.dest))
+
+
+class TestRunSummary(unittest.TestCase):
+
+    def test_report(self):
+        undertest = RunSummary()
+        undertest.record("/a", True)
+        undertest.record("/b", False)
+        undertest.record("/c", False)
+
+        self.assertEqual("Changed '/a'\n1 file(s) changed, 2 unchanged", undertest.report())
+
+    def test_skipped(self):
+        undertest = RunSummary()
+        undertest.record("/a", False)
+        undertest.skip("/b")
+
+        self.assertEqual(["/b"], undertest.skipped)
+        self.assertEqual("0 file(s) changed, 2 unchanged", undertest.report())
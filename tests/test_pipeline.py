@@ -0,0 +1,120 @@
+import threading
+import time
+import unittest
+
+from configbutler.pipeline import PipelineError, exported_properties, run_pipeline
+
+
+class TestPipeline(unittest.TestCase):
+
+    def run_files(self, configs, resolve=None, workers=4):
+        if resolve is None:
+            def resolve(filename, config, dependencies):
+                return config['value']
+        return list(run_pipeline(sorted(configs), lambda filename: configs[filename], resolve, workers=workers))
+
+    def test_order(self):
+        configs = {
+            "/etc/configbutler/b.yaml": {"value": "b"},
+            "/etc/configbutler/a.yaml": {"value": "a"},
+            "/etc/configbutler/c.yaml": {"value": "c"},
+        }
+
+        def resolve(filename, config, dependencies):
+            # the first file is the slowest to resolve, but is still returned first
+            if config['value'] == "a":
+                time.sleep(0.1)
+            return config['value']
+
+        results = self.run_files(configs, resolve)
+        self.assertEqual(["a", "b", "c"], [resolved for _, _, resolved in results])
+        self.assertEqual("/etc/configbutler/a.yaml", results[0][0])
+
+    def test_depends_on(self):
+        configs = {
+            "/etc/configbutler/a.yaml": {"value": "a", "depends_on": ["b.yaml"]},
+            "/etc/configbutler/b.yaml": {"value": "b"},
+        }
+        finished = []
+        lock = threading.Lock()
+
+        def resolve(filename, config, dependencies):
+            if config['value'] == "b":
+                time.sleep(0.1)
+            with lock:
+                finished.append(config['value'])
+            return config['value']
+
+        results = self.run_files(configs, resolve)
+        self.assertEqual(["b", "a"], finished)
+        self.assertEqual(["a", "b"], [resolved for _, _, resolved in results])
+
+    def test_single_worker(self):
+        configs = {
+            "/etc/configbutler/a.yaml": {"value": "a", "depends_on": "c.yaml"},
+            "/etc/configbutler/b.yaml": {"value": "b", "depends_on": ["a.yaml"]},
+            "/etc/configbutler/c.yaml": {"value": "c"},
+        }
+
+        results = self.run_files(configs, workers=1)
+        self.assertEqual(["a", "b", "c"], [resolved for _, _, resolved in results])
+
+    def test_unknown_dependency(self):
+        configs = {
+            "/etc/configbutler/a.yaml": {"value": "a", "depends_on": ["missing.yaml"]},
+        }
+
+        with self.assertRaises(PipelineError) as ex:
+            self.run_files(configs)
+        self.assertEqual("Unknown dependency 'missing.yaml' of '/etc/configbutler/a.yaml'", str(ex.exception))
+
+    def test_circular_dependency(self):
+        configs = {
+            "/etc/configbutler/a.yaml": {"value": "a", "depends_on": ["b.yaml"]},
+            "/etc/configbutler/b.yaml": {"value": "b", "depends_on": ["a.yaml"]},
+        }
+
+        with self.assertRaises(PipelineError) as ex:
+            self.run_files(configs)
+        self.assertEqual("Circular service dependency (a.yaml -> b.yaml -> a.yaml)", str(ex.exception))
+
+    def test_failure_propagates(self):
+        configs = {
+            "/etc/configbutler/a.yaml": {"value": "a"},
+            "/etc/configbutler/b.yaml": {"value": "b", "depends_on": ["a.yaml"]},
+            "/etc/configbutler/c.yaml": {"value": "c", "depends_on": ["b.yaml"]},
+        }
+
+        def resolve(filename, config, dependencies):
+            if config['value'] == "a":
+                raise ValueError("broken")
+            return config['value']
+
+        pipeline = run_pipeline(sorted(configs), lambda filename: configs[filename], resolve, workers=2)
+        with self.assertRaises(ValueError):
+            next(pipeline)
+
+    def test_exports(self):
+        configs = {
+            "/etc/configbutler/a.yaml": {"value": "a", "exports": ["ENVIRONMENT"]},
+            "/etc/configbutler/b.yaml": {"value": "b"},
+            "/etc/configbutler/c.yaml": {"value": "c", "exports": "ENVIRONMENT"},
+            "/etc/configbutler/d.yaml": {"value": "d"},
+        }
+        seen = dict()
+
+        def resolve(filename, config, dependencies):
+            seen[config['value']] = [dependency['value'] for dependency, _ in dependencies]
+            return {"ENVIRONMENT": config['value'], "PRIVATE": config['value']}
+
+        self.run_files(configs, resolve)
+        self.assertEqual({"a": [], "b": ["a"], "c": ["a"], "d": ["a", "c"]}, seen)
+
+    def test_exported_properties(self):
+        dependencies = [
+            ({"exports": ["ENVIRONMENT", "REGION"]}, {"ENVIRONMENT": "dev", "REGION": "ap-southeast-2", "PRIVATE": "a"}),
+            ({"exports": ["ENVIRONMENT", "UNDEFINED"]}, {"ENVIRONMENT": "prod"}),
+            ({}, {"PRIVATE": "c"}),
+        ]
+
+        self.assertEqual({"ENVIRONMENT": "prod", "REGION": "ap-southeast-2"}, exported_properties(dependencies))
@@ -3,6 +3,8 @@ import mock
 import yaml
 
 from configbutler.main import resolve_properties
+from configbutler.engine import PropertyEngine
+from configbutler.registry import ResolverRegistry
 
 
 class TestAWSInstanceMetadataResolver(unittest.TestCase):
@@ -52,3 +54,41 @@ properties:
 
         self.assertEqual(properties["the"], "the end")
         self.assertEqual(properties["end"], "end")
+
+    def test_cycle(self):
+
+        args = mock.Mock()
+
+        undertest = """
+properties:
+    a: string|a${b}
+    b: string|b${a}
+"""
+        properties = resolve_properties(args, yaml.safe_load(undertest))
+
+        self.assertEqual(properties["a"], "a${b}")
+        self.assertEqual(properties["b"], "ba${b}")
+
+    def test_paramstore_batched(self):
+
+        args = mock.Mock()
+        registry = ResolverRegistry()
+        client = registry.get("aws").paramstore_resolver.client = mock.Mock()
+        client.get_parameters.return_value = {
+            "Parameters": [{"Name": "/garden/test/a", "Value": "1"}, {"Name": "/garden/test/b", "Value": "2"}],
+            "InvalidParameters": [],
+        }
+
+        undertest = """
+properties:
+    app: string|garden
+    a: aws|paramstore|/${app}/${env}/a
+    b: aws|paramstore|/${app}/${env}/b
+    env: string|test
+"""
+        properties = resolve_properties(args, yaml.safe_load(undertest), PropertyEngine(registry))
+
+        self.assertEqual(properties["a"], "1")
+        self.assertEqual(properties["b"], "2")
+        self.assertEqual([mock.call.get_parameters(Names=["/garden/test/a", "/garden/test/b"], WithDecryption=True)],
+                         client.mock_calls)
@@ -0,0 +1,59 @@
+import unittest
+import mock
+
+from configbutler.registry import ResolverRegistry
+from configbutler.resolvers import AWSClientPool, StringResolver
+
+
+class TestResolverRegistry(unittest.TestCase):
+
+    def test_invalid(self):
+        undertest = ResolverRegistry()
+        undertest.plugins = dict()
+
+        self.assertEqual(None, undertest.get("blart"))
+
+    def test_resolver_shared_across_lookups(self):
+        undertest = ResolverRegistry()
+
+        self.assertIs(undertest.get("aws"), undertest.get("aws"))
+        self.assertIs(undertest.get("string"), undertest.get("string"))
+
+    def test_aws_resolvers_share_client_pool(self):
+        undertest = ResolverRegistry()
+        aws = undertest.get("aws")
+
+        self.assertIs(undertest.aws, aws.tags_resolver.aws)
+        self.assertIs(undertest.aws, aws.paramstore_resolver.aws)
+        self.assertIs(undertest.aws, aws.metadata_resolver.aws)
+
+    def test_register(self):
+        undertest = ResolverRegistry()
+        undertest.register("blart", StringResolver)
+
+        self.assertIsInstance(undertest.get("blart"), StringResolver)
+
+    @mock.patch("configbutler.registry._entry_points")
+    def test_entry_point(self, mock_entry_points):
+        entry_point = mock.Mock()
+        entry_point.load.return_value = StringResolver
+        mock_entry_points.return_value = {"blart": entry_point}
+
+        undertest = ResolverRegistry()
+
+        self.assertIsInstance(undertest.get("blart"), StringResolver)
+        self.assertIs(undertest.get("blart"), undertest.get("blart"))
+        self.assertEqual([mock.call()], entry_point.load.mock_calls)
+        self.assertEqual([mock.call()], mock_entry_points.mock_calls)
+
+
+class TestAWSClientPool(unittest.TestCase):
+
+    def test_clients_built_once(self):
+        session = mock.Mock()
+        undertest = AWSClientPool(session)
+
+        self.assertIs(undertest.client("ssm"), undertest.client("ssm"))
+        undertest.client("ec2")
+
+        self.assertEqual([mock.call("ssm"), mock.call("ec2")], session.client.mock_calls)
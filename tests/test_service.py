@@ -0,0 +1,118 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+import mock
+
+import configbutler.main
+from fake_imds import FakeIMDS
+from configbutler.service import ConvergenceDaemon, install_service, send_command
+
+
+class TestConvergenceDaemon(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.template = os.path.join(self.directory, "setenv.sh.j2")
+        self.dest = os.path.join(self.directory, "setenv.sh")
+        self.config = os.path.join(self.directory, "001-app.yaml")
+        self.socket = os.path.join(self.directory, "control.sock")
+
+        with open(self.template, "w") as template:
+            template.write("export NAME={{ name }}")
+        with open(self.config, "w") as config:
+            config.write("""
+properties:
+    name: string|garden
+files:
+    - mode: jinja2
+      src: {}
+      dest: {}
+""".format(self.template, self.dest))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    @mock.patch("sys.stdout")
+    def test_converge_renders_only_changed(self, mock_stdout):
+        undertest = ConvergenceDaemon(configbutler.main.parse_args([self.config]))
+
+        self.assertEqual([self.dest], undertest.converge().changed)
+        with mock.patch.object(undertest.state.registry, "refresh") as mock_refresh:
+            summary = undertest.converge()
+            mock_refresh.assert_called_once_with()
+        self.assertEqual([self.dest], summary.skipped)
+
+        with open(self.template, "w") as template:
+            template.write("export NAME={{ name }}-2")
+        self.assertEqual([self.dest], undertest.converge().changed)
+        self.assertEqual(3, undertest.status()["runs"])
+
+    @mock.patch("sys.stdout")
+    def test_converge_reads_instance_action_again(self, mock_stdout):
+        with open(self.config, "w") as config:
+            config.write("""
+properties:
+    name: aws|metadata|instance_action
+    instance: aws|metadata|instance_id
+files:
+    - mode: jinja2
+      src: {}
+      dest: {}
+""".format(self.template, self.dest))
+
+        with FakeIMDS() as imds:
+            imds.paths["/latest/meta-data/instance-action"] = "none"
+            undertest = ConvergenceDaemon(configbutler.main.parse_args([self.config]))
+            undertest.state.registry.aws.metadata_url = imds.url
+
+            self.assertEqual([self.dest], undertest.converge().changed)
+            imds.paths["/latest/meta-data/instance-action"] = "reboot"
+            self.assertEqual([self.dest], undertest.converge().changed)
+
+            with open(self.dest) as rendered:
+                self.assertEqual("export NAME=reboot", rendered.read())
+            self.assertEqual(2, imds.requests.count(("GET", "/latest/meta-data/instance-action")))
+            self.assertEqual(1, imds.requests.count(("GET", "/latest/meta-data/instance-id")))
+
+    @mock.patch("sys.stdout")
+    def test_control_socket(self, mock_stdout):
+        undertest = ConvergenceDaemon(configbutler.main.parse_args([self.config]), interval=60, socket_path=self.socket)
+        thread = threading.Thread(target=undertest.serve_forever)
+        thread.start()
+        try:
+            for _ in range(100):
+                if os.path.exists(self.socket) and undertest.runs > 0:
+                    break
+                time.sleep(0.02)
+
+            self.assertEqual(0o600, os.stat(self.socket).st_mode & 0o777)
+            self.assertEqual(1, json.loads(send_command(self.socket, "status", timeout=5))["runs"])
+            self.assertEqual("0 file(s) changed, 1 unchanged", send_command(self.socket, "run", timeout=5))
+            self.assertEqual("Unknown command 'blart'", send_command(self.socket, "blart", timeout=5))
+            self.assertEqual("Stopping", send_command(self.socket, "stop", timeout=5))
+        finally:
+            undertest.stop()
+            thread.join(5)
+
+        self.assertFalse(thread.is_alive())
+        self.assertFalse(os.path.exists(self.socket))
+
+
+class TestInstallService(unittest.TestCase):
+
+    @mock.patch("sys.stdout")
+    def test_unit(self, mock_stdout):
+        directory = tempfile.mkdtemp()
+        try:
+            unit_path = os.path.join(directory, "configbutler.service")
+            install_service(configbutler.main.parse_args(["--control-socket", "/run/cb.sock", "/etc/configbutler"]), unit_path)
+
+            with open(unit_path) as unit:
+                self.assertIn("--daemon --control-socket /run/cb.sock /etc/configbutler\n", unit.read())
+        finally:
+            shutil.rmtree(directory)
@@ -0,0 +1,39 @@
+import json
+import subprocess
+import sys
+import unittest
+
+# Generous enough for a slow CI host, but far below the cost of importing boto3 and jinja2.
+IMPORT_BUDGET = 0.5
+
+HEAVY_MODULES = ["boto3", "botocore", "jinja2", "psutil"]
+
+SCRIPT = """
+import json, sys, time
+start = time.time()
+import configbutler.main
+elapsed = time.time() - start
+
+from configbutler.engine import PropertyEngine
+from configbutler.registry import ResolverRegistry
+PropertyEngine(ResolverRegistry()).resolve({"name": "string|garden", "host": "host|hostname", "sum": "math|add|1|2"})
+
+print(json.dumps({"elapsed": elapsed, "loaded": [name for name in %r if name in sys.modules]}))
+""" % (HEAVY_MODULES,)
+
+
+class TestStartup(unittest.TestCase):
+
+    def run_script(self):
+        # A fresh interpreter, so nothing imported by other tests is already loaded.
+        output = subprocess.check_output([sys.executable, "-c", SCRIPT])
+        return json.loads(output.decode("utf-8").strip().splitlines()[-1])
+
+    def test_heavy_dependencies_not_loaded(self):
+        self.assertEqual([], self.run_script()["loaded"])
+
+    def test_import_budget(self):
+        # Best of a few runs, to ignore a cold filesystem cache.
+        elapsed = min(self.run_script()["elapsed"] for _ in range(3))
+
+        self.assertLess(elapsed, IMPORT_BUDGET)
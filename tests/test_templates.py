@@ -0,0 +1,66 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from configbutler.templates import TemplateEnvironment, compile_templates, shared_environment, template_names
+
+
+class TestTemplates(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.directory, "test"))
+        os.makedirs(os.path.join(self.directory, "prod"))
+
+        self.template = os.path.join(self.directory, "app.conf.j2")
+        self.include = os.path.join(self.directory, "common.j2")
+        self.write(self.template, "name={{ name }}\n{% include '" + self.include + "' %}")
+        self.write(self.include, "port={{ port }}")
+        self.write(os.path.join(self.directory, "test", "env.j2"), "test")
+        self.write(os.path.join(self.directory, "prod", "env.j2"), "prod")
+
+        self.archive = os.path.join(self.directory, "templates.zip")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    @staticmethod
+    def write(path, contents):
+        with open(path, "w") as out:
+            out.write(contents)
+
+    def test_template_names(self):
+        self.assertEqual([self.template], template_names(self.template))
+        self.assertEqual([os.path.join(self.directory, "prod", "env.j2"), os.path.join(self.directory, "test", "env.j2")],
+                         template_names(os.path.join(self.directory, "${ENVIRONMENT}", "env.j2")))
+
+    def test_relative_template_names(self):
+        relative = os.path.relpath(os.path.join(self.directory, "$ENVIRONMENT", "env.j2"), "/")
+
+        self.assertEqual([os.path.relpath(os.path.join(self.directory, "prod", "env.j2"), "/"),
+                          os.path.relpath(os.path.join(self.directory, "test", "env.j2"), "/")],
+                         template_names(relative))
+
+    def test_compile_and_load_precompiled(self):
+        configs = [{"files": [{"src": self.template}, {"src": os.path.join(self.directory, "${ENVIRONMENT}", "env.j2")}]}]
+
+        names = compile_templates(configs, self.archive)
+        self.assertEqual(4, len(names))
+
+        # The archive is used even once the sources are gone.
+        os.remove(self.template)
+        os.remove(self.include)
+
+        undertest = TemplateEnvironment(archive=self.archive)
+        self.assertEqual("name=garden\nport=80", undertest.get_template(self.template).render(name="garden", port=80))
+
+    def test_bytecode_cache(self):
+        cache_dir = os.path.join(self.directory, "cache")
+
+        TemplateEnvironment(cache_dir=cache_dir).get_template(self.template)
+
+        self.assertEqual(1, len(os.listdir(os.path.join(cache_dir, "jinja"))))
+
+    def test_shared(self):
+        self.assertIs(shared_environment(), shared_environment())
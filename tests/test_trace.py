@@ -0,0 +1,94 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from configbutler.engine import PropertyEngine
+from configbutler.registry import ResolverRegistry
+from configbutler.resolvers import AWSResolver, BaseResolver
+from configbutler.trace import Tracer, annotate
+
+
+class SleepResolver(BaseResolver):
+
+    def resolve(self, parts, current_properties):
+        time.sleep(float(parts[0]))
+        annotate(slept=parts[0])
+        return self.resolve_embedded(parts[1], current_properties)
+
+
+class TestTracer(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_span(self):
+        undertest = Tracer()
+        with undertest.span("outer", "test", {"a": 1}):
+            with undertest.span("inner", "test"):
+                annotate(b=2)
+            annotate(c=3)
+        annotate(ignored=True)
+
+        path = os.path.join(self.directory, "trace.json")
+        undertest.save(path)
+        with open(path) as trace_file:
+            events = json.load(trace_file)["traceEvents"]
+
+        self.assertEqual(["outer", "inner"], [event["name"] for event in events])
+        self.assertEqual({"a": 1, "c": 3}, events[0]["args"])
+        self.assertEqual({"b": 2}, events[1]["args"])
+        self.assertEqual("X", events[0]["ph"])
+        self.assertGreaterEqual(events[0]["dur"], events[1]["dur"])
+
+    def engine(self, tracer, jobs=1):
+        aws = AWSResolver()
+        aws.tags_resolver.tags = {"a": "tagged"}
+        registry = ResolverRegistry()
+        registry.register("sleep", SleepResolver)
+        registry.register("aws", lambda: aws)
+        return PropertyEngine(registry, jobs=jobs, tracer=tracer)
+
+    def test_property_spans(self):
+        tracer = Tracer()
+        self.engine(tracer).resolve({"a": "sleep|0|a", "b": "aws|tags|${a}"}, source="001-app.yaml")
+
+        spans = dict((event["name"], event["args"]) for event in tracer.events if event["cat"] == "property")
+        self.assertEqual({
+            "property": "a",
+            "file": "001-app.yaml",
+            "expression": "sleep|0|a",
+            "resolver": "sleep",
+            "sub_resolver": None,
+            "key": "0|a",
+            "pass": 0,
+            "safe_mode": False,
+            "references": [],
+            "slept": "0",
+        }, spans["a"])
+        self.assertEqual("tags", spans["b"]["sub_resolver"])
+        self.assertEqual("a", spans["b"]["key"])
+        self.assertEqual(1, spans["b"]["pass"])
+
+    def test_critical_path(self):
+        for jobs in [1, 4]:
+            tracer = Tracer()
+            engine = self.engine(tracer, jobs)
+            engine.resolve({"ENVIRONMENT": "sleep|0.1|prod"}, source="001-base.yaml")
+            engine.resolve({
+                "quick": "sleep|0|quick",
+                "slow": "sleep|0.05|${ENVIRONMENT}",
+                "last": "sleep|0|${quick}${slow}",
+            }, {"ENVIRONMENT": "prod"}, source="010-app.yaml")
+
+            chain = [(event["args"]["file"], event["name"]) for event in tracer.critical_path()]
+            self.assertEqual([("001-base.yaml", "ENVIRONMENT"), ("010-app.yaml", "slow"), ("010-app.yaml", "last")], chain)
+
+            summary = tracer.summary().splitlines()
+            self.assertTrue(summary[0].startswith("Critical path"))
+            self.assertIn("001-base.yaml ENVIRONMENT = sleep|0.1|prod", summary[1])